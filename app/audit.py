@@ -0,0 +1,417 @@
+# -*- coding: utf-8 -*-
+# =============================================
+# Audit log (user history) writer. Requests put
+# their records in a bounded in-process queue and
+# a background worker inserts them in batches, so
+# that responses don't wait for Postgres. Records
+# are also appended to a local spool file and kept
+# there until they are in the database, surviving
+# crashes and outages.
+# =============================================
+import asyncio
+import fcntl
+import json
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from loguru import logger
+from tortoise import timezone
+
+from app.config import (
+    AUDIT_QUEUE_MAX_SIZE,
+    AUDIT_BATCH_SIZE,
+    AUDIT_FLUSH_INTERVAL,
+    AUDIT_SHUTDOWN_TIMEOUT,
+    AUDIT_SPOOL_DIR,
+    AUDIT_SPOOL_REPLAY_INTERVAL,
+)
+from app.metrics import Counter, Gauge, Histogram, on_collect
+from app.models import UserHistory
+
+audit_queue_depth = Gauge(
+    "hci_audit_queue_depth",
+    "Audit records waiting to be written",
+)
+audit_written_records = Counter(
+    "hci_audit_written_records_total",
+    "Audit records written to the database",
+)
+audit_dropped_records = Counter(
+    "hci_audit_dropped_records_total",
+    "Audit records lost, by reason (queue_full, write_error or shutdown)",
+)
+audit_flush_seconds = Histogram(
+    "hci_audit_flush_seconds",
+    "Time taken to write a batch of audit records",
+)
+audit_spool_segments = Gauge(
+    "hci_audit_spool_segments",
+    "Audit spool files holding records that may not be in the database yet",
+)
+audit_replayed_records = Counter(
+    "hci_audit_replayed_records_total",
+    "Audit records written to the database from spool files",
+)
+
+HISTORY_FIELDS = (
+    "id",
+    "user_id",
+    "method",
+    "path",
+    "query_params",
+    "body",
+    "status_code",
+    "timestamp",
+)
+
+
+def _history_to_line(history: UserHistory) -> bytes:
+    data = {field: getattr(history, field) for field in HISTORY_FIELDS}
+    data["id"] = str(data["id"])
+    data["timestamp"] = data["timestamp"].isoformat()
+    return json.dumps(data).encode() + b"\n"
+
+
+def _history_from_line(line: bytes) -> UserHistory:
+    data = json.loads(line)
+    data["timestamp"] = datetime.fromisoformat(data["timestamp"])
+    return UserHistory(**data)
+
+
+class SpoolSegment:
+    """
+    A spool file, locked for as long as it is open, so that other processes sharing the
+    spool directory don't replay it.
+    """
+
+    def __init__(self, path: Path, fd: int):
+        self.path = path
+        self.fd = fd
+        # False when records of this file were left out of the queue, which then can't
+        # tell whether the whole file is in the database
+        self.complete = True
+
+    def read(self) -> List[UserHistory]:
+        records = []
+        with open(self.fd, "rb", closefd=False) as file:
+            file.seek(0)
+            for number, line in enumerate(file, start=1):
+                try:
+                    records.append(_history_from_line(line))
+                except Exception as e:
+                    # The last line is partial when the process died while writing it
+                    logger.warning(f"Skipping line {number} of {self.path}: {e}")
+        return records
+
+    def release(self) -> None:
+        os.close(self.fd)
+
+    def remove(self) -> None:
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+        self.release()
+
+
+class AuditSpool:
+    """
+    Append-only files holding audit records until they are in the database. Records are
+    appended to the current file as they are queued, and are on disk when the append
+    returns; the worker starts a new file for every batch and removes the previous one once
+    its batch is written.
+    Args:
+        directory (str): Where the files are kept. It must outlive the process (a volume,
+            not the container filesystem) for records to survive a crash.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self._segment: Optional[SpoolSegment] = None
+
+    def _new_segment(self) -> SpoolSegment:
+        path = self.directory / f"{time.time_ns():020d}-{os.getpid()}.jsonl"
+        # Every append is synced, so a record is not lost once `record` returns
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND | os.O_DSYNC, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # The new file's directory entry must be on disk too
+        directory_fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+        return SpoolSegment(path, fd)
+
+    def open(self) -> None:
+        if self._segment is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._segment = self._new_segment()
+
+    def append(self, history: UserHistory, complete: bool = True) -> None:
+        line = _history_to_line(history)
+        if os.write(self._segment.fd, line) != len(line):
+            raise OSError(f"Short write to {self._segment.path}")
+        self._segment.complete = self._segment.complete and complete
+
+    def rotate(self) -> SpoolSegment:
+        """
+        Starts a new file and returns the previous one.
+        """
+        segment, self._segment = self._segment, self._new_segment()
+        return segment
+
+    def close(self) -> None:
+        if self._segment is None:
+            return
+        segment, self._segment = self._segment, None
+        if os.fstat(segment.fd).st_size == 0:
+            segment.remove()
+        else:
+            segment.release()
+
+    def pending(self) -> List[Path]:
+        """
+        The files left by earlier batches or processes, oldest first.
+        """
+        if not self.directory.is_dir():
+            return []
+        current = self._segment.path if self._segment else None
+        return sorted(path for path in self.directory.glob("*.jsonl") if path != current)
+
+    def claim(self, path: Path) -> Optional[SpoolSegment]:
+        """
+        Opens and locks a pending file, or returns None if another process holds it.
+        """
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return SpoolSegment(path, fd)
+
+
+class AuditWriter:
+    """
+    Writes `UserHistory` records in batches of up to `batch_size`, or whatever arrived in
+    the `flush_interval` seconds after the first record of the batch. While the worker is
+    not running (as in scripts, or during shutdown), records are written right away.
+
+    With a spool directory, each record is synced to the spool file before `record` returns,
+    and files whose insert failed are inserted again on startup and every `replay_interval`
+    seconds until the database takes them. Inserts ignore records that are already there, so
+    a file may be replayed more than once.
+    Args:
+        max_queue_size (int, optional): Records kept waiting before new ones are dropped, or,
+            with a spool, left in the spool file until it is replayed.
+        batch_size (int, optional): Maximum number of records in one insert.
+        flush_interval (float, optional): Maximum number of seconds a record waits.
+        spool_dir (str, optional): The spool directory. When empty, the spool is disabled
+            and records still queued are lost on a crash.
+        replay_interval (float, optional): Seconds between replays of failed spool files.
+    """
+
+    def __init__(
+        self,
+        max_queue_size: int = AUDIT_QUEUE_MAX_SIZE,
+        batch_size: int = AUDIT_BATCH_SIZE,
+        flush_interval: float = AUDIT_FLUSH_INTERVAL,
+        spool_dir: str = AUDIT_SPOOL_DIR,
+        replay_interval: float = AUDIT_SPOOL_REPLAY_INTERVAL,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.replay_interval = replay_interval
+        self.spool = AuditSpool(spool_dir) if spool_dir else None
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self._worker_task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._replay_pending = self.spool is not None
+        self._replayed_at = float("-inf")
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    async def record(self, **fields) -> None:
+        """
+        Queues a `UserHistory` record, stamped with the current time.
+        """
+        fields.setdefault("timestamp", timezone.now())
+        if self._worker_task is None:
+            await UserHistory.create(**fields)
+            return
+        history = UserHistory(**fields)
+        queued = not self._queue.full()
+        spooled = False
+        if self.spool is not None:
+            # A full disk must not fail the request, so the record is then only queued
+            try:
+                self.spool.append(history, complete=queued)
+                spooled = True
+            except OSError as e:
+                logger.error(f"Error appending record of {history.path} to the audit spool: {e}")
+        if queued:
+            self._queue.put_nowait(history)
+        elif spooled:
+            logger.warning(f"Audit queue is full, record of {history.path} left in the spool")
+        else:
+            audit_dropped_records.inc(reason="queue_full")
+            logger.warning(f"Audit queue is full, dropping record of {history.path}")
+
+    async def _write(self, batch: List[UserHistory], segment: Optional[SpoolSegment]) -> None:
+        start = time.perf_counter()
+        written = False
+        try:
+            await UserHistory.bulk_create(
+                batch, batch_size=self.batch_size, ignore_conflicts=True
+            )
+            written = True
+        except Exception as e:
+            if segment is None:
+                audit_dropped_records.inc(len(batch), reason="write_error")
+                logger.error(f"Error writing {len(batch)} audit records: {e}")
+            else:
+                logger.error(f"Error writing {len(batch)} audit records, kept in the spool: {e}")
+        finally:
+            if segment is not None:
+                if written and segment.complete:
+                    segment.remove()
+                else:
+                    self._replay_pending = True
+                    segment.release()
+
+        if written:
+            audit_written_records.inc(len(batch))
+            audit_flush_seconds.observe(time.perf_counter() - start)
+
+    async def replay(self) -> int:
+        """
+        Inserts the records of pending spool files, oldest first, stopping at the first
+        failure.
+        Returns:
+            int: The number of records read from the files that were inserted.
+        """
+        if self.spool is None:
+            return 0
+        loop = asyncio.get_running_loop()
+        self._replayed_at = time.monotonic()
+        count = 0
+        for path in self.spool.pending():
+            segment = self.spool.claim(path)
+            if segment is None:
+                continue
+            try:
+                records = await loop.run_in_executor(None, segment.read)
+                await UserHistory.bulk_create(
+                    records, batch_size=self.batch_size, ignore_conflicts=True
+                )
+            except Exception as e:
+                segment.release()
+                self._replay_pending = True
+                logger.error(f"Error replaying audit spool file {path}: {e}")
+                return count
+            segment.remove()
+            count += len(records)
+            audit_replayed_records.inc(len(records))
+            logger.info(f"Replayed {len(records)} audit records from {path}")
+        self._replay_pending = False
+        return count
+
+    async def _next_batch(self) -> Tuple[List[UserHistory], Optional[SpoolSegment]]:
+        # Waits for the first record, or only until the next replay when one is pending
+        timeout = self.replay_interval if self._replay_pending else None
+        try:
+            record = await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return [], None
+
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        # A None record, queued by `close`, ends the batch and the worker
+        while record is not None:
+            batch.append(record)
+            timeout = deadline - time.monotonic()
+            if len(batch) >= self.batch_size or timeout <= 0:
+                break
+            try:
+                record = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+        if record is None:
+            self._closing = True
+        # Everything queued so far is in the current spool file, so it all goes in the batch
+        while not self._queue.empty():
+            record = self._queue.get_nowait()
+            if record is None:
+                self._closing = True
+            else:
+                batch.append(record)
+
+        segment = self.spool.rotate() if self.spool is not None and batch else None
+        return batch, segment
+
+    async def _write_periodically(self) -> None:
+        while not self._closing:
+            if self._replay_pending:
+                if time.monotonic() - self._replayed_at >= self.replay_interval:
+                    await self.replay()
+            batch, segment = await self._next_batch()
+            if batch:
+                await self._write(batch, segment)
+
+    def start(self) -> None:
+        """
+        Starts writing queued records in the background, after replaying the spool files
+        left by earlier processes.
+        """
+        if self._worker_task is None:
+            if self.spool is not None:
+                self.spool.open()
+            self._closing = False
+            self._worker_task = asyncio.create_task(self._write_periodically())
+
+    async def _stop(self, task: asyncio.Task) -> None:
+        await self._queue.put(None)
+        await task
+
+    async def close(self, timeout: float = AUDIT_SHUTDOWN_TIMEOUT) -> None:
+        """
+        Writes every queued record and stops the worker, giving up after `timeout` seconds.
+        Must run before the database connections are closed. Records that were not written
+        stay in the spool, if there is one.
+        """
+        if self._worker_task is None:
+            return
+        task, self._worker_task = self._worker_task, None
+        try:
+            await asyncio.wait_for(self._stop(task), timeout)
+        except asyncio.TimeoutError:
+            lost = 0
+            while not self._queue.empty():
+                if self._queue.get_nowait() is not None:
+                    lost += 1
+            if self.spool is None:
+                audit_dropped_records.inc(lost, reason="shutdown")
+                logger.error(f"Timed out writing audit records, {lost} were not written")
+            else:
+                logger.error(f"Timed out writing audit records, {lost} were left in the spool")
+        finally:
+            if self.spool is not None:
+                self.spool.close()
+
+
+audit_writer = AuditWriter()
+
+
+@on_collect
+def collect_audit_metrics() -> None:
+    audit_queue_depth.set(audit_writer.queue_depth)
+    if audit_writer.spool is not None:
+        audit_spool_segments.set(len(audit_writer.spool.pending()))
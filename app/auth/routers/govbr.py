@@ -10,25 +10,24 @@ from app.types import Token
 from app.auth.types import LoginFormGovbr, AuthenticationErrorModel
 from app.auth.utils import generate_token_from_user_data
 from app.auth.utils.govbr import get_user_data_from_access_list, decode_token
+from app.http_clients import get_http_client
 
 
 router = APIRouter(prefix="/govbr")
 
-retry_transport = httpx.AsyncHTTPTransport(retries=3)
-
 async def fetch_with_retry(method, url, **kwargs):
-    """Executa uma requisição HTTP com retry nativo do httpx."""
-    async with httpx.AsyncClient(transport=retry_transport) as client:
-        try:
-            response = await client.request(method, url, **kwargs)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as e:
-            logger.error(f"Erro HTTP {e.response.status_code} ao acessar {url}: {e}")
-            raise HTTPException(status_code=e.response.status_code, detail=f"Erro ao acessar GovBR: {e.response.text}")
-        except httpx.RequestError as e:
-            logger.error(f"Erro na requisição ao GovBR ({url}): {e}")
-            raise HTTPException(status_code=500, detail="Falha na comunicação com GovBR. Tente novamente.")
+    """Executa uma requisição HTTP com o cliente compartilhado do GovBR, que já faz retry."""
+    client = get_http_client("govbr")
+    try:
+        response = await client.request(method, url, **kwargs)
+        response.raise_for_status()
+        return response.json()
+    except httpx.HTTPStatusError as e:
+        logger.error(f"Erro HTTP {e.response.status_code} ao acessar {url}: {e}")
+        raise HTTPException(status_code=e.response.status_code, detail=f"Erro ao acessar GovBR: {e.response.text}")
+    except httpx.RequestError as e:
+        logger.error(f"Erro na requisição ao GovBR ({url}): {e}")
+        raise HTTPException(status_code=500, detail="Falha na comunicação com GovBR. Tente novamente.")
 
 @router.post(
     "/login/",
@@ -62,15 +61,11 @@ async def login_with_govbr(form_data: LoginFormGovbr) -> Token:
     if not access_token:
         raise HTTPException(status_code=401, detail="Token de acesso não recebido.")
 
-    logger.info(f"Fetching JWK from GovBR...")
-    jwk_url = f"{config.GOVBR_PROVIDER_URL}/jwk"
-    jwk_response = await fetch_with_retry("GET", jwk_url, timeout=10.0)
-
     logger.info(f"Decoding ID token...")
-    payload_id_token = await decode_token(id_token, jwk_response)
+    payload_id_token = await decode_token(id_token)
 
     logger.info(f"Decoding Access token...")
-    payload_access_token = await decode_token(access_token, jwk_response)
+    payload_access_token = await decode_token(access_token)
 
     # -----------------------------
     # LOGIN
@@ -1,27 +1,19 @@
 # -*- coding: utf-8 -*-
+import httpx
 import jwt
-from jwt.algorithms import RSAAlgorithm
 from fastapi import HTTPException
 from loguru import logger
 
-from app.config import (
-    BIGQUERY_ACCESS_TABLE_ID,
-)
-from app.utils import read_bq
 from app import config
+from app.snapshots import access_list_snapshot
+from app.auth.utils.jwks import JwksCache
+
+govbr_jwks = JwksCache(f"{config.GOVBR_PROVIDER_URL}/jwk", upstream="govbr")
 
 
 async def get_user_data_from_access_list(cpf: str) -> dict:
 
-    user_infos = await read_bq(
-        f"""
-        SELECT *
-        FROM {BIGQUERY_ACCESS_TABLE_ID}
-        WHERE cpf_particao = {int(cpf)}
-        LIMIT 1
-        """,
-        from_file="/tmp/credentials.json",
-    )
+    user_infos = await access_list_snapshot.get_rows(cpf)
     if len(user_infos) == 0:
         logger.info(f"User {cpf} not found in Database")
         return None
@@ -39,7 +31,7 @@ async def get_user_data_from_access_list(cpf: str) -> dict:
         "ap": registry["unidade_ap"],
     }
 
-async def decode_token(token: str, jwk_response: dict) -> dict:
+async def decode_token(token: str) -> dict:
     logger.debug(f"Getting key id from token...")
     try:
         unverified_header = jwt.get_unverified_header(token)
@@ -49,18 +41,17 @@ async def decode_token(token: str, jwk_response: dict) -> dict:
         raise HTTPException(status_code=401, detail="Token inválido, cabeçalho não pode ser lido")
 
     logger.debug(f"Finding matching key in JWK...")
-    matching_key = next((key for key in jwk_response['keys'] if key["kid"] == key_id), None)
-    if not matching_key:
+    try:
+        public_key = await govbr_jwks.get_key(key_id)
+    except httpx.HTTPError as e:
+        logger.error(f"Erro ao buscar o JWK do GovBR: {e}")
+        raise HTTPException(
+            status_code=500, detail="Falha na comunicação com GovBR. Tente novamente."
+        )
+    if not public_key:
         logger.error(f"Nenhuma chave correspondente ao token encontrada no JWK")
         raise HTTPException(status_code=500, detail="Nenhuma chave correspondente ao token encontrada no JWK")
 
-    logger.debug(f"Converting JWK to public key...")
-    try:
-        public_key = RSAAlgorithm.from_jwk(matching_key)
-    except Exception as e:
-        logger.error(f"Erro ao processar a JWK: {str(e)}")
-        raise HTTPException(status_code=500, detail="Erro ao processar a chave pública do JWK")
-
     logger.debug(f"Decoding token...")
     try:
         payload = jwt.decode(
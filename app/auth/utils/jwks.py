@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+import httpx
+from jwt.algorithms import RSAAlgorithm
+from loguru import logger
+
+from app import config
+from app.http_clients import get_http_client
+
+
+def cache_max_age(headers: httpx.Headers, default: float) -> float:
+    """
+    Returns for how many seconds a response may be reused, from its `Cache-Control`
+    (`no-store`, `no-cache` and `max-age`, minus `Age`) or `Expires` headers.
+    Args:
+        headers (httpx.Headers): The response headers.
+        default (float): The value used when the headers don't say.
+    Returns:
+        float: The number of seconds, possibly 0.
+    """
+    directives = {}
+    for directive in headers.get("cache-control", "").split(","):
+        name, _, value = directive.strip().partition("=")
+        if name:
+            directives[name.lower()] = value.strip('"')
+
+    if "no-store" in directives or "no-cache" in directives:
+        return 0
+    if "max-age" in directives:
+        try:
+            age = float(headers.get("age", 0))
+            return max(float(directives["max-age"]) - age, 0)
+        except ValueError:
+            return default
+    if "expires" in headers:
+        try:
+            expires = parsedate_to_datetime(headers["expires"])
+            date = parsedate_to_datetime(headers["date"]) if "date" in headers else None
+            now = date.timestamp() if date else time.time()
+            return max(expires.timestamp() - now, 0)
+        except (TypeError, ValueError):
+            return 0
+    return default
+
+
+class JwksCache:
+    """
+    The public keys of a JSON Web Key Set, parsed once and stored by key ID. The set is
+    fetched again when the response's cache headers say it expired, and once more when a
+    token is signed with an unknown key ID, which happens right after the provider rotates
+    its keys. Either kind of fetch happens at most once every `min_refresh_interval`.
+    Args:
+        url (str): The JWKS URL.
+        upstream (str): The shared HTTP client used to fetch it, see `get_http_client`.
+        default_max_age (float, optional): How long the keys are kept when the response
+            has no cache headers.
+        min_refresh_interval (float, optional): The minimum number of seconds between
+            expiry fetches, and between the fetches caused by unknown key IDs.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        upstream: str,
+        default_max_age: float = config.GOVBR_JWKS_DEFAULT_MAX_AGE,
+        min_refresh_interval: float = config.GOVBR_JWKS_MIN_REFRESH_INTERVAL,
+    ):
+        self.url = url
+        self.upstream = upstream
+        self.default_max_age = default_max_age
+        self.min_refresh_interval = min_refresh_interval
+        self._keys: Dict[str, Any] = {}
+        self._expires_at = float("-inf")
+        self._forced_at = float("-inf")
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def _fetch(self) -> httpx.Response:
+        response = await get_http_client(self.upstream).get(self.url, timeout=10.0)
+        response.raise_for_status()
+        return response
+
+    async def refresh(self, force: bool = False) -> None:
+        """
+        Fetches the key set if it expired, or with `force`, if no other forced fetch
+        happened in the last `min_refresh_interval` seconds.
+        Raises:
+            httpx.HTTPError: If the key set could not be fetched.
+        """
+        async with self._lock:
+            now = time.monotonic()
+            if force and now - self._forced_at < self.min_refresh_interval:
+                return
+            if not force and now < self._expires_at:
+                return
+            if force:
+                self._forced_at = now
+
+            response = await self._fetch()
+            keys = {}
+            for jwk in response.json().get("keys", []):
+                if "kid" not in jwk or jwk.get("use", "sig") != "sig":
+                    continue
+                try:
+                    keys[jwk["kid"]] = RSAAlgorithm.from_jwk(jwk)
+                except Exception as e:
+                    logger.warning(f"Ignoring JWK {jwk['kid']} of {self.url}: {e}")
+
+            max_age = cache_max_age(response.headers, self.default_max_age)
+            self._keys = keys
+            self._expires_at = now + max(max_age, self.min_refresh_interval)
+            logger.info(f"Fetched {len(keys)} keys from {self.url}, kept for {max_age:.0f}s")
+
+    async def get_key(self, key_id: str) -> Optional[Any]:
+        """
+        Returns the public key with the given key ID, or None if the key set doesn't have it
+        even after fetching it again.
+        Raises:
+            httpx.HTTPError: If there are no keys yet and the key set could not be fetched.
+        """
+        # While the background refresh runs, expired keys are used until it replaces them
+        if time.monotonic() >= self._expires_at and not (self._keys and self._refresh_task):
+            try:
+                await self.refresh()
+            except httpx.HTTPError as e:
+                if not self._keys:
+                    raise
+                logger.warning(f"Using expired keys of {self.url}: {e}")
+
+        if key_id not in self._keys:
+            try:
+                await self.refresh(force=True)
+            except httpx.HTTPError as e:
+                logger.warning(f"Error fetching {self.url} for key {key_id}: {e}")
+        return self._keys.get(key_id)
+
+    async def _refresh_periodically(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+                delay = self._expires_at - time.monotonic()
+            except Exception as e:
+                logger.error(f"Error refreshing {self.url}: {e}")
+                delay = self.min_refresh_interval
+            await asyncio.sleep(max(delay, 0))
+
+    def start(self) -> None:
+        """
+        Starts fetching the key set in the background whenever it expires, so that token
+        validation doesn't wait for it.
+        """
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_periodically())
+
+    async def close(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
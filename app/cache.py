@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+from typing import Dict, List, Optional
+
+import redis.asyncio as redis
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from loguru import logger
+
+from app.config import (
+    CACHE_ENABLE,
+    CACHE_REDIS_HOST,
+    CACHE_REDIS_PORT,
+    CACHE_REDIS_PASSWORD,
+    CACHE_REDIS_DB,
+    CACHE_DEFAULT_TIMEOUT,
+    CACHE_PATIENT_ACCESS_TIMEOUT,
+    MATERIALIZATION_ENABLE,
+)
+from app.materialization import get_materialized_rows, materialize_rows
+from app.models import User
+from app.queries import get_query_template, user_has_permission
+from app.utils import (
+    check_access_results,
+    read_patient_data_with_access,
+    run_query,
+)
+
+_cache_connection: Optional[redis.Redis] = None
+
+# The columns of the "patient_exibicao" query, cached per patient to validate access
+EXIBICAO_COLUMNS = (
+    "cpf",
+    "data_is_displayable",
+    "data_display_reasons",
+    "unidades_cadastro",
+    "ap_cadastro",
+)
+
+
+async def init_cache() -> None:
+    """
+    Opens the connection to the response cache Redis, if the cache is enabled.
+    """
+    global _cache_connection
+
+    if not CACHE_ENABLE or _cache_connection is not None:
+        return
+
+    logger.info("Connecting to cache Redis")
+    _cache_connection = redis.from_url(
+        f"redis://:{CACHE_REDIS_PASSWORD}@{CACHE_REDIS_HOST}:{CACHE_REDIS_PORT}/{CACHE_REDIS_DB}",
+        encoding="utf8",
+        decode_responses=True,
+    )
+
+
+async def close_cache() -> None:
+    """
+    Closes the connection to the response cache Redis.
+    """
+    global _cache_connection
+
+    if _cache_connection is not None:
+        await _cache_connection.aclose()
+        _cache_connection = None
+
+
+def build_cache_key(table_id: str, cpf: str, *parts) -> str:
+    """
+    Builds the cache key of a patient's rows in a given BigQuery table.
+    Args:
+        table_id (str): The BigQuery table the rows come from.
+        cpf (str): The CPF of the patient.
+        *parts: Extra values that change the rows returned for the same patient.
+    Returns:
+        str: The cache key.
+    """
+    return ":".join(["hci", table_id, str(cpf), *[str(part) for part in parts]])
+
+
+def _fields_key_parts(fields: Optional[List[str]]) -> tuple:
+    return ("fields=" + ",".join(sorted(set(fields))),) if fields else ()
+
+
+def _is_materializable(cache_key_parts: tuple, fields: Optional[List[str]], params: dict) -> bool:
+    # Postgres only holds each patient's whole set of rows, without filters. Routes pass
+    # every optional parameter, so a filter counts only when it has a value.
+    return (
+        MATERIALIZATION_ENABLE
+        and not cache_key_parts
+        and not fields
+        and not any(value not in (None, []) for value in params.values())
+    )
+
+
+async def get_cached_rows(key: str) -> Optional[list]:
+    """
+    Returns the rows stored under `key`, or None on a miss. Cache failures are logged
+    and treated as misses, so that the API keeps working without Redis.
+    """
+    if _cache_connection is None:
+        return None
+
+    try:
+        value = await _cache_connection.get(key)
+    except Exception as e:
+        logger.warning(f"Error reading cache key {key}: {e}")
+        return None
+
+    if value is None:
+        return None
+    return json.loads(value)
+
+
+async def set_cached_rows(key: str, rows: list, timeout: int = CACHE_DEFAULT_TIMEOUT) -> None:
+    """
+    Stores `rows` under `key` for `timeout` seconds.
+    """
+    if _cache_connection is None:
+        return
+
+    try:
+        await _cache_connection.set(key, json.dumps(jsonable_encoder(rows)), ex=timeout)
+    except Exception as e:
+        logger.warning(f"Error writing cache key {key}: {e}")
+
+
+async def validate_user_access_cached(user: User, cpf: str) -> tuple[bool, JSONResponse]:
+    """
+    Validates a user's access to a patient, evaluating the permission rules in Python on
+    the patient's `exibicao` arrays.
+    The arrays are cached per patient, so that any user's access to a cached patient is
+    checked without a BigQuery job.
+    Args:
+        user (User): The user requesting the data.
+        cpf (str): The CPF of the patient.
+    Returns:
+        tuple: A tuple containing a boolean and a JSONResponse, as described in
+            `check_access_results`.
+    """
+    key = _exibicao_cache_key(cpf)
+
+    patients = await get_cached_rows(key)
+    if patients is None:
+        patients = await run_query("patient_exibicao", cpf=cpf)
+        if patients:
+            await set_cached_rows(key, patients, timeout=CACHE_PATIENT_ACCESS_TIMEOUT)
+
+    return _check_exibicao_access(user, patients)
+
+
+def _exibicao_cache_key(cpf: str) -> str:
+    return build_cache_key(get_query_template("patient_exibicao").table_id, cpf, "exibicao")
+
+
+def _check_exibicao_access(user: User, patients: list) -> tuple[bool, JSONResponse]:
+    return check_access_results(
+        [
+            {
+                "data_is_displayable": patient["data_is_displayable"],
+                "data_display_reasons": patient["data_display_reasons"],
+                "user_has_permition": user_has_permission(user, patient),
+            }
+            for patient in patients
+        ]
+    )
+
+
+async def run_query_cached(
+    query_name: str,
+    /,
+    *,
+    cpf: str,
+    cache_key_parts: tuple = (),
+    fields: Optional[List[str]] = None,
+    **params,
+) -> list:
+    """
+    Reads a patient's rows through the response cache, then the rows materialized in
+    Postgres, running the query template `query_name` on a miss. This only caches data:
+    access validation must still be done by the caller on every request.
+    Args:
+        query_name (str): The query template that returns the rows, taking a `cpf` parameter.
+        cpf (str): The CPF of the patient.
+        cache_key_parts (tuple, optional): Extra values that change the rows returned. Must
+            identify the values given in `params`.
+        fields (list, optional): Only select these fields of the template's model.
+        **params: Values of the template's other parameters.
+    Returns:
+        list: The raw BigQuery rows.
+    """
+    table_id = get_query_template(query_name).table_id
+    key = build_cache_key(table_id, cpf, *cache_key_parts, *_fields_key_parts(fields))
+    is_materializable = _is_materializable(cache_key_parts, fields, params)
+
+    rows = await get_cached_rows(key)
+    if rows is not None:
+        logger.debug(f"Cache hit: {key}")
+        return rows
+
+    if is_materializable:
+        rows = await get_materialized_rows(table_id, cpf)
+        if rows is not None:
+            await set_cached_rows(key, rows)
+            return rows
+
+    rows = await run_query(query_name, fields=fields, cpf=cpf, **params)
+    # Empty results are not cached, so patients that just arrived show up right away
+    if rows:
+        await set_cached_rows(key, rows)
+        if is_materializable:
+            await materialize_rows(table_id, cpf, rows)
+    return rows
+
+
+async def read_patient_data_cached(
+    user: User,
+    cpf: str,
+    *,
+    query_name: str,
+    cache_key_parts: tuple = (),
+    fields: Optional[List[str]] = None,
+    **params,
+) -> tuple[bool, JSONResponse, list]:
+    """
+    Validates the user's access to a patient and reads the patient's rows with the query
+    template `query_name`. When the rows are in the response cache or materialized in
+    Postgres, access is validated with `validate_user_access_cached`; otherwise validation
+    and data come from a single job and the rows are stored for the next requests.
+    Args:
+        user (User): The user requesting the data.
+        cpf (str): The CPF of the patient.
+        query_name (str): See `read_patient_data_with_access`.
+        cache_key_parts (tuple, optional): Extra values that change the rows returned. Must
+            identify the values given in `params`.
+        fields (list, optional): Only select these fields of the template's model.
+        **params: Values of the template's optional parameters.
+    Returns:
+        tuple: The access boolean, the error JSONResponse (or None) and the rows.
+    """
+    table_id = get_query_template(query_name).table_id
+    key = build_cache_key(table_id, cpf, *cache_key_parts, *_fields_key_parts(fields))
+    is_materializable = _is_materializable(cache_key_parts, fields, params)
+
+    rows = await get_cached_rows(key)
+    if rows is not None:
+        logger.debug(f"Cache hit: {key}")
+    elif is_materializable:
+        rows = await get_materialized_rows(table_id, cpf)
+        if rows is not None:
+            logger.debug(f"Materialized hit: {table_id} {cpf}")
+            await set_cached_rows(key, rows)
+
+    if rows is not None:
+        has_access, response = await validate_user_access_cached(user, cpf)
+        return has_access, response, rows if has_access else []
+
+    has_access, response, rows = await read_patient_data_with_access(
+        user, cpf, query_name, fields=fields, **params
+    )
+    if rows:
+        await set_cached_rows(key, rows)
+        if is_materializable:
+            await materialize_rows(table_id, cpf, rows)
+    return has_access, response, rows
+
+
+async def read_patient_headers_cached(
+    user: User,
+    cpfs: List[str],
+) -> Dict[str, tuple[bool, JSONResponse, list]]:
+    """
+    Validates the user's access to several patients and reads their headers. Patients
+    whose header and `exibicao` arrays are in the response cache are served from it, and
+    all the others are read with a single "patient_headers" job, whose rows are then
+    cached for the single patient endpoints too.
+    Args:
+        user (User): The user requesting the data.
+        cpfs (list): The CPFs of the patients.
+    Returns:
+        dict: For each CPF, the access boolean, the error JSONResponse (or None) and the
+            header rows, as returned by `read_patient_data_cached`.
+    """
+    header_table_id = get_query_template("patient_header").table_id
+    header_keys = {cpf: build_cache_key(header_table_id, cpf) for cpf in cpfs}
+
+    cached = await asyncio.gather(
+        *[get_cached_rows(header_keys[cpf]) for cpf in cpfs],
+        *[get_cached_rows(_exibicao_cache_key(cpf)) for cpf in cpfs],
+    )
+    headers = dict(zip(cpfs, cached[:len(cpfs)]))
+    patients = dict(zip(cpfs, cached[len(cpfs):]))
+
+    # Patients that are not displayable have no cached header, so only their access is needed
+    missing = [
+        cpf
+        for cpf in cpfs
+        if patients[cpf] is None
+        or (headers[cpf] is None and any(p["data_is_displayable"] for p in patients[cpf]))
+    ]
+    if missing:
+        rows = await run_query("patient_headers", cpfs=missing)
+
+        found = {cpf: [] for cpf in missing}
+        payloads = {cpf: [] for cpf in missing}
+        for row in rows:
+            cpf = f"{row['cpf_particao']:011d}"
+            found[cpf].append({key: row[key] for key in EXIBICAO_COLUMNS})
+            if row["payload"] is not None:
+                payloads[cpf].append(row["payload"])
+
+        writes = []
+        for cpf in missing:
+            patients[cpf] = found[cpf]
+            headers[cpf] = payloads[cpf]
+            if found[cpf]:
+                writes.append(
+                    set_cached_rows(
+                        _exibicao_cache_key(cpf), found[cpf], timeout=CACHE_PATIENT_ACCESS_TIMEOUT
+                    )
+                )
+            if payloads[cpf]:
+                writes.append(set_cached_rows(header_keys[cpf], payloads[cpf]))
+        await asyncio.gather(*writes)
+
+    results = {}
+    for cpf in cpfs:
+        has_access, response = _check_exibicao_access(user, patients[cpf])
+        results[cpf] = (has_access, response, (headers[cpf] or []) if has_access else [])
+    return results
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# =============================================
+# CNS to CPF lookup in a memory-mapped file of
+# fixed-width (cns, cpf) records sorted by CNS.
+# Every worker maps the same file, so the pages
+# are shared through the OS page cache.
+# =============================================
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Iterable, Optional
+
+from loguru import logger
+
+from app.config import CNS_INDEX_PATH, CNS_INDEX_CHECK_INTERVAL
+
+# Little-endian unsigned 64-bit CNS followed by the CPF, both as integers
+RECORD = struct.Struct("<QQ")
+
+
+class CnsIndex:
+    """
+    Binary search over a sorted CNS to CPF index file. The file is reopened when it is
+    replaced, which `write_cns_index` does atomically, so lookups never see a partial file.
+    """
+
+    def __init__(self, path: str, check_interval: float = CNS_INDEX_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mmap: Optional[mmap.mmap] = None
+        self._size = 0
+        self._identity = None
+        self._checked_at = float("-inf")
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                if self._mmap is not None:
+                    logger.warning(f"CNS index {self.path} was removed")
+                self._close()
+                return
+
+            identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if identity == self._identity:
+                return
+
+            self._close()
+            if stat.st_size == 0 or stat.st_size % RECORD.size != 0:
+                logger.error(f"CNS index {self.path} has an invalid size: {stat.st_size}")
+                return
+            with open(self.path, "rb") as file:
+                self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._size = stat.st_size // RECORD.size
+            self._identity = identity
+            logger.info(f"Opened CNS index {self.path} with {self._size} records")
+
+    def _close(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+        self._mmap = None
+        self._size = 0
+        self._identity = None
+
+    def lookup(self, cns: int) -> Optional[str]:
+        """
+        Returns the CPF of the patient with the given CNS, or None if the CNS is not in
+        the index or there is no index file.
+        """
+        self._refresh()
+        index, size = self._mmap, self._size
+        if index is None:
+            return None
+
+        low, high = 0, size
+        while low < high:
+            middle = (low + high) // 2
+            record_cns, cpf = RECORD.unpack_from(index, middle * RECORD.size)
+            if record_cns < cns:
+                low = middle + 1
+            elif record_cns > cns:
+                high = middle
+            else:
+                return f"{cpf:011d}"
+        return None
+
+    def close(self) -> None:
+        with self._lock:
+            self._close()
+            self._checked_at = float("-inf")
+
+
+def write_cns_index(path: str, records: Iterable[tuple[int, int]]) -> int:
+    """
+    Writes an index file from (cns, cpf) pairs sorted by CNS, then atomically replaces
+    the file at `path`. Workers pick the new file up on their next check.
+    Args:
+        path (str): The index file path.
+        records (Iterable): The (cns, cpf) pairs, sorted by CNS. Repeated CNSs keep their
+            first CPF.
+    Returns:
+        int: The number of records written.
+    Raises:
+        ValueError: If the records are not sorted by CNS.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    count, previous_cns = 0, None
+
+    try:
+        with open(temporary_path, "wb") as file:
+            for cns, cpf in records:
+                if previous_cns is not None and cns <= previous_cns:
+                    if cns == previous_cns:
+                        continue
+                    raise ValueError(
+                        f"CNS index records are not sorted: {cns} after {previous_cns}"
+                    )
+                file.write(RECORD.pack(cns, cpf))
+                previous_cns = cns
+                count += 1
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+    # Persist the rename itself
+    directory_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(directory_fd)
+    finally:
+        os.close(directory_fd)
+    return count
+
+
+cns_index = CnsIndex(CNS_INDEX_PATH)
+
+
+def lookup_cpf_by_cns(cns: str) -> Optional[str]:
+    """
+    Translates a CNS into a CPF with the local index. Returns None when the index can't
+    answer, so that the caller can fall back to BigQuery.
+    """
+    if not CNS_INDEX_PATH:
+        return None
+    try:
+        return cns_index.lookup(int(cns))
+    except ValueError:
+        return None
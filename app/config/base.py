@@ -21,6 +21,26 @@ BIGQUERY_ERGON_TABLE_ID = getenv_or_action("BIGQUERY_ERGON_TABLE_ID", action="ra
 BIGQUERY_ACCESS_TABLE_ID = getenv_or_action("BIGQUERY_ACCESS_TABLE_ID", action="raise")
 BIGQUERY_PATIENT_SEARCH_TABLE_ID = getenv_or_action("BIGQUERY_PATIENT_SEARCH_TABLE_ID", action="raise")
 BIGQUERY_PATIENT_INDEX_TABLE_ID = getenv_or_action("BIGQUERY_PATIENT_INDEX_TABLE_ID", action="raise")
+BIGQUERY_HTTP_POOL_SIZE = int(getenv_or_action("BIGQUERY_HTTP_POOL_SIZE", default="20"))
+BIGQUERY_STREAM_PAGE_SIZE = int(getenv_or_action("BIGQUERY_STREAM_PAGE_SIZE", default="100"))
+BIGQUERY_EXECUTOR_MAX_WORKERS = int(
+    getenv_or_action("BIGQUERY_EXECUTOR_MAX_WORKERS", default="16")
+)
+BIGQUERY_EXECUTOR_MAX_QUEUE_DEPTH = int(
+    getenv_or_action("BIGQUERY_EXECUTOR_MAX_QUEUE_DEPTH", default="100")
+)
+BIGQUERY_JOB_STATS_ENABLE = (
+    getenv_or_action("BIGQUERY_JOB_STATS_ENABLE", default="true").lower() == "true"
+)
+BIGQUERY_STATS_EXECUTOR_MAX_WORKERS = int(
+    getenv_or_action("BIGQUERY_STATS_EXECUTOR_MAX_WORKERS", default="2")
+)
+BIGQUERY_STATS_EXECUTOR_MAX_QUEUE_DEPTH = int(
+    getenv_or_action("BIGQUERY_STATS_EXECUTOR_MAX_QUEUE_DEPTH", default="100")
+)
+DATALAKE_UPLOAD_EXECUTOR_MAX_WORKERS = int(
+    getenv_or_action("DATALAKE_UPLOAD_EXECUTOR_MAX_WORKERS", default="4")
+)
 
 # JWT configuration
 JWT_SECRET_KEY = getenv_or_action("JWT_SECRET_KEY", default=token_bytes(32).hex())
@@ -29,6 +49,11 @@ JWT_ACCESS_TOKEN_EXPIRE_MINUTES = int(
     getenv_or_action("JWT_ACCESS_TOKEN_EXPIRE_MINUTES", default="30")
 )
 
+# Authenticated users kept in memory by token, disabled when the TTL is 0. Users saved by
+# another process (e.g. deactivated by a script) keep their cached fields for up to the TTL
+USER_CACHE_TTL = float(getenv_or_action("USER_CACHE_TTL", default="30"))
+USER_CACHE_MAX_SIZE = int(getenv_or_action("USER_CACHE_MAX_SIZE", default="10000"))
+
 # Auth
 DATARELAY_URL = getenv_or_action("DATARELAY_URL", action="raise")
 DATARELAY_MAILMAN_TOKEN = getenv_or_action("DATARELAY_MAILMAN_TOKEN", action="raise")
@@ -41,12 +66,66 @@ VITACARE_USERNAME = getenv_or_action("VITACARE_USERNAME", action="raise")
 DATALAKE_HUB_URL = getenv_or_action("DATALAKE_HUB_URL", action="raise")
 DATALAKE_HUB_USERNAME = getenv_or_action("DATALAKE_HUB_USERNAME", action="raise")
 DATALAKE_HUB_PASSWORD = getenv_or_action("DATALAKE_HUB_PASSWORD", action="raise")
+DATALAKE_HUB_TOKEN_DEFAULT_TTL = float(
+    getenv_or_action("DATALAKE_HUB_TOKEN_DEFAULT_TTL", default="300")
+)
+DATALAKE_HUB_TOKEN_REFRESH_MARGIN = float(
+    getenv_or_action("DATALAKE_HUB_TOKEN_REFRESH_MARGIN", default="60")
+)
 
 # GOVBR
 GOVBR_PROVIDER_URL = getenv_or_action("GOVBR_PROVIDER_URL", action="raise")
 GOVBR_CLIENT_ID = getenv_or_action("GOVBR_CLIENT_ID", action="raise")
 GOVBR_CLIENT_SECRET = getenv_or_action("GOVBR_CLIENT_SECRET", action="raise")
 GOVBR_REDIRECT_URL = getenv_or_action("GOVBR_REDIRECT_URL", action="raise")
+GOVBR_JWKS_DEFAULT_MAX_AGE = float(getenv_or_action("GOVBR_JWKS_DEFAULT_MAX_AGE", default="3600"))
+GOVBR_JWKS_MIN_REFRESH_INTERVAL = float(
+    getenv_or_action("GOVBR_JWKS_MIN_REFRESH_INTERVAL", default="60")
+)
+
+# Outbound HTTP clients, one pool per upstream. Each setting is read from
+# HTTP_CLIENT_<UPSTREAM>_<SETTING> (e.g. HTTP_CLIENT_GOVBR_RETRIES), then from
+# HTTP_CLIENT_<SETTING> for every upstream
+HTTP_CLIENT_UPSTREAMS = ("govbr", "datalake_hub")
+HTTP_CLIENT_MAX_CONNECTIONS = getenv_or_action("HTTP_CLIENT_MAX_CONNECTIONS", default="100")
+HTTP_CLIENT_MAX_KEEPALIVE_CONNECTIONS = getenv_or_action(
+    "HTTP_CLIENT_MAX_KEEPALIVE_CONNECTIONS", default="20"
+)
+HTTP_CLIENT_KEEPALIVE_EXPIRY = getenv_or_action("HTTP_CLIENT_KEEPALIVE_EXPIRY", default="30")
+HTTP_CLIENT_RETRIES = getenv_or_action("HTTP_CLIENT_RETRIES", default="3")
+HTTP_CLIENT_HTTP2_ENABLE = getenv_or_action("HTTP_CLIENT_HTTP2_ENABLE", default="false")
+HTTP_CLIENT_SETTINGS = {
+    upstream: {
+        "max_connections": int(
+            getenv_or_action(
+                f"HTTP_CLIENT_{upstream.upper()}_MAX_CONNECTIONS",
+                default=HTTP_CLIENT_MAX_CONNECTIONS,
+            )
+        ),
+        "max_keepalive_connections": int(
+            getenv_or_action(
+                f"HTTP_CLIENT_{upstream.upper()}_MAX_KEEPALIVE_CONNECTIONS",
+                default=HTTP_CLIENT_MAX_KEEPALIVE_CONNECTIONS,
+            )
+        ),
+        "keepalive_expiry": float(
+            getenv_or_action(
+                f"HTTP_CLIENT_{upstream.upper()}_KEEPALIVE_EXPIRY",
+                default=HTTP_CLIENT_KEEPALIVE_EXPIRY,
+            )
+        ),
+        "retries": int(
+            getenv_or_action(
+                f"HTTP_CLIENT_{upstream.upper()}_RETRIES", default=HTTP_CLIENT_RETRIES
+            )
+        ),
+        "http2": getenv_or_action(
+            f"HTTP_CLIENT_{upstream.upper()}_HTTP2_ENABLE", default=HTTP_CLIENT_HTTP2_ENABLE
+        ).lower()
+        == "true",
+    }
+    for upstream in HTTP_CLIENT_UPSTREAMS
+}
 
 # Request Limit Configuration
 REQUEST_LIMIT_MAX = int(getenv_or_action("REQUEST_LIMIT_MAX", action="raise"))
@@ -74,3 +153,44 @@ else:
     CACHE_REDIS_PASSWORD = None
     CACHE_REDIS_DB = None
 CACHE_DEFAULT_TIMEOUT = int(getenv_or_action("CACHE_DEFAULT_TIMEOUT", default="43200"))  # 12 hours
+CACHE_PATIENT_ACCESS_TIMEOUT = int(
+    getenv_or_action("CACHE_PATIENT_ACCESS_TIMEOUT", default="3600")
+)  # 1 hour
+
+# Patient data materialized in Postgres
+MATERIALIZATION_ENABLE = (
+    getenv_or_action("MATERIALIZATION_ENABLE", default="false").lower() == "true"
+)
+MATERIALIZATION_MAX_AGE = int(
+    getenv_or_action("MATERIALIZATION_MAX_AGE", default="86400")
+)  # 1 day
+
+# Patient name search index in Postgres
+SEARCH_INDEX_ENABLE = getenv_or_action("SEARCH_INDEX_ENABLE", default="false").lower() == "true"
+SEARCH_INDEX_RESULT_LIMIT = int(getenv_or_action("SEARCH_INDEX_RESULT_LIMIT", default="100"))
+
+# CNS to CPF index file, disabled when the path is empty
+CNS_INDEX_PATH = getenv_or_action("CNS_INDEX_PATH", default="")
+CNS_INDEX_CHECK_INTERVAL = float(getenv_or_action("CNS_INDEX_CHECK_INTERVAL", default="5"))
+
+# In-memory snapshots of the access list and Ergon tables, used by logins. Rows removed
+# from BigQuery (revoked access) keep being found until the next sync, so for up to
+# SNAPSHOT_MAX_AGE seconds; the max age allows one failed sync before falling back
+SNAPSHOT_ENABLE = getenv_or_action("SNAPSHOT_ENABLE", default="false").lower() == "true"
+SNAPSHOT_REFRESH_INTERVAL = float(getenv_or_action("SNAPSHOT_REFRESH_INTERVAL", default="300"))
+SNAPSHOT_MAX_AGE = float(getenv_or_action("SNAPSHOT_MAX_AGE", default="600"))
+SNAPSHOT_PAGE_SIZE = int(getenv_or_action("SNAPSHOT_PAGE_SIZE", default="10000"))
+
+# Audit log (user history), written in batches by a background worker
+AUDIT_QUEUE_MAX_SIZE = int(getenv_or_action("AUDIT_QUEUE_MAX_SIZE", default="10000"))
+AUDIT_BATCH_SIZE = int(getenv_or_action("AUDIT_BATCH_SIZE", default="500"))
+AUDIT_FLUSH_INTERVAL = float(getenv_or_action("AUDIT_FLUSH_INTERVAL", default="1"))
+AUDIT_SHUTDOWN_TIMEOUT = float(getenv_or_action("AUDIT_SHUTDOWN_TIMEOUT", default="30"))
+# Directory of the audit spool files. It must be a volume (the k8s manifests mount an
+# emptyDir there) for records to survive container restarts. An empty path disables the
+# spool, and queued records are then lost on a crash
+AUDIT_SPOOL_DIR = getenv_or_action("AUDIT_SPOOL_DIR", default="/var/spool/hci-audit")
+AUDIT_SPOOL_REPLAY_INTERVAL = float(getenv_or_action("AUDIT_SPOOL_REPLAY_INTERVAL", default="30"))
+
+# Maximum number of CPFs in a batch patient header lookup
+PATIENT_HEADERS_MAX_CPFS = int(getenv_or_action("PATIENT_HEADERS_MAX_CPFS", default="50"))
@@ -5,13 +5,13 @@ import shutil
 import base64
 from typing import Optional
 from google.cloud import bigquery
-from asyncify import asyncify
 import pandas as pd
 import basedosdados as bd
 
 from loguru import logger
 
 from app.datalake.utils import generate_bigquery_schema
+from app.executor import datalake_upload_executor
 
 class DatalakeUploader:
 
@@ -268,14 +268,19 @@ class DatalakeUploader:
                 datetime_as="DATE"
             )
 
-        job_result = client.load_table_from_dataframe(
-            dataframe=dataframe,
-            destination=table_ref,
-            job_config=bigquery.LoadJobConfig(**job_config_params),
-            num_retries=5,
-        )
-        result = await asyncify(job_result.result)()
-        job = client.get_job(result.job_id)
+        def load() -> bigquery.LoadJob:
+            job_result = client.load_table_from_dataframe(
+                dataframe=dataframe,
+                destination=table_ref,
+                job_config=bigquery.LoadJobConfig(**job_config_params),
+                num_retries=5,
+            )
+            result = job_result.result()
+            return client.get_job(result.job_id)
+
+        # Uploads wait for a free thread instead of being rejected, and never take the
+        # threads of the API's queries
+        job = await datalake_upload_executor.run(load, reject_when_saturated=False)
 
         return job.state == "DONE"
 
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+from typing import Optional
+
+import httpx
+import jwt
+from loguru import logger
+
+from app.config import (
+    DATALAKE_HUB_URL,
+    DATALAKE_HUB_USERNAME,
+    DATALAKE_HUB_PASSWORD,
+    DATALAKE_HUB_TOKEN_DEFAULT_TTL,
+    DATALAKE_HUB_TOKEN_REFRESH_MARGIN,
+)
+from app.http_clients import get_http_client
+
+
+class HubTokenError(Exception):
+    """
+    The datalake hub refused to issue a token.
+    """
+
+    def __init__(self, status_code: int, content: str):
+        super().__init__(f"Datalake hub token request failed with {status_code}: {content}")
+        self.status_code = status_code
+        self.content = content
+
+
+def _token_lifetime(response_json: dict, token: str) -> float:
+    # The hub may send `expires_in` (OAuth) or `token_expire_minutes` (as this API does);
+    # otherwise the JWT `exp` claim is read without verifying it, since it is not ours to verify
+    if response_json.get("expires_in"):
+        return float(response_json["expires_in"])
+    if response_json.get("token_expire_minutes"):
+        return float(response_json["token_expire_minutes"]) * 60
+    try:
+        expires_at = jwt.decode(token, options={"verify_signature": False}).get("exp")
+    except jwt.PyJWTError:
+        expires_at = None
+    if expires_at:
+        return float(expires_at) - time.time()
+    return DATALAKE_HUB_TOKEN_DEFAULT_TTL
+
+
+class HubTokenManager:
+    """
+    Keeps the datalake hub access token until `refresh_margin` seconds before it expires.
+    Concurrent requests that find no valid token wait for a single password grant.
+    """
+
+    def __init__(self, refresh_margin: float = DATALAKE_HUB_TOKEN_REFRESH_MARGIN):
+        self.refresh_margin = refresh_margin
+        self._token: Optional[str] = None
+        self._expires_at = float("-inf")
+        self._lock = asyncio.Lock()
+
+    def _is_valid(self) -> bool:
+        return self._token is not None and time.monotonic() < self._expires_at
+
+    async def _request_token(self) -> None:
+        logger.info("Getting token from datalake hub...")
+        response = await get_http_client("datalake_hub").post(
+            url=f"{DATALAKE_HUB_URL}auth/token",
+            headers={
+                "accept": "application/json",
+                "Content-Type": "application/x-www-form-urlencoded",
+            },
+            data={
+                "grant_type": "password",
+                "username": DATALAKE_HUB_USERNAME,
+                "password": DATALAKE_HUB_PASSWORD,
+            },
+            timeout=90,
+        )
+        if response.status_code != 200:
+            raise HubTokenError(response.status_code, response.text)
+
+        response_json = response.json()
+        token = response_json.get("access_token")
+        lifetime = _token_lifetime(response_json, token)
+        self._token = token
+        self._expires_at = time.monotonic() + lifetime - self.refresh_margin
+
+    async def get_token(self) -> str:
+        """
+        Returns a valid access token, requesting a new one if needed.
+        Raises:
+            HubTokenError: If the hub refused the credentials.
+            httpx.HTTPError: If the hub could not be reached.
+        """
+        if self._is_valid():
+            return self._token
+        async with self._lock:
+            if not self._is_valid():
+                await self._request_token()
+            return self._token
+
+    def invalidate(self, token: str) -> None:
+        """
+        Drops `token`, after the hub rejected it, unless it was already replaced.
+        """
+        if self._token == token:
+            self._token = None
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Sends an authenticated request to the hub. A 401 response drops the token and the
+        request is sent once more with a new one.
+        """
+        client = get_http_client("datalake_hub")
+        token = await self.get_token()
+        response = await client.request(
+            method, url, headers={"Authorization": f"Bearer {token}"}, **kwargs
+        )
+        if response.status_code == httpx.codes.UNAUTHORIZED:
+            logger.info("Datalake hub rejected its token, getting a new one")
+            self.invalidate(token)
+            token = await self.get_token()
+            response = await client.request(
+                method, url, headers={"Authorization": f"Bearer {token}"}, **kwargs
+            )
+        return response
+
+
+hub_token_manager = HubTokenManager()
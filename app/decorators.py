@@ -5,7 +5,8 @@ from typing import Any, Dict, Optional, Sequence, Union
 
 from fastapi import APIRouter, Depends, HTTPException, Request, status
 
-from app.models import User, UserHistory
+from app.audit import audit_writer
+from app.models import User
 
 
 def router_request(
@@ -55,7 +56,7 @@ def router_request(
                     body = None
             try:
                 response = await f(*args, **kwargs)
-                await UserHistory.create(
+                await audit_writer.record(
                     user=user,
                     method=request.method,
                     path=full_path,
@@ -65,7 +66,7 @@ def router_request(
                 )
                 return response
             except HTTPException as exc:
-                await UserHistory.create(
+                await audit_writer.record(
                     user=user,
                     method=request.method,
                     path=full_path,
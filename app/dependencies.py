@@ -1,23 +1,110 @@
 # -*- coding: utf-8 -*-
-from typing import Annotated
+from collections import OrderedDict
+from typing import Annotated, Optional
 import json
-from fastapi import Depends, HTTPException, status
+import time
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import HTTPException
 from tortoise.exceptions import ValidationError
+from tortoise.signals import post_delete, post_save
 import jwt
 from jwt import PyJWTError
 from loguru import logger
 
 from app import config
+from app.metrics import current_endpoint
 from app.models import User
 from app.types import TokenData
 from app.validators import CPFValidator
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
+# The user fields that are kept in sync with the token claims
+USER_TOKEN_FIELDS = ("name", "cpf", "access_level", "cnes", "job_title", "ap")
+
+# Users authenticated by each token, with the monotonic time they expire at
+_authenticated_users: "OrderedDict[str, tuple[float, User]]" = OrderedDict()
+
+
+def get_authenticated_user(token: str) -> Optional[User]:
+    """
+    Returns the user recently authenticated with `token`, or None if there is none or the
+    entry expired.
+    """
+    entry = _authenticated_users.get(token)
+    if entry is None:
+        return None
+    expires_at, user = entry
+    if time.monotonic() >= expires_at:
+        _authenticated_users.pop(token, None)
+        return None
+    return user
+
+
+def set_authenticated_user(token: str, user: User, token_expires_at: Optional[float]) -> None:
+    """
+    Keeps the user authenticated with `token` for `USER_CACHE_TTL` seconds, or until the
+    token expires (a Unix timestamp) if that comes first.
+    """
+    if config.USER_CACHE_TTL <= 0:
+        return
+
+    expires_at = time.monotonic() + config.USER_CACHE_TTL
+    if token_expires_at is not None:
+        expires_at = min(expires_at, time.monotonic() + token_expires_at - time.time())
+
+    _authenticated_users[token] = (expires_at, user)
+    _authenticated_users.move_to_end(token)
+    while len(_authenticated_users) > config.USER_CACHE_MAX_SIZE:
+        _authenticated_users.popitem(last=False)
+
+
+def clear_authenticated_users() -> None:
+    _authenticated_users.clear()
+
+
+def forget_authenticated_user(user_id: int) -> None:
+    """
+    Drops every token kept for the user, so that their next request reads them from the
+    database again.
+    """
+    tokens = [token for token, (_, user) in _authenticated_users.items() if user.id == user_id]
+    for token in tokens:
+        del _authenticated_users[token]
+
+
+# Saving or deleting a user in this process, such as deactivating it, applies right away.
+# Changes made elsewhere, or with queryset updates that don't send signals, apply once
+# the entry expires
+@post_save(User)
+async def _forget_saved_user(sender, instance: User, created, using_db, update_fields) -> None:
+    forget_authenticated_user(instance.id)
+
+
+@post_delete(User)
+async def _forget_deleted_user(sender, instance: User, using_db) -> None:
+    forget_authenticated_user(instance.id)
+
+
+async def tag_endpoint(request: Request) -> None:
+    """
+    Stores the route path of the request, so that metrics recorded while handling it
+    can be labelled with the endpoint. Must stay async to run in the request's context.
+    """
+    route = request.scope.get("route")
+    current_endpoint.set(getattr(route, "path", request.url.path))
+
 
 async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
+    """
+    Returns the user of the token, creating it on its first request. The user's fields
+    are only written when the token claims changed them, and users are kept in memory by
+    token for `USER_CACHE_TTL` seconds, so most requests don't touch the database.
+    """
+    user = get_authenticated_user(token)
+    if user is not None:
+        return user
 
     try:
         payload = jwt.decode(token, config.JWT_SECRET_KEY, algorithms=[config.JWT_ALGORITHM])
@@ -44,20 +131,23 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
     # Update user
     if user:
         logger.info(f"User {user.username} found in database")
-        try:
-            user.name = token_data.name
-            user.cpf = token_data.cpf
-            user.access_level = token_data.access_level
-            user.cnes = token_data.cnes
-            user.job_title = token_data.job_title
-            user.ap = token_data.ap
-            await user.save()
-        except Exception as exc:
-            logger.error(f"Error updating user: {str(exc)}")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail=f"Error updating user: {str(exc)}",
-            ) from exc
+        changed_fields = [
+            field
+            for field in USER_TOKEN_FIELDS
+            if getattr(user, field) != getattr(token_data, field)
+        ]
+        if changed_fields:
+            try:
+                for field in changed_fields:
+                    setattr(user, field, getattr(token_data, field))
+                await user.save(update_fields=[*changed_fields, "updated_at"])
+            except Exception as exc:
+                logger.error(f"Error updating user: {str(exc)}")
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail=f"Error updating user: {str(exc)}",
+                ) from exc
+        set_authenticated_user(token, user, payload.get("exp"))
         return user
 
     # Create user
@@ -80,6 +170,7 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
             detail=f"Error creating user: {str(exc)}",
         ) from exc
 
+    set_authenticated_user(token, user, payload.get("exp"))
     return user
 
 async def assert_user_is_active(current_user: Annotated[User, Depends(get_current_user)]):
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from fastapi import HTTPException, status
+from loguru import logger
+
+from app.config import (
+    BIGQUERY_EXECUTOR_MAX_WORKERS,
+    BIGQUERY_EXECUTOR_MAX_QUEUE_DEPTH,
+    BIGQUERY_STATS_EXECUTOR_MAX_WORKERS,
+    BIGQUERY_STATS_EXECUTOR_MAX_QUEUE_DEPTH,
+    DATALAKE_UPLOAD_EXECUTOR_MAX_WORKERS,
+)
+from app.metrics import Counter, Gauge, Histogram
+
+executor_active_jobs = Gauge(
+    "hci_executor_active_jobs",
+    "Blocking calls currently running in a dedicated executor",
+)
+executor_queued_jobs = Gauge(
+    "hci_executor_queued_jobs",
+    "Blocking calls waiting for a free thread in a dedicated executor",
+)
+executor_queue_wait_seconds = Histogram(
+    "hci_executor_queue_wait_seconds",
+    "Time blocking calls waited for a free thread in a dedicated executor",
+)
+executor_rejections = Counter(
+    "hci_executor_rejections_total",
+    "Blocking calls rejected because a dedicated executor queue was full",
+)
+
+
+class ExecutorSaturatedError(HTTPException):
+    def __init__(self, name: str):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Too many concurrent {name} requests. Please try again.",
+            headers={"Retry-After": "1"},
+        )
+
+
+class BoundedExecutor:
+    """
+    A thread pool reserved for one kind of blocking call, so that a slow dependency only
+    exhausts its own threads instead of anyio's default limiter, shared by the whole worker.
+    At most `max_workers` calls run at once and at most `max_queue_depth` wait for a thread;
+    further calls are rejected right away with a 503.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue_depth: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix=f"{self.name}-executor",
+            )
+        return self._executor
+
+    def _update_gauges(self) -> None:
+        executor_queued_jobs.set(self._queued, executor=self.name)
+        executor_active_jobs.set(self._active, executor=self.name)
+
+    async def run(
+        self,
+        func: Callable[..., Any],
+        *args,
+        reject_when_saturated: bool = True,
+        **kwargs,
+    ) -> Any:
+        """
+        Runs `func(*args, **kwargs)` in the executor and waits for its result.
+        Args:
+            func (Callable): The blocking function to run.
+            reject_when_saturated (bool, optional): Raise `ExecutorSaturatedError` instead of
+                queueing when the queue is full. Disable it for calls that continue work
+                already accepted, such as fetching the next page of a result being streamed.
+                Defaults to True.
+        Returns:
+            Any: The return value of `func`.
+        """
+        with self._lock:
+            if reject_when_saturated and self._queued >= self.max_queue_depth:
+                executor_rejections.inc(executor=self.name)
+                logger.warning(f"Executor {self.name} saturated: {self._queued} calls queued")
+                raise ExecutorSaturatedError(self.name)
+            self._queued += 1
+            self._update_gauges()
+
+        submitted_at = time.perf_counter()
+        abandoned = threading.Event()
+
+        def job():
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+                self._update_gauges()
+            executor_queue_wait_seconds.observe(
+                time.perf_counter() - submitted_at, executor=self.name
+            )
+            try:
+                # Skip calls whose caller went away while they were queued
+                if abandoned.is_set():
+                    return None
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self._update_gauges()
+
+        loop = asyncio.get_running_loop()
+        # Shielded so that the job always runs and keeps the counters right, even if the
+        # caller is cancelled while it is queued
+        future = loop.run_in_executor(self._get_executor(), job)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            abandoned.set()
+            raise
+
+    async def shutdown(self) -> None:
+        """
+        Waits for the running calls and stops the executor threads, without blocking the
+        event loop while they finish.
+        """
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(executor.shutdown, wait=True, cancel_futures=True)
+            )
+
+
+bigquery_executor = BoundedExecutor(
+    name="bigquery",
+    max_workers=BIGQUERY_EXECUTOR_MAX_WORKERS,
+    max_queue_depth=BIGQUERY_EXECUTOR_MAX_QUEUE_DEPTH,
+)
+
+# Job statistics lookups run in the background, so they get their own threads and never
+# delay or reject the queries of user requests
+bigquery_stats_executor = BoundedExecutor(
+    name="bigquery_stats",
+    max_workers=BIGQUERY_STATS_EXECUTOR_MAX_WORKERS,
+    max_queue_depth=BIGQUERY_STATS_EXECUTOR_MAX_QUEUE_DEPTH,
+)
+
+# Datalake load jobs take minutes, so they run apart from the queries of user requests.
+# Uploads are never rejected, so their queue is not bounded
+datalake_upload_executor = BoundedExecutor(
+    name="datalake_upload",
+    max_workers=DATALAKE_UPLOAD_EXECUTOR_MAX_WORKERS,
+    max_queue_depth=0,
+)
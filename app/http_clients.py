@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# =============================================
+# Outbound HTTP clients, one per upstream, shared
+# by every request of the worker, so that
+# connections (and their TLS sessions) are kept
+# alive and reused.
+# =============================================
+from typing import Dict
+
+import httpx
+
+from app.config import HTTP_CLIENT_SETTINGS, HTTP_CLIENT_UPSTREAMS
+from app.metrics import Counter, Gauge, on_collect
+
+UPSTREAMS = HTTP_CLIENT_UPSTREAMS
+
+http_pool_connections = Gauge(
+    "hci_http_pool_connections",
+    "Open connections in an outbound HTTP client pool, by upstream and state",
+)
+http_pool_max_connections = Gauge(
+    "hci_http_pool_max_connections",
+    "Maximum number of connections of an outbound HTTP client pool, by upstream",
+)
+http_pool_queued_requests = Gauge(
+    "hci_http_pool_queued_requests",
+    "Requests waiting for a connection of an outbound HTTP client pool, by upstream",
+)
+http_requests = Counter(
+    "hci_http_requests_total",
+    "Outbound HTTP requests, by upstream and response status",
+)
+
+_http_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def create_http_client(upstream: str) -> httpx.AsyncClient:
+    """
+    Creates the client of an upstream, with a pooled transport that keeps connections
+    alive and retries failed connection attempts, as set in `HTTP_CLIENT_SETTINGS`.
+    """
+    settings = HTTP_CLIENT_SETTINGS[upstream]
+    transport = httpx.AsyncHTTPTransport(
+        http2=settings["http2"],
+        retries=settings["retries"],
+        limits=httpx.Limits(
+            max_connections=settings["max_connections"],
+            max_keepalive_connections=settings["max_keepalive_connections"],
+            keepalive_expiry=settings["keepalive_expiry"],
+        ),
+    )
+
+    async def count_response(response: httpx.Response) -> None:
+        http_requests.inc(upstream=upstream, status=response.status_code)
+
+    return httpx.AsyncClient(transport=transport, event_hooks={"response": [count_response]})
+
+
+def get_http_client(upstream: str) -> httpx.AsyncClient:
+    """
+    Returns the shared client of an upstream, created on first use when the API lifespan
+    did not create it (as in scripts).
+    Raises:
+        KeyError: If the upstream is not one of `UPSTREAMS`.
+    """
+    if upstream not in UPSTREAMS:
+        raise KeyError(f"Unknown upstream: {upstream}")
+    if upstream not in _http_clients or _http_clients[upstream].is_closed:
+        _http_clients[upstream] = create_http_client(upstream)
+    return _http_clients[upstream]
+
+
+def init_http_clients() -> None:
+    for upstream in UPSTREAMS:
+        get_http_client(upstream)
+
+
+async def close_http_clients() -> None:
+    for upstream in list(_http_clients):
+        await _http_clients.pop(upstream).aclose()
+
+
+@on_collect
+def collect_pool_metrics() -> None:
+    for upstream, client in _http_clients.items():
+        # httpx exposes no pool statistics, so they are read from its httpcore pool. These
+        # are private attributes, so the pool is skipped when they are missing
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        if pool is None or not hasattr(pool, "connections"):
+            continue
+        connections = list(pool.connections)
+        idle = sum(1 for connection in connections if connection.is_idle())
+        http_pool_connections.set(len(connections) - idle, upstream=upstream, state="active")
+        http_pool_connections.set(idle, upstream=upstream, state="idle")
+        http_pool_max_connections.set(
+            HTTP_CLIENT_SETTINGS[upstream]["max_connections"], upstream=upstream
+        )
+        http_pool_queued_requests.set(
+            sum(1 for request in getattr(pool, "_requests", []) if request.is_queued()),
+            upstream=upstream,
+        )
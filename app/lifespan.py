@@ -13,13 +13,29 @@ from tortoise import Tortoise, connections
 from tortoise.exceptions import DoesNotExist, IntegrityError
 from tortoise.log import logger
 
+from app.audit import audit_writer
+from app.auth.utils.govbr import govbr_jwks
 from app.db import TORTOISE_ORM
+from app.cache import init_cache, close_cache
+from app.cns_index import cns_index
+from app.executor import (
+    bigquery_executor,
+    bigquery_stats_executor,
+    datalake_upload_executor,
+)
+from app.http_clients import init_http_clients, close_http_clients
+from app.snapshots import start_snapshots, close_snapshots
+from app.queries import prepare_queries
 from app.config import (
     REDIS_HOST,
     REDIS_PASSWORD,
     REDIS_PORT,
 )
-from app.utils import request_limiter_identifier
+from app.utils import (
+    request_limiter_identifier,
+    init_bigquery_client,
+    close_bigquery_client,
+)
 
 
 
@@ -82,6 +98,36 @@ async def api_lifespan(app: FastAPI):
     except Exception as e:
         logger.error(f"Error initializing FastAPILimiter: {e}")
 
+    try:
+        init_bigquery_client()
+    except Exception as e:
+        logger.error(f"Error initializing BigQuery client: {e}")
+
+    try:
+        prepare_queries()
+    except Exception as e:
+        logger.error(f"Error preparing BigQuery query templates: {e}")
+
+    try:
+        await init_cache()
+    except Exception as e:
+        logger.error(f"Error initializing cache: {e}")
+
+    try:
+        init_http_clients()
+    except Exception as e:
+        logger.error(f"Error initializing HTTP clients: {e}")
+
+    try:
+        start_snapshots()
+    except Exception as e:
+        logger.error(f"Error starting table snapshots: {e}")
+
+    try:
+        govbr_jwks.start()
+    except Exception as e:
+        logger.error(f"Error starting GovBR JWKS refresh: {e}")
+
     async with register_tortoise(
         app,
         config=TORTOISE_ORM,
@@ -89,10 +135,57 @@ async def api_lifespan(app: FastAPI):
         add_exception_handlers=True,
     ):
         # do sth while db connected
+        try:
+            audit_writer.start()
+        except Exception as e:
+            logger.error(f"Error starting audit writer: {e}")
+
         yield
 
+        try:
+            await audit_writer.close()
+        except Exception as e:
+            logger.error(f"Error closing audit writer: {e}")
+
     # do sth after db closed
     try:
         await FastAPILimiter.close()
     except Exception as e:
-        logger.error(f"Error closing FastAPILimiter: {e}")
\ No newline at end of file
+        logger.error(f"Error closing FastAPILimiter: {e}")
+
+    try:
+        close_bigquery_client()
+    except Exception as e:
+        logger.error(f"Error closing BigQuery client: {e}")
+
+    try:
+        await bigquery_executor.shutdown()
+        await bigquery_stats_executor.shutdown()
+        await datalake_upload_executor.shutdown()
+    except Exception as e:
+        logger.error(f"Error closing BigQuery executor: {e}")
+
+    try:
+        cns_index.close()
+    except Exception as e:
+        logger.error(f"Error closing CNS index: {e}")
+
+    try:
+        await govbr_jwks.close()
+    except Exception as e:
+        logger.error(f"Error closing GovBR JWKS refresh: {e}")
+
+    try:
+        await close_snapshots()
+    except Exception as e:
+        logger.error(f"Error closing table snapshots: {e}")
+
+    try:
+        await close_http_clients()
+    except Exception as e:
+        logger.error(f"Error closing HTTP clients: {e}")
+
+    try:
+        await close_cache()
+    except Exception as e:
+        logger.error(f"Error closing cache: {e}")
@@ -2,12 +2,13 @@
 import sys
 
 import sentry_sdk
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from loguru import logger
 
 from app import config
 from app.utils import prepare_gcp_credential
+from app.dependencies import tag_endpoint
 from app.lifespan import api_lifespan
 from app.routers import frontend, misc, vitacare
 from app.auth.routers import router as auth_routers
@@ -27,7 +28,8 @@ prepare_gcp_credential()
 
 app = FastAPI(
     title="Histórico Clínico Integrado - SMSRIO",
-    lifespan=api_lifespan
+    lifespan=api_lifespan,
+    dependencies=[Depends(tag_endpoint)],
 )
 
 logger.debug("Configuring CORS with the following settings:")
@@ -45,6 +47,7 @@ app.add_middleware(
     allow_methods=config.ALLOWED_METHODS,
     allow_headers=config.ALLOWED_HEADERS,
     allow_credentials=config.ALLOW_CREDENTIALS,
+    expose_headers=["X-Next-Cursor"],
 )
 
 app.include_router(auth_routers)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import datetime
+from typing import Optional, Type
+
+from fastapi.encoders import jsonable_encoder
+from loguru import logger
+
+from app.config import (
+    BIGQUERY_PATIENT_HEADER_TABLE_ID,
+    BIGQUERY_PATIENT_SUMMARY_TABLE_ID,
+    BIGQUERY_PATIENT_ENCOUNTERS_TABLE_ID,
+    MATERIALIZATION_ENABLE,
+    MATERIALIZATION_MAX_AGE,
+)
+from app.models import (
+    MaterializedPatientData,
+    MaterializedPatientHeader,
+    MaterializedPatientSummary,
+    MaterializedPatientEncounters,
+)
+from app.utils import run_query
+
+# The model holding the materialized rows of each BigQuery table, and the query template
+# that reads all of a patient's rows from it
+MATERIALIZED_TABLES: dict[str, tuple[Type[MaterializedPatientData], str]] = {
+    BIGQUERY_PATIENT_HEADER_TABLE_ID: (MaterializedPatientHeader, "patient_header_rows"),
+    BIGQUERY_PATIENT_SUMMARY_TABLE_ID: (MaterializedPatientSummary, "patient_summary_rows"),
+    BIGQUERY_PATIENT_ENCOUNTERS_TABLE_ID: (
+        MaterializedPatientEncounters,
+        "patient_encounters_rows",
+    ),
+}
+
+
+async def get_materialized_rows(table_id: str, cpf: str) -> Optional[list]:
+    """
+    Returns a patient's rows of `table_id` from Postgres, or None if they were never
+    materialized or are older than `MATERIALIZATION_MAX_AGE`. Database failures are logged
+    and treated as misses, so that reads fall back to BigQuery.
+    """
+    if not MATERIALIZATION_ENABLE or table_id not in MATERIALIZED_TABLES:
+        return None
+
+    model, _ = MATERIALIZED_TABLES[table_id]
+    oldest = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+        seconds=MATERIALIZATION_MAX_AGE
+    )
+    try:
+        materialized = await model.get_or_none(cpf=cpf, synced_at__gte=oldest)
+    except Exception as e:
+        logger.warning(f"Error reading materialized {table_id} of {cpf}: {e}")
+        return None
+
+    if materialized is None:
+        return None
+    return materialized.data
+
+
+async def materialize_rows(table_id: str, cpf: str, rows: list) -> None:
+    """
+    Stores a patient's rows of `table_id` in Postgres, with the current time as watermark.
+    """
+    if table_id not in MATERIALIZED_TABLES:
+        return
+
+    model, _ = MATERIALIZED_TABLES[table_id]
+    try:
+        await model.update_or_create(
+            defaults={
+                "data": jsonable_encoder(rows),
+                "synced_at": datetime.datetime.now(datetime.timezone.utc),
+            },
+            cpf=cpf,
+        )
+    except Exception as e:
+        logger.warning(f"Error materializing {table_id} of {cpf}: {e}")
+
+
+async def sync_patient(cpf: str) -> dict:
+    """
+    Reads a patient's header, summary and encounters from BigQuery and stores them in
+    Postgres. Tables without rows for the patient are left out.
+    Returns:
+        dict: The number of rows stored, by table.
+    """
+    table_ids = list(MATERIALIZED_TABLES)
+    results = await asyncio.gather(
+        *[run_query(MATERIALIZED_TABLES[table_id][1], cpf=cpf) for table_id in table_ids]
+    )
+
+    synced = {}
+    for table_id, rows in zip(table_ids, results):
+        if rows:
+            await materialize_rows(table_id, cpf, rows)
+        synced[table_id] = len(rows)
+    return synced
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# =============================================
+# In-process metrics, rendered in the Prometheus
+# text exposition format by /misc/metrics.
+# Values are kept per worker process.
+# =============================================
+import threading
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from loguru import logger
+
+REGISTERED_METRICS = []
+
+# Called before rendering, to set gauges that are read from their source at scrape time
+COLLECT_CALLBACKS: List[Callable[[], None]] = []
+
+# Route path of the request being handled, used to label metrics recorded deep in helpers
+current_endpoint: ContextVar[str] = ContextVar("current_endpoint", default="unknown")
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _labels_key(labels: dict) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    formatted = ",".join(f'{key}="{value}"' for key, value in labels)
+    return "{" + formatted + "}"
+
+
+class Counter:
+    """
+    A monotonically increasing value, optionally split by labels. Metrics may be updated
+    from executor threads, so every update holds the metric's lock.
+    """
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+        self._lock = threading.Lock()
+        REGISTERED_METRICS.append(self)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _labels_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(_labels_key(labels), 0)
+
+    def collect(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    """
+    A value that can go up and down, optionally split by labels.
+    """
+
+    def set(self, value: float, **labels) -> None:
+        key = _labels_key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def collect(self) -> List[str]:
+        lines = super().collect()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    """
+    Counts observed values in cumulative buckets, optionally split by labels.
+    """
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[Tuple[str, str], ...], dict] = {}
+        self._lock = threading.Lock()
+        REGISTERED_METRICS.append(self)
+
+    def observe(self, value: float, **labels) -> None:
+        key = _labels_key(labels)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0, "count": 0}
+            series = self._values[key]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def get(self, **labels) -> dict:
+        """
+        Returns the bucket counts, sum and count observed with `labels`.
+        """
+        with self._lock:
+            series = self._values.get(_labels_key(labels))
+            if series is None:
+                return {"buckets": [0] * len(self.buckets), "sum": 0, "count": 0}
+            return {**series, "buckets": list(series["buckets"])}
+
+    def collect(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            values = [
+                (labels, {**series, "buckets": list(series["buckets"])})
+                for labels, series in self._values.items()
+            ]
+        for labels, series in values:
+            for bound, count in zip(self.buckets, series["buckets"]):
+                bucket_labels = labels + (("le", str(bound)),)
+                lines.append(f"{self.name}_bucket{_format_labels(bucket_labels)} {count}")
+            inf_labels = labels + (("le", "+Inf"),)
+            lines.append(f"{self.name}_bucket{_format_labels(inf_labels)} {series['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {series['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {series['count']}")
+        return lines
+
+
+def on_collect(callback: Callable[[], None]) -> Callable[[], None]:
+    """
+    Registers a function that updates metrics right before they are rendered.
+    """
+    COLLECT_CALLBACKS.append(callback)
+    return callback
+
+
+def render_metrics() -> str:
+    """
+    Renders every registered metric in the Prometheus text exposition format.
+    """
+    for callback in COLLECT_CALLBACKS:
+        # A failing source must not take the other metrics down with it
+        try:
+            callback()
+        except Exception as e:
+            logger.warning(f"Error collecting metrics with {callback.__name__}: {e}")
+
+    lines = []
+    for metric in REGISTERED_METRICS:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
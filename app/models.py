@@ -35,4 +35,53 @@ class UserHistory(Model):
     query_params = fields.JSONField(null=True)
     body = fields.JSONField(null=True)
     status_code = fields.IntField()
-    timestamp = fields.DatetimeField(auto_now_add=True)
+    timestamp = fields.DatetimeField(auto_now_add=True, index=True)
+
+    class Meta:
+        # The table is partitioned by month on `timestamp`, see migration 40
+        indexes = (("user_id", "timestamp"),)
+
+
+class MaterializedPatientData(Model):
+    """
+    A patient's rows from one BigQuery table, copied to Postgres so that frontend reads
+    don't wait for a BigQuery job. `synced_at` is when the rows were read from BigQuery.
+    """
+    cpf = fields.CharField(max_length=11, pk=True)
+    data = fields.JSONField()
+    synced_at = fields.DatetimeField(index=True)
+
+    class Meta:
+        abstract = True
+
+
+class MaterializedPatientHeader(MaterializedPatientData):
+    class Meta:
+        table = "materialized_patient_header"
+
+
+class MaterializedPatientSummary(MaterializedPatientData):
+    class Meta:
+        table = "materialized_patient_summary"
+
+
+class MaterializedPatientEncounters(MaterializedPatientData):
+    class Meta:
+        table = "materialized_patient_encounters"
+
+
+class PatientSearchEntry(Model):
+    """
+    A row of the BigQuery patient search table, copied to Postgres and indexed with
+    `pg_trgm` so that name searches don't wait for a BigQuery job.
+    """
+    cpf = fields.CharField(max_length=11, pk=True)
+    name = fields.TextField()
+    normalized_name = fields.TextField()
+    data = fields.JSONField()
+    unidades_cadastro = fields.JSONField(null=True)
+    ap_cadastro = fields.JSONField(null=True)
+    synced_at = fields.DatetimeField(index=True)
+
+    class Meta:
+        table = "patient_search_index"
@@ -0,0 +1,557 @@
+# -*- coding: utf-8 -*-
+# =============================================
+# Named BigQuery query templates. Values are
+# passed as query parameters, so the SQL text of
+# each template is rendered once and stays the
+# same across requests and users, which lets
+# BigQuery reuse its cached results.
+# =============================================
+from typing import Any, Callable, Dict, Iterable, List, Optional, Type
+
+from google.cloud import bigquery
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_LIST, SHAPE_SINGLETON
+from pydantic.utils import lenient_issubclass
+
+from app.config import (
+    BIGQUERY_PROJECT,
+    BIGQUERY_PATIENT_HEADER_TABLE_ID,
+    BIGQUERY_PATIENT_SUMMARY_TABLE_ID,
+    BIGQUERY_PATIENT_ENCOUNTERS_TABLE_ID,
+    BIGQUERY_PATIENT_SEARCH_TABLE_ID,
+    BIGQUERY_PATIENT_INDEX_TABLE_ID,
+    BIGQUERY_ERGON_TABLE_ID,
+    BIGQUERY_ACCESS_TABLE_ID,
+)
+from app.enums import PermitionEnum
+from app.models import User
+from app.types.frontend import Encounter, PatientHeader, PatientSummary
+
+# Whether the user can see a patient, evaluated on a row with the patient's `cpf` and
+# `exibicao` columns. Note that `only_from_same_ap` compares the user's CNES and
+# `only_from_same_cnes` the user's AP, as the access rules always did.
+USER_PERMISSION_CONDITION = """
+    CASE @access_level
+        WHEN 'full_permission' THEN TRUE
+        WHEN 'only_from_same_cpf' THEN cpf = @user_cpf
+        WHEN 'only_from_same_ap' THEN @user_cnes IN UNNEST(exibicao.unidades_cadastro)
+        WHEN 'only_from_same_cnes' THEN @user_ap IN UNNEST(exibicao.ap_cadastro)
+        ELSE FALSE
+    END
+"""
+
+USER_PERMISSION_PARAMETERS = {
+    "access_level": "STRING",
+    "user_cpf": "STRING",
+    "user_cnes": "STRING",
+    "user_ap": "STRING",
+}
+
+
+def user_permission_parameters(user: User) -> dict:
+    """
+    Returns the values of `USER_PERMISSION_PARAMETERS` for a user. Only the value used by
+    the user's access level is filled, so that users with the same permissions send the
+    same parameters and share BigQuery's cached results.
+    """
+    access_level = PermitionEnum(user.access_level) if user.access_level else None
+    return {
+        "access_level": access_level.value if access_level else None,
+        "user_cpf": user.cpf if access_level == PermitionEnum.HCI_SAME_CPF else None,
+        "user_cnes": user.cnes if access_level == PermitionEnum.HCI_SAME_AP else None,
+        "user_ap": user.ap if access_level == PermitionEnum.HCI_SAME_HEALTHUNIT else None,
+    }
+
+
+def user_has_permission(user: User, patient: dict) -> bool:
+    """
+    Evaluates `USER_PERMISSION_CONDITION` in Python, on a row of the "patient_exibicao"
+    query, so that access can be checked without a BigQuery job.
+    """
+    access_level = PermitionEnum(user.access_level) if user.access_level else None
+    if access_level == PermitionEnum.HCI_full_permission:
+        return True
+    elif access_level == PermitionEnum.HCI_SAME_CPF:
+        return patient["cpf"] == user.cpf
+    elif access_level == PermitionEnum.HCI_SAME_AP:
+        return user.cnes in (patient["unidades_cadastro"] or [])
+    elif access_level == PermitionEnum.HCI_SAME_HEALTHUNIT:
+        return user.ap in (patient["ap_cadastro"] or [])
+    return False
+
+
+def _quote(path: str) -> str:
+    return ".".join(f"`{part}`" for part in path.split("."))
+
+
+def _literal(value: Any) -> str:
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    escaped = str(value).replace("\\", "\\\\").replace("'", "\\'")
+    return f"'{escaped}'"
+
+
+def _model_expressions(
+    model: Type[BaseModel], prefix: str = "", fields: Optional[Iterable[str]] = None, depth: int = 0
+) -> List[str]:
+    expressions = []
+    for name, field in model.__fields__.items():
+        if fields is not None and name not in fields:
+            continue
+        # Columns whose field has a default may be missing from the table, so they are only
+        # read when asked for by name; otherwise the model fills in the default
+        if field.default is not None and fields is None:
+            continue
+
+        column = _quote(f"{prefix}{name}")
+        if lenient_issubclass(field.type_, BaseModel) and field.shape == SHAPE_LIST:
+            item = f"item{depth}"
+            inner = ", ".join(_model_expressions(field.type_, f"{item}.", depth=depth + 1))
+            expression = f"ARRAY(SELECT AS STRUCT {inner} FROM UNNEST({column}) {item})"
+        elif lenient_issubclass(field.type_, BaseModel) and field.shape == SHAPE_SINGLETON:
+            inner = ", ".join(_model_expressions(field.type_, f"{prefix}{name}.", depth=depth))
+            # A struct of nulls would not validate where the model expects a null
+            expression = f"IF({column} IS NULL, NULL, STRUCT({inner}))"
+        elif field.default is not None:
+            # The model's default stands in for null values too
+            expression = f"IFNULL({column}, {_literal(field.default)})"
+        else:
+            expression = column
+        expressions.append(f"{expression} AS `{name}`")
+    return expressions
+
+
+def model_columns(model: Type[BaseModel], fields: Optional[Iterable[str]] = None) -> str:
+    """
+    Builds the select list of the columns that a pydantic model reads from a row, so that
+    queries don't scan the columns the response would throw away. Nested models become
+    `STRUCT`s and lists of models `ARRAY(SELECT AS STRUCT ...)`, with only their fields.
+    Fields with a default are only selected when listed in `fields`, and read the default in
+    place of nulls.
+    Args:
+        model (Type[BaseModel]): The model the rows are turned into.
+        fields (Iterable, optional): Only project these top level fields.
+    Returns:
+        str: The comma separated select expressions.
+    """
+    return ", ".join(_model_expressions(model, fields=fields))
+
+
+class QueryTemplate:
+    """
+    A named SQL query that takes its values as BigQuery query parameters.
+    Args:
+        name (str): The name used to run the query.
+        render (Callable): Returns the SQL text. Called once, by `prepare`. Templates with a
+            `model` are given the select list of its columns, see `model_columns`.
+        parameters (dict): The type of each query parameter, such as "INT64" or
+            "ARRAY<STRING>".
+        defaults (dict, optional): Values of the optional parameters.
+        table_id (str, optional): The table the rows come from, used in cache keys.
+        model (Type[BaseModel], optional): The model of the rows, whose fields are selected.
+        key_fields (tuple, optional): Fields of `model` that are always selected, because
+            the query itself uses them.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        render: Callable[..., str],
+        parameters: Dict[str, str],
+        defaults: Optional[Dict[str, Any]] = None,
+        table_id: Optional[str] = None,
+        model: Optional[Type[BaseModel]] = None,
+        key_fields: tuple = (),
+    ):
+        self.name = name
+        self.parameters = parameters
+        self.defaults = defaults or {}
+        self.table_id = table_id
+        self.model = model
+        self.key_fields = key_fields
+        self._render = render
+        self._sql: Optional[str] = None
+        self._projected_sql: Dict[tuple, str] = {}
+
+    def prepare(self) -> None:
+        self._sql = self._render(model_columns(self.model)) if self.model else self._render()
+
+    @property
+    def sql(self) -> str:
+        if self._sql is None:
+            self.prepare()
+        return self._sql
+
+    def sql_for(self, fields: Optional[Iterable[str]] = None) -> str:
+        """
+        Returns the SQL text that only selects the given fields of the template's model,
+        rendered once per set of fields.
+        Raises:
+            ValueError: If the template has no model or a field is not in it.
+        """
+        if not fields:
+            return self.sql
+        if self.model is None:
+            raise ValueError(f"Query {self.name} does not select model fields")
+
+        fields = tuple(sorted(set(fields) | set(self.key_fields)))
+        unknown = set(fields) - set(self.model.__fields__)
+        if unknown:
+            raise ValueError(f"Query {self.name} got unknown fields: {sorted(unknown)}")
+        if fields not in self._projected_sql:
+            self._projected_sql[fields] = self._render(model_columns(self.model, fields))
+        return self._projected_sql[fields]
+
+    def build_parameters(self, **values) -> list:
+        """
+        Checks the values against the declared parameters and converts them into
+        BigQuery query parameters.
+        Raises:
+            TypeError: If a required parameter is missing or an unknown one is given.
+        """
+        unknown = set(values) - set(self.parameters)
+        if unknown:
+            raise TypeError(f"Query {self.name} got unknown parameters: {sorted(unknown)}")
+        values = {**self.defaults, **values}
+        missing = set(self.parameters) - set(values)
+        if missing:
+            raise TypeError(f"Query {self.name} is missing parameters: {sorted(missing)}")
+
+        query_parameters = []
+        for name, parameter_type in self.parameters.items():
+            value = values[name]
+            if parameter_type.startswith("ARRAY<"):
+                item_type = parameter_type[6:-1]
+                value = list(value or [])
+                if item_type == "INT64":
+                    value = [int(item) for item in value]
+                query_parameters.append(bigquery.ArrayQueryParameter(name, item_type, value))
+            else:
+                if parameter_type == "INT64" and value is not None:
+                    value = int(value)
+                query_parameters.append(bigquery.ScalarQueryParameter(name, parameter_type, value))
+        return query_parameters
+
+
+def _patient_data_sql(
+    table_id: str,
+    columns: str,
+    payload_filter: str = "",
+    payload_sorting: str = "",
+    result_sorting: str = "",
+) -> str:
+    """
+    Builds a query that returns the user's access flags to a patient, from the header table,
+    together with the `columns` of the patient's rows from `table_id`, as a `payload` struct.
+    There is one result row per payload row, or a single row with a null payload when there
+    is no data or access is denied; no rows at all means the patient was not found. The
+    payload only has the `columns`, not the `cpf_particao` the rows are joined on.
+    """
+    return f"""
+    WITH
+        access AS (
+            SELECT
+                cpf_particao,
+                exibicao.indicador data_is_displayable,
+                exibicao.motivos data_display_reasons,
+                cast({USER_PERMISSION_CONDITION} as bool) as user_has_permition
+            FROM `{BIGQUERY_PROJECT}`.{BIGQUERY_PATIENT_HEADER_TABLE_ID}
+            WHERE cpf_particao = @cpf
+        ),
+        patient_rows AS (
+            SELECT
+                cpf_particao,
+                STRUCT({columns}) AS payload
+            FROM `{BIGQUERY_PROJECT}`.{table_id} source
+            WHERE cpf_particao = @cpf {payload_filter}
+            {payload_sorting}
+        )
+    SELECT
+        access.data_is_displayable,
+        access.data_display_reasons,
+        access.user_has_permition,
+        patient_rows.payload
+    FROM access
+        LEFT JOIN patient_rows
+            ON patient_rows.cpf_particao = access.cpf_particao
+            AND access.user_has_permition
+            AND access.data_is_displayable
+    {result_sorting}
+    """
+
+
+PATIENT_PARAMETERS = {"cpf": "INT64", **USER_PERMISSION_PARAMETERS}
+
+# Orders encounters with the same `entry_datetime`, as a hash of the whole row
+ENCOUNTER_PAGE_ORDER = "FARM_FINGERPRINT(TO_JSON_STRING(source))"
+
+QUERY_TEMPLATES = {
+    template.name: template
+    for template in [
+        # What `USER_PERMISSION_CONDITION` needs, to evaluate it for any user in Python
+        QueryTemplate(
+            name="patient_exibicao",
+            render=lambda: f"""
+            SELECT
+                cpf,
+                exibicao.indicador data_is_displayable,
+                exibicao.motivos data_display_reasons,
+                exibicao.unidades_cadastro,
+                exibicao.ap_cadastro
+            FROM `{BIGQUERY_PROJECT}`.{BIGQUERY_PATIENT_HEADER_TABLE_ID}
+            WHERE
+                cpf_particao = @cpf
+            """,
+            parameters={"cpf": "INT64"},
+            table_id=BIGQUERY_PATIENT_HEADER_TABLE_ID,
+        ),
+        QueryTemplate(
+            name="patient_header",
+            render=lambda columns: _patient_data_sql(BIGQUERY_PATIENT_HEADER_TABLE_ID, columns),
+            parameters=PATIENT_PARAMETERS,
+            table_id=BIGQUERY_PATIENT_HEADER_TABLE_ID,
+            model=PatientHeader,
+        ),
+        # Several patients at once: the `patient_exibicao` columns and, for displayable
+        # patients, the header row as `payload`. Access is evaluated in Python, so the
+        # query is the same for every user
+        QueryTemplate(
+            name="patient_headers",
+            render=lambda columns: f"""
+            SELECT
+                cpf_particao,
+                cpf,
+                exibicao.indicador data_is_displayable,
+                exibicao.motivos data_display_reasons,
+                exibicao.unidades_cadastro,
+                exibicao.ap_cadastro,
+                IF(exibicao.indicador, STRUCT({columns}), NULL) payload
+            FROM `{BIGQUERY_PROJECT}`.{BIGQUERY_PATIENT_HEADER_TABLE_ID}
+            WHERE
+                cpf_particao IN UNNEST(@cpfs)
+            """,
+            parameters={"cpfs": "ARRAY<INT64>"},
+            table_id=BIGQUERY_PATIENT_HEADER_TABLE_ID,
+            model=PatientHeader,
+        ),
+        QueryTemplate(
+            name="patient_summary",
+            render=lambda columns: _patient_data_sql(BIGQUERY_PATIENT_SUMMARY_TABLE_ID, columns),
+            parameters=PATIENT_PARAMETERS,
+            table_id=BIGQUERY_PATIENT_SUMMARY_TABLE_ID,
+            model=PatientSummary,
+        ),
+        # Most recent first. `limit`, `cursor`, `since`, `until` and `filter_tags` are
+        # optional; a null (or empty) value disables the condition. Encounters with the same
+        # `entry_datetime` are sorted by `page_order`, a hash of the whole row, so that pages
+        # split between them the same way every time. With `cursor_skip`, the encounters at
+        # `cursor` are included, for the caller to drop the `cursor_skip` ones already seen
+        QueryTemplate(
+            name="patient_encounters",
+            render=lambda columns: _patient_data_sql(
+                BIGQUERY_PATIENT_ENCOUNTERS_TABLE_ID,
+                f"{columns}, {ENCOUNTER_PAGE_ORDER} AS page_order",
+                payload_filter="""
+                AND exibicao.indicador = true
+                AND (
+                    @cursor IS NULL
+                    OR CAST(entry_datetime AS DATETIME) < @cursor
+                    OR (@cursor_skip IS NOT NULL AND CAST(entry_datetime AS DATETIME) = @cursor)
+                )
+                AND (@since IS NULL OR CAST(entry_datetime AS DATETIME) >= @since)
+                AND (@until IS NULL OR CAST(entry_datetime AS DATETIME) <= @until)
+                AND (
+                    ARRAY_LENGTH(@filter_tags) = 0
+                    OR EXISTS(
+                        SELECT 1 FROM UNNEST(filter_tags) tag WHERE tag IN UNNEST(@filter_tags)
+                    )
+                )
+                """,
+                payload_sorting=f"""
+                QUALIFY @limit IS NULL
+                    OR ROW_NUMBER() OVER (ORDER BY entry_datetime DESC, {ENCOUNTER_PAGE_ORDER})
+                        <= @limit
+                """,
+                result_sorting="""
+                ORDER BY patient_rows.payload.entry_datetime DESC, patient_rows.payload.page_order
+                """,
+            ),
+            parameters={
+                **PATIENT_PARAMETERS,
+                "cursor": "DATETIME",
+                "cursor_skip": "INT64",
+                "since": "DATETIME",
+                "until": "DATETIME",
+                "filter_tags": "ARRAY<STRING>",
+                "limit": "INT64",
+            },
+            defaults={
+                "cursor": None,
+                "cursor_skip": None,
+                "since": None,
+                "until": None,
+                "filter_tags": [],
+                "limit": None,
+            },
+            table_id=BIGQUERY_PATIENT_ENCOUNTERS_TABLE_ID,
+            model=Encounter,
+            # Pages are sorted by, and their cursors taken from, `entry_datetime` (and
+            # `page_order`, which is always selected)
+            key_fields=("entry_datetime",),
+        ),
+        # The rows alone, for callers that validate access with another query
+        QueryTemplate(
+            name="patient_header_rows",
+            render=lambda columns: f"""
+            SELECT {columns}
+            FROM `{BIGQUERY_PROJECT}`.{BIGQUERY_PATIENT_HEADER_TABLE_ID}
+            WHERE cpf_particao = @cpf
+            """,
+            parameters={"cpf": "INT64"},
+            table_id=BIGQUERY_PATIENT_HEADER_TABLE_ID,
+            model=PatientHeader,
+        ),
+        QueryTemplate(
+            name="patient_summary_rows",
+            render=lambda columns: f"""
+            SELECT {columns}
+            FROM `{BIGQUERY_PROJECT}`.{BIGQUERY_PATIENT_SUMMARY_TABLE_ID}
+            WHERE cpf_particao = @cpf
+            """,
+            parameters={"cpf": "INT64"},
+            table_id=BIGQUERY_PATIENT_SUMMARY_TABLE_ID,
+            model=PatientSummary,
+        ),
+        QueryTemplate(
+            name="patient_encounters_rows",
+            render=lambda columns: f"""
+            SELECT {columns}
+            FROM `{BIGQUERY_PROJECT}`.{BIGQUERY_PATIENT_ENCOUNTERS_TABLE_ID}
+            WHERE cpf_particao = @cpf and exibicao.indicador = true
+            ORDER BY entry_datetime DESC
+            """,
+            parameters={"cpf": "INT64"},
+            table_id=BIGQUERY_PATIENT_ENCOUNTERS_TABLE_ID,
+            model=Encounter,
+            key_fields=("entry_datetime",),
+        ),
+        QueryTemplate(
+            name="patient_search_by_cpf",
+            render=lambda: f"""
+            SELECT
+                * except(exibicao),
+                cast({USER_PERMISSION_CONDITION} as bool) as is_available
+            FROM `{BIGQUERY_PROJECT}`.{BIGQUERY_PATIENT_SEARCH_TABLE_ID}
+            WHERE cpf = @cpf
+            ORDER BY nome
+            """,
+            parameters={**USER_PERMISSION_PARAMETERS, "cpf": "STRING"},
+            table_id=BIGQUERY_PATIENT_SEARCH_TABLE_ID,
+        ),
+        QueryTemplate(
+            name="patient_search_by_name",
+            render=lambda: f"""
+            SELECT
+                * except(exibicao),
+                cast({USER_PERMISSION_CONDITION} as bool) as is_available
+            FROM `{BIGQUERY_PROJECT}`.{BIGQUERY_PATIENT_SEARCH_TABLE_ID}
+            WHERE search(nome, @name)
+            ORDER BY nome
+            """,
+            parameters={**USER_PERMISSION_PARAMETERS, "name": "STRING"},
+            table_id=BIGQUERY_PATIENT_SEARCH_TABLE_ID,
+        ),
+        # The whole search table, to build the Postgres name search index
+        QueryTemplate(
+            name="patient_search_all",
+            render=lambda: f"""
+            SELECT *
+            FROM `{BIGQUERY_PROJECT}`.{BIGQUERY_PATIENT_SEARCH_TABLE_ID}
+            """,
+            parameters={},
+            table_id=BIGQUERY_PATIENT_SEARCH_TABLE_ID,
+        ),
+        QueryTemplate(
+            name="patient_index_by_cns",
+            render=lambda: f"""
+            SELECT
+                cpf
+            FROM `{BIGQUERY_PROJECT}`.{BIGQUERY_PATIENT_INDEX_TABLE_ID}
+            WHERE cns_particao = @cns
+            LIMIT 1
+            """,
+            parameters={"cns": "INT64"},
+            table_id=BIGQUERY_PATIENT_INDEX_TABLE_ID,
+        ),
+        # The whole CNS index, sorted, to build the local CNS index file
+        QueryTemplate(
+            name="patient_index_all",
+            render=lambda: f"""
+            SELECT
+                cns_particao cns,
+                cpf
+            FROM `{BIGQUERY_PROJECT}`.{BIGQUERY_PATIENT_INDEX_TABLE_ID}
+            WHERE cns_particao IS NOT NULL AND cpf IS NOT NULL
+            ORDER BY cns_particao
+            """,
+            parameters={},
+            table_id=BIGQUERY_PATIENT_INDEX_TABLE_ID,
+        ),
+        QueryTemplate(
+            name="ergon_by_cpf",
+            render=lambda: f"""
+            SELECT * FROM {BIGQUERY_ERGON_TABLE_ID} WHERE cpf_particao = @cpf
+            """,
+            parameters={"cpf": "INT64"},
+            table_id=BIGQUERY_ERGON_TABLE_ID,
+        ),
+        # The whole table, for the in-memory snapshot
+        QueryTemplate(
+            name="ergon_all",
+            render=lambda: f"""
+            SELECT * FROM {BIGQUERY_ERGON_TABLE_ID}
+            """,
+            parameters={},
+            table_id=BIGQUERY_ERGON_TABLE_ID,
+        ),
+        QueryTemplate(
+            name="access_list_by_cpf",
+            render=lambda: f"""
+            SELECT *
+            FROM {BIGQUERY_ACCESS_TABLE_ID}
+            WHERE cpf_particao = @cpf
+            LIMIT 1
+            """,
+            parameters={"cpf": "INT64"},
+            table_id=BIGQUERY_ACCESS_TABLE_ID,
+        ),
+        QueryTemplate(
+            name="access_list_all",
+            render=lambda: f"""
+            SELECT * FROM {BIGQUERY_ACCESS_TABLE_ID}
+            """,
+            parameters={},
+            table_id=BIGQUERY_ACCESS_TABLE_ID,
+        ),
+    ]
+}
+
+
+def get_query_template(name: str) -> QueryTemplate:
+    """
+    Returns the query template registered under `name`.
+    Raises:
+        KeyError: If there is no template with that name.
+    """
+    return QUERY_TEMPLATES[name]
+
+
+def prepare_queries() -> None:
+    """
+    Renders the SQL text of every registered template, so that requests only bind
+    parameters.
+    """
+    for template in QUERY_TEMPLATES.values():
+        template.prepare()
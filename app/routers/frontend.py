@@ -1,32 +1,48 @@
 # -*- coding: utf-8 -*-
 import asyncio
-import unicodedata
+import functools
+import json
 import datetime
-from typing import Annotated, List
-from fastapi import APIRouter, Depends, Request
+import typing
+from typing import Annotated, Dict, List, Optional, Type
+from zoneinfo import ZoneInfo
+from fastapi import APIRouter, Depends, Query, Request, Response
 from fastapi_limiter.depends import RateLimiter
-from fastapi.responses import JSONResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, create_model
 
 from app.decorators import router_request
 from app.dependencies import assert_user_is_active, assert_cpf_is_valid
 from app.models import User
 from app.types.frontend import (
     PatientHeader,
+    PatientHeaderResult,
+    PatientHeadersRequest,
     PatientSummary,
+    PatientBundle,
     Encounter,
     UserInfo,
 )
 from app.types.errors import AcceptTermsEnum
-from app.utils import read_bq, validate_user_access_to_patient_data, get_filter_clause
+from app.utils import (
+    NDJSON_MEDIA_TYPE,
+    accepts_ndjson,
+    check_access_results,
+    ndjson_lines,
+    normalize_name,
+    run_query,
+    stream_query,
+)
+from app.queries import user_has_permission, user_permission_parameters
+from app.search import search_patient_index
+from app.cns_index import lookup_cpf_by_cns
+from app.cache import run_query_cached, read_patient_data_cached, read_patient_headers_cached
 from app.config import (
-    BIGQUERY_PROJECT,
-    BIGQUERY_PATIENT_HEADER_TABLE_ID,
-    BIGQUERY_PATIENT_SEARCH_TABLE_ID,
-    BIGQUERY_PATIENT_INDEX_TABLE_ID,
-    BIGQUERY_PATIENT_SUMMARY_TABLE_ID,
-    BIGQUERY_PATIENT_ENCOUNTERS_TABLE_ID,
+    SEARCH_INDEX_ENABLE,
     REQUEST_LIMIT_MAX,
     REQUEST_LIMIT_WINDOW_SIZE,
+    TIMEZONE,
 )
 from app.types.errors import (
     TermAcceptanceErrorModel
@@ -34,6 +50,83 @@ from app.types.errors import (
 from app.auth.types import AccessErrorModel
 router = APIRouter(prefix="/frontend", tags=["Frontend Application"])
 
+ENCOUNTER_FILTER_TAGS = [
+    "CF/CMS",
+    "HOSPITAL",
+    "CENTRO SAUDE ESCOLA",
+    "UPA",
+    "CCO",
+    "MATERNIDADE",
+    "CER",
+    "POLICLINICA",
+]
+
+
+def check_fields(model: Type[BaseModel], fields: Optional[List[str]]) -> Optional[JSONResponse]:
+    """
+    Returns a 400 response if `fields` has names that are not fields of `model`.
+    """
+    invalid_fields = set(fields or []) - set(model.__fields__)
+    if invalid_fields:
+        return JSONResponse(
+            status_code=400,
+            content={"message": f"Invalid fields: {', '.join(sorted(invalid_fields))}"},
+        )
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def projected_model(model: Type[BaseModel], fields: tuple) -> Type[BaseModel]:
+    """
+    Returns a model with only the given fields of `model`, to validate and serialize rows
+    read with `fields` the way `model` does for whole rows.
+    """
+    hints = typing.get_type_hints(model)
+    return create_model(
+        f"{model.__name__}Fields",
+        __config__=model.__config__,
+        **{name: (hints[name], model.__fields__[name].field_info) for name in fields},
+    )
+
+
+def project_rows(model: Type[BaseModel], fields: List[str], rows: list) -> list:
+    """
+    Validates rows read with `fields` against those fields of `model`, dropping any other
+    column.
+    """
+    projection = projected_model(model, tuple(sorted(set(fields))))
+    return [projection(**row) for row in rows]
+
+
+def parse_encounters_cursor(cursor: str) -> tuple[datetime.datetime, Optional[int]]:
+    """
+    Splits an encounters cursor, `<entry_datetime>~<n>`, where `n` is the number of
+    encounters at `entry_datetime` already returned. A bare `<entry_datetime>` skips every
+    encounter at that time.
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    value, separator, skip = cursor.partition("~")
+    if not separator:
+        return datetime.datetime.fromisoformat(value), None
+    if not skip.isdigit():
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return datetime.datetime.fromisoformat(value), int(skip)
+
+
+def next_encounters_cursor(page: List[dict], cursor: Optional[str]) -> str:
+    """
+    Returns the cursor of the page after `page`, which was read with `cursor`.
+    """
+    last = str(page[-1]["entry_datetime"])
+    skip = sum(1 for row in page if str(row["entry_datetime"]) == last)
+    # A time shared by more encounters than a page holds spans several pages
+    if cursor and skip == len(page):
+        value, _, previous_skip = cursor.partition("~")
+        if value == last and previous_skip.isdigit():
+            skip += int(previous_skip)
+    return f"{last}~{skip}"
+
 
 @router.get("/user")
 async def get_user_info(
@@ -122,40 +215,54 @@ async def search_patient(
     # INDEX USAGE IN CASE OF CNS SEARCH
     # --------------------------------
     if cns:
-        result = await read_bq(
-            f"""
-            SELECT
-                cpf
-            FROM `{BIGQUERY_PROJECT}`.{BIGQUERY_PATIENT_INDEX_TABLE_ID}
-            WHERE cns_particao = {cns}
-            LIMIT 1
-            """,
-            from_file="/tmp/credentials.json",
-        )
-        cpf = result[0]['cpf']
+        cpf = lookup_cpf_by_cns(cns)
+        if cpf is None:
+            result = await run_query("patient_index_by_cns", cns=cns)
+            cpf = result[0]['cpf']
+
+    # --------------------------------
+    # SEARCH BY NAME IN THE LOCAL INDEX
+    # --------------------------------
+    if name and SEARCH_INDEX_ENABLE:
+        entries = await search_patient_index(name)
+        # Falls back to BigQuery if the index can't be queried
+        if entries is not None:
+            results = [
+                {**entry["data"], "is_available": user_has_permission(user, entry)}
+                for entry in entries
+            ]
+            if accepts_ndjson(request):
+                async def stream_entries():
+                    for result in results:
+                        yield result
+
+                return StreamingResponse(
+                    ndjson_lines(stream_entries(), lambda row: json.dumps(jsonable_encoder(row))),
+                    media_type=NDJSON_MEDIA_TYPE,
+                )
+            return results
 
     # --------------------------------
     # SEARCH BY NAME OR CPF
     # --------------------------------
-    clause = ""
     if cpf:
-        clause = f"cpf = '{cpf}'"
+        query_name, params = "patient_search_by_cpf", {"cpf": cpf}
     elif name:
-        name_cleaned = ''.join(c for c in unicodedata.normalize('NFD', name) if unicodedata.category(c) != 'Mn')
-        clause = f"search(nome,'{name_cleaned}')"
-
-    user_permition_filter = get_filter_clause(user)
-    results = await read_bq(
-        f"""
-        SELECT
-            * except(exibicao),
-            cast({user_permition_filter} as bool) as is_available
-        FROM `{BIGQUERY_PROJECT}`.{BIGQUERY_PATIENT_SEARCH_TABLE_ID}
-        WHERE {clause}
-        ORDER BY nome
-        """,
-        from_file="/tmp/credentials.json",
-    )
+        query_name, params = "patient_search_by_name", {"name": normalize_name(name)}
+    params.update(user_permission_parameters(user))
+
+    if accepts_ndjson(request):
+        async def stream_results():
+            async for page in stream_query(query_name, **params):
+                for row in page:
+                    yield row
+
+        return StreamingResponse(
+            ndjson_lines(stream_results(), lambda row: json.dumps(jsonable_encoder(row))),
+            media_type=NDJSON_MEDIA_TYPE,
+        )
+
+    results = await run_query(query_name, **params)
 
     results = sorted(results, key=lambda x: x['nome'])
 
@@ -176,26 +283,59 @@ async def get_patient_header(
     user: Annotated[User, Depends(assert_user_is_active)],
     cpf: Annotated[str, Depends(assert_cpf_is_valid)],
     request: Request,
+    fields: Annotated[Optional[List[str]], Query()] = None,
 ) -> PatientHeader:
-
-    validation_job = validate_user_access_to_patient_data(user, cpf)
-    results_job = read_bq(
-        f"""
-        SELECT *
-        FROM `{BIGQUERY_PROJECT}`.{BIGQUERY_PATIENT_HEADER_TABLE_ID}
-        WHERE
-            cpf_particao = {cpf}
-        """,
-        from_file="/tmp/credentials.json",
+    """
+    Returns the patient's header. With `fields`, only those fields are read and returned.
+    """
+    invalid_fields = check_fields(PatientHeader, fields)
+    if invalid_fields:
+        return invalid_fields
+
+    has_access, response, results = await read_patient_data_cached(
+        user,
+        cpf,
+        query_name="patient_header",
+        fields=fields,
     )
 
-    validation, results = await asyncio.gather(validation_job, results_job)
-
-    has_access, response = validation
-    if has_access:
-        return results[0]
-    else:
+    if not has_access:
         return response
+    if fields:
+        header = project_rows(PatientHeader, fields, results)[0]
+        return JSONResponse(content=jsonable_encoder(header))
+    return results[0]
+
+
+@router_request(
+    method="POST",
+    router=router,
+    path="/patient/headers",
+    response_model=Dict[str, PatientHeaderResult],
+    dependencies=[Depends(RateLimiter(times=REQUEST_LIMIT_MAX, seconds=REQUEST_LIMIT_WINDOW_SIZE))]
+)
+async def get_patient_headers(
+    user: Annotated[User, Depends(assert_user_is_active)],
+    body: PatientHeadersRequest,
+    request: Request,
+) -> Dict[str, PatientHeaderResult]:
+    """
+    Returns the headers of several patients, keyed by CPF. Each entry has the `status` the
+    header endpoint would have returned for the patient and, when it is not 200, the
+    `message` and `type` of the error.
+    """
+    cpfs = list(dict.fromkeys(assert_cpf_is_valid(cpf) for cpf in body.cpfs))
+
+    results = {}
+    for cpf, (has_access, response, headers) in (
+        await read_patient_headers_cached(user, cpfs)
+    ).items():
+        if has_access:
+            results[cpf] = {"status": 200, "header": headers[0]}
+        else:
+            results[cpf] = {"status": response.status_code, **json.loads(response.body)}
+
+    return results
 
 
 @router_request(
@@ -209,25 +349,28 @@ async def get_patient_summary(
     user: Annotated[User, Depends(assert_user_is_active)],
     cpf: Annotated[str, Depends(assert_cpf_is_valid)],
     request: Request,
+    fields: Annotated[Optional[List[str]], Query()] = None,
 ) -> PatientSummary:
-
-    validation_job = validate_user_access_to_patient_data(user, cpf)
-
-    results_job = read_bq(
-        f"""
-        SELECT *
-        FROM `{BIGQUERY_PROJECT}`.{BIGQUERY_PATIENT_SUMMARY_TABLE_ID}
-        WHERE cpf_particao = {cpf}
-        """,
-        from_file="/tmp/credentials.json",
+    """
+    Returns the patient's summary. With `fields`, only those fields are read and returned.
+    """
+    invalid_fields = check_fields(PatientSummary, fields)
+    if invalid_fields:
+        return invalid_fields
+
+    has_access, _, results = await read_patient_data_cached(
+        user,
+        cpf,
+        query_name="patient_summary",
+        fields=fields,
     )
-    validation, results = await asyncio.gather(validation_job, results_job)
 
-    has_access, _ = validation
-    if has_access:
-        return results[0]
-    else:
+    if not has_access:
         return PatientSummary(allergies=[], continuous_use_medications=[])
+    if fields:
+        summary = project_rows(PatientSummary, fields, results)[0]
+        return JSONResponse(content=jsonable_encoder(summary))
+    return results[0]
 
 
 @router_request(
@@ -241,39 +384,192 @@ async def get_patient_encounters(
     user: Annotated[User, Depends(assert_user_is_active)],
     cpf: Annotated[str, Depends(assert_cpf_is_valid)],
     request: Request,
+    response: Response,
+    limit: Annotated[Optional[int], Query(ge=1, le=500)] = None,
+    cursor: Optional[str] = None,
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+    filter_tags: Annotated[Optional[List[str]], Query()] = None,
+    fields: Annotated[Optional[List[str]], Query()] = None,
 ) -> List[Encounter]:
+    """
+    Returns the patient's encounters. Without parameters, the whole history is returned.
+    With `limit` and/or `cursor`, the most recent encounters come first, and the
+    `X-Next-Cursor` response header holds the `cursor` of the next (older) page, see
+    `parse_encounters_cursor`.
+    With `fields`, only those fields (and `entry_datetime`) are read and returned.
+    """
+    invalid_tags = set(filter_tags or []) - set(ENCOUNTER_FILTER_TAGS)
+    if invalid_tags:
+        return JSONResponse(
+            status_code=400,
+            content={"message": f"Invalid filter tags: {', '.join(sorted(invalid_tags))}"},
+        )
+    invalid_fields = check_fields(Encounter, fields)
+    if invalid_fields:
+        return invalid_fields
+    # Pages are cut at an `entry_datetime`, so it is always returned
+    encounter_fields = [*fields, "entry_datetime"] if fields else None
+    cursor_datetime, cursor_skip = None, None
+    if cursor is not None:
+        try:
+            cursor_datetime, cursor_skip = parse_encounters_cursor(cursor)
+        except ValueError:
+            return JSONResponse(status_code=400, content={"message": f"Invalid cursor: {cursor}"})
+
+    def as_local_datetime(value: Optional[datetime.datetime]) -> Optional[datetime.datetime]:
+        # `entry_datetime` has no timezone, so aware values are compared in local time
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(ZoneInfo(TIMEZONE)).replace(tzinfo=None)
+        return value
+
+    filters = {
+        "cursor": as_local_datetime(cursor_datetime),
+        "cursor_skip": cursor_skip,
+        "since": as_local_datetime(since),
+        "until": as_local_datetime(until),
+        "filter_tags": sorted(set(filter_tags or [])),
+    }
 
-    validation_job = validate_user_access_to_patient_data(user, cpf)
+    is_paginated = limit is not None or cursor is not None
+
+    if accepts_ndjson(request):
+        # Streams come straight from BigQuery, a page at a time, without the cache. With
+        # `limit`, the next page's cursor is the `entry_datetime` of the last line and the
+        # number of lines at the end of the page with that `entry_datetime`.
+        pages = stream_query(
+            "patient_encounters",
+            cpf=cpf,
+            limit=limit + (cursor_skip or 0) if limit is not None else None,
+            fields=fields,
+            **filters,
+            **user_permission_parameters(user),
+        )
+        first_page = await anext(pages, [])
+        has_access, _ = check_access_results(first_page)
+        if not has_access:
+            await pages.aclose()
+            first_page = []
+
+        async def stream_payloads():
+            for result in first_page:
+                if result["payload"] is not None:
+                    yield result["payload"]
+            if has_access:
+                async for page in pages:
+                    for result in page:
+                        yield result["payload"]
+
+        async def stream_encounters():
+            skipped = 0
+            async for payload in stream_payloads():
+                # The first encounters are the ones at the cursor that were already seen
+                if skipped < (cursor_skip or 0):
+                    skipped += 1
+                    continue
+                payload.pop("page_order", None)
+                yield payload
+
+        return StreamingResponse(
+            ndjson_lines(
+                stream_encounters(),
+                (lambda row: project_rows(Encounter, encounter_fields, [row])[0].json())
+                if fields
+                else (lambda row: Encounter(**row).json()),
+            ),
+            media_type=NDJSON_MEDIA_TYPE,
+        )
+
+    cache_key_parts = ()
+    if is_paginated or since or until or filter_tags:
+        cache_key_parts = (
+            limit,
+            cursor,
+            since,
+            until,
+            ",".join(sorted(set(filter_tags or []))),
+        )
 
-    results_job = read_bq(
-        f"""
-        SELECT *
-        FROM `{BIGQUERY_PROJECT}`.{BIGQUERY_PATIENT_ENCOUNTERS_TABLE_ID}
-        WHERE cpf_particao = {cpf} and exibicao.indicador = true
-        """,
-        from_file="/tmp/credentials.json",
+    has_access, _, results = await read_patient_data_cached(
+        user,
+        cpf,
+        query_name="patient_encounters",
+        cache_key_parts=cache_key_parts,
+        fields=fields,
+        # One extra row tells whether there is a next page
+        limit=limit + (cursor_skip or 0) + 1 if limit is not None else None,
+        **filters,
     )
-    validation, results = await asyncio.gather(validation_job, results_job)
 
-    has_access, _ = validation
-    if has_access:
-        return results
-    else:
+    if not has_access:
         return []
 
+    # The rows may be cached, so they are copied before `page_order` is removed
+    results = [
+        {name: value for name, value in row.items() if name != "page_order"}
+        for row in results[cursor_skip or 0:]
+    ]
+    next_cursor = None
+    if limit is not None and len(results) > limit:
+        results = results[:limit]
+        next_cursor = next_encounters_cursor(results, cursor)
+        response.headers["X-Next-Cursor"] = next_cursor
+
+    if fields:
+        return JSONResponse(
+            content=jsonable_encoder(project_rows(Encounter, encounter_fields, results)),
+            headers={"X-Next-Cursor": next_cursor} if next_cursor else None,
+        )
+    return results
+
+
+@router_request(
+    method="GET",
+    router=router,
+    path="/patient/bundle/{cpf}",
+    response_model=PatientBundle,
+    responses={
+        404: {"model": AccessErrorModel},
+        403: {"model": AccessErrorModel}
+    },
+    dependencies=[Depends(RateLimiter(times=REQUEST_LIMIT_MAX, seconds=REQUEST_LIMIT_WINDOW_SIZE))]
+)
+async def get_patient_bundle(
+    user: Annotated[User, Depends(assert_user_is_active)],
+    cpf: Annotated[str, Depends(assert_cpf_is_valid)],
+    request: Request,
+) -> PatientBundle:
+
+    # The header read carries the only access check of the bundle, so the other reads
+    # only start once it passed: a denied user must not cause jobs or cache fills
+    has_access, response, header = await read_patient_data_cached(
+        user,
+        cpf,
+        query_name="patient_header",
+    )
+    if not has_access:
+        return response
+
+    summary, encounters = await asyncio.gather(
+        run_query_cached("patient_summary_rows", cpf=cpf),
+        run_query_cached(
+            "patient_encounters_rows",
+            cpf=cpf,
+        ),
+    )
+
+    return {
+        "header": header[0],
+        "summary": (
+            summary[0] if summary else PatientSummary(allergies=[], continuous_use_medications=[])
+        ),
+        "encounters": encounters,
+    }
+
 
 @router.get("/patient/filter_tags")
 async def get_filter_tags(_: Annotated[User, Depends(assert_user_is_active)]) -> List[str]:
-    return [
-        "CF/CMS",
-        "HOSPITAL",
-        "CENTRO SAUDE ESCOLA",
-        "UPA",
-        "CCO",
-        "MATERNIDADE",
-        "CER",
-        "POLICLINICA",
-    ]
+    return ENCOUNTER_FILTER_TAGS
 
 
 @router.get("/metadata")
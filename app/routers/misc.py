@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 from fastapi import APIRouter
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from tortoise import Tortoise
 
+from app.metrics import render_metrics
 from app.utils import read_bq
 
 
@@ -47,3 +48,11 @@ async def health() -> dict:
         content=result,
         status_code=200 if result["success"] else 503,
     )
+
+
+@router.get(path="/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    return PlainTextResponse(
+        content=render_metrics(),
+        media_type="text/plain; version=0.0.4",
+    )
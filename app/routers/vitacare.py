@@ -10,6 +10,7 @@ from datetime import datetime
 from loguru import logger
 
 from app.dependencies import get_current_user
+from app.datalake_hub import HubTokenError, hub_token_manager
 from app.config import base as config
 from app.models import User
 
@@ -41,42 +42,21 @@ async def load_data(
         entity_name = "atendimento"
 
     try:
-        async with httpx.AsyncClient() as client:
-            logger.info(f"Getting token from datalake hub...")
-            response = await client.post(
-                url=f"{config.DATALAKE_HUB_URL}auth/token",
-                headers={
-                    "accept": "application/json",
-                    "Content-Type": "application/x-www-form-urlencoded"
-                },
-                data={
-                    "grant_type": "password",
-                    "username": config.DATALAKE_HUB_USERNAME,
-                    "password": config.DATALAKE_HUB_PASSWORD,
-                },
-                timeout=90
-            )
-
-            if response.status_code != 200:
-                return JSONResponse(
-                    status_code=response.status_code,
-                    content={
-                        "message": "Failed to get token from datalake hub",
-                        "content": response.text
-                    }
-                )
-
-            token = response.json().get("access_token")
-
-            logger.info(f"Sending data to datalake hub...")
-            response = await client.post(
-                url=f"{config.DATALAKE_HUB_URL}vitacare/{entity_name}",
-                headers={
-                    "Authorization": f"Bearer {token}"
-                },
-                json=json.loads(raw_data.json()),
-                timeout=90
-            )
+        logger.info(f"Sending data to datalake hub...")
+        response = await hub_token_manager.request(
+            "POST",
+            f"{config.DATALAKE_HUB_URL}vitacare/{entity_name}",
+            json=json.loads(raw_data.json()),
+            timeout=90
+        )
+    except HubTokenError as e:
+        return JSONResponse(
+            status_code=e.status_code,
+            content={
+                "message": "Failed to get token from datalake hub",
+                "content": e.content
+            }
+        )
     except httpx.TimeoutException as e:
         logger.error(f"Timeout error: {e}")
         return JSONResponse(
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import datetime
+import json
+from typing import Optional
+
+from fastapi.encoders import jsonable_encoder
+from loguru import logger
+from tortoise import connections
+
+from app.config import BIGQUERY_STREAM_PAGE_SIZE, SEARCH_INDEX_RESULT_LIMIT
+from app.models import PatientSearchEntry
+from app.utils import normalize_name, stream_query
+
+SEARCH_INDEX_TABLE = PatientSearchEntry._meta.db_table
+
+# Every word of the name must appear in the indexed name, as BigQuery's `search` requires.
+# Each word gets its own LIKE, which the trigram GIN index serves (it can't serve
+# `LIKE ALL` over an array parameter), and `similarity` ranks the matches
+SEARCH_INDEX_QUERY = """
+    SELECT cpf, data, unidades_cadastro, ap_cadastro
+    FROM "{table}"
+    WHERE {conditions}
+    ORDER BY similarity(normalized_name, ${name_parameter}) DESC, name
+    LIMIT ${limit_parameter}
+"""
+
+
+def normalize_indexed_name(name: str) -> str:
+    """
+    Normalizes a name for the search index: accents stripped as in `normalize_name`,
+    lower case and single spaces.
+    """
+    return " ".join(normalize_name(name).lower().split())
+
+
+def _like_pattern(word: str) -> str:
+    escaped = word.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+async def search_patient_index(
+    name: str,
+    limit: int = SEARCH_INDEX_RESULT_LIMIT,
+    table: str = SEARCH_INDEX_TABLE,
+) -> Optional[list]:
+    """
+    Searches patients by name in the Postgres search index, best matches first.
+    Args:
+        name (str): The name, or part of it, to search for.
+        limit (int, optional): The maximum number of patients returned.
+        table (str, optional): The index table. Only changed by benchmarks.
+    Returns:
+        list: The matching entries, as dictionaries with the `cpf`, `data` (the search table
+            row), `unidades_cadastro` and `ap_cadastro` keys. None if the index could not be
+            queried, so that the caller can fall back to BigQuery.
+    """
+    normalized_name = normalize_indexed_name(name)
+    if not normalized_name:
+        return []
+
+    patterns = [_like_pattern(word) for word in normalized_name.split()]
+    query = SEARCH_INDEX_QUERY.format(
+        table=table,
+        conditions=" AND ".join(
+            f"normalized_name LIKE ${index}" for index in range(1, len(patterns) + 1)
+        ),
+        name_parameter=len(patterns) + 1,
+        limit_parameter=len(patterns) + 2,
+    )
+
+    try:
+        entries = await connections.get("default").execute_query_dict(
+            query, [*patterns, normalized_name, limit]
+        )
+    except Exception as e:
+        logger.warning(f"Error searching the patient index: {e}")
+        return None
+
+    # Raw queries return JSONB columns as text
+    for entry in entries:
+        for column in ("data", "unidades_cadastro", "ap_cadastro"):
+            if isinstance(entry[column], str):
+                entry[column] = json.loads(entry[column])
+    return entries
+
+
+def build_search_entry(row: dict, synced_at: datetime.datetime) -> PatientSearchEntry:
+    """
+    Turns a row of the BigQuery patient search table into a search index entry.
+    """
+    data = {key: value for key, value in row.items() if key != "exibicao"}
+    exibicao = row.get("exibicao") or {}
+    return PatientSearchEntry(
+        cpf=row["cpf"],
+        name=row["nome"],
+        normalized_name=normalize_indexed_name(row["nome"] or ""),
+        data=jsonable_encoder(data),
+        unidades_cadastro=exibicao.get("unidades_cadastro"),
+        ap_cadastro=exibicao.get("ap_cadastro"),
+        synced_at=synced_at,
+    )
+
+
+async def refresh_search_index(page_size: int = BIGQUERY_STREAM_PAGE_SIZE) -> int:
+    """
+    Copies the BigQuery patient search table into the Postgres search index. Entries are
+    upserted page by page, so searches keep working during the refresh, and the patients
+    no longer in BigQuery are deleted at the end.
+    Returns:
+        int: The number of entries written.
+    """
+    started_at = datetime.datetime.now(datetime.timezone.utc)
+    count = 0
+
+    async for page in stream_query("patient_search_all", page_size=page_size):
+        entries = [build_search_entry(row, started_at) for row in page if row.get("cpf")]
+        await PatientSearchEntry.bulk_create(
+            entries,
+            on_conflict=["cpf"],
+            update_fields=[
+                "name",
+                "normalized_name",
+                "data",
+                "unidades_cadastro",
+                "ap_cadastro",
+                "synced_at",
+            ],
+        )
+        count += len(entries)
+        logger.info(f"Indexed {count} patients")
+
+    deleted = await PatientSearchEntry.filter(synced_at__lt=started_at).delete()
+    logger.info(f"Removed {deleted} patients no longer in the search table")
+    return count
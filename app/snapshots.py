@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+# =============================================
+# In-memory copies of small BigQuery tables that
+# are read by CPF on every login, synced in the
+# background. Lookups that miss the snapshot, or
+# happen while it is stale, go to BigQuery.
+# Hits are not checked against BigQuery, so rows
+# removed there are still found until the next
+# sync: revocations lag by up to `max_age`.
+# =============================================
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from app.config import (
+    SNAPSHOT_ENABLE,
+    SNAPSHOT_REFRESH_INTERVAL,
+    SNAPSHOT_MAX_AGE,
+    SNAPSHOT_PAGE_SIZE,
+)
+from app.metrics import Counter, Gauge, Histogram, on_collect
+from app.utils import run_query, stream_query
+
+snapshot_rows = Gauge(
+    "hci_snapshot_rows",
+    "Rows held by an in-memory table snapshot, by table",
+)
+snapshot_sync_lag_seconds = Gauge(
+    "hci_snapshot_sync_lag_seconds",
+    "Seconds since an in-memory table snapshot was last synced, by table",
+)
+snapshot_sync_seconds = Histogram(
+    "hci_snapshot_sync_seconds",
+    "Time taken to sync an in-memory table snapshot, by table",
+)
+snapshot_sync_errors = Counter(
+    "hci_snapshot_sync_errors_total",
+    "Failed syncs of an in-memory table snapshot, by table",
+)
+snapshot_lookups = Counter(
+    "hci_snapshot_lookups_total",
+    "Lookups in an in-memory table snapshot, by table and result (hit, miss or stale)",
+)
+
+REGISTERED_SNAPSHOTS = []
+
+
+class TableSnapshot:
+    """
+    A copy of a BigQuery table, indexed by its `cpf_particao` column.
+    Args:
+        name (str): The name used in logs and metrics.
+        query_name (str): The query template that reads the whole table.
+        fallback_query_name (str): The query template that reads the rows of one CPF,
+            run when the snapshot can't answer.
+        refresh_interval (float, optional): Seconds between syncs.
+        max_age (float, optional): Seconds after the last sync after which the snapshot is
+            no longer used. This bounds how long a row removed from the table, such as a
+            revoked access, is still returned, so keep it close to `refresh_interval`.
+        page_size (int, optional): Rows read per page while syncing.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        query_name: str,
+        fallback_query_name: str,
+        refresh_interval: float = SNAPSHOT_REFRESH_INTERVAL,
+        max_age: float = SNAPSHOT_MAX_AGE,
+        page_size: int = SNAPSHOT_PAGE_SIZE,
+    ):
+        self.name = name
+        self.query_name = query_name
+        self.fallback_query_name = fallback_query_name
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self.page_size = page_size
+        self._rows: Dict[int, List[dict]] = {}
+        self._synced_at: Optional[float] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        REGISTERED_SNAPSHOTS.append(self)
+
+    @property
+    def synced_at(self) -> Optional[float]:
+        """
+        The Unix time of the last sync, or None if the snapshot was never synced.
+        """
+        return self._synced_at
+
+    def is_fresh(self) -> bool:
+        return self._synced_at is not None and time.time() - self._synced_at <= self.max_age
+
+    async def refresh(self) -> int:
+        """
+        Reads the whole table and replaces the snapshot with it.
+        Returns:
+            int: The number of rows read.
+        """
+        start = time.perf_counter()
+        started_at = time.time()
+        rows: Dict[int, List[dict]] = {}
+        count = 0
+        async for page in stream_query(self.query_name, page_size=self.page_size):
+            for row in page:
+                if row.get("cpf_particao") is not None:
+                    rows.setdefault(int(row["cpf_particao"]), []).append(row)
+                    count += 1
+
+        self._rows = rows
+        self._synced_at = started_at
+        snapshot_rows.set(count, table=self.name)
+        snapshot_sync_seconds.observe(time.perf_counter() - start, table=self.name)
+        logger.info(f"Synced {count} rows of the {self.name} snapshot")
+        return count
+
+    async def get_rows(self, cpf: str) -> list:
+        """
+        Returns the rows of a CPF, from the snapshot when it is fresh and has them, or from
+        the fallback query otherwise, so that rows added since the last sync are found.
+        """
+        if SNAPSHOT_ENABLE:
+            rows = self._lookup(cpf)
+            if rows:
+                return rows
+        return await run_query(self.fallback_query_name, cpf=cpf)
+
+    def _lookup(self, cpf: str) -> Optional[list]:
+        if not self.is_fresh():
+            snapshot_lookups.inc(table=self.name, result="stale")
+            return None
+        try:
+            rows = self._rows.get(int(cpf))
+        except ValueError:
+            rows = None
+        snapshot_lookups.inc(table=self.name, result="hit" if rows else "miss")
+        return rows
+
+    async def _refresh_periodically(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                snapshot_sync_errors.inc(table=self.name)
+                logger.error(f"Error syncing the {self.name} snapshot: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self) -> None:
+        """
+        Starts syncing the snapshot in the background, every `refresh_interval` seconds.
+        """
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_periodically())
+
+    async def close(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+
+access_list_snapshot = TableSnapshot("access_list", "access_list_all", "access_list_by_cpf")
+ergon_snapshot = TableSnapshot("ergon", "ergon_all", "ergon_by_cpf")
+
+
+def start_snapshots() -> None:
+    if not SNAPSHOT_ENABLE:
+        return
+    for snapshot in REGISTERED_SNAPSHOTS:
+        snapshot.start()
+
+
+async def close_snapshots() -> None:
+    for snapshot in REGISTERED_SNAPSHOTS:
+        await snapshot.close()
+
+
+@on_collect
+def collect_snapshot_metrics() -> None:
+    for snapshot in REGISTERED_SNAPSHOTS:
+        if snapshot.synced_at is not None:
+            snapshot_sync_lag_seconds.set(time.time() - snapshot.synced_at, table=snapshot.name)
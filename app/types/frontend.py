@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 from typing import Optional, List
-from pydantic import BaseModel
+from pydantic import BaseModel, conlist
 from datetime import datetime
 
+from app.config import PATIENT_HEADERS_MAX_CPFS
+from app.enums import AccessErrorEnum
+
 # Clinic Family model
 class FamilyClinic(BaseModel):
     cnes: Optional[str]
@@ -115,3 +118,21 @@ class PatientHeader(BaseModel):
     medical_responsible: List[Professional]
     nursing_responsible: List[Professional]
     validated: bool
+
+
+class PatientHeadersRequest(BaseModel):
+    cpfs: conlist(str, min_items=1, max_items=PATIENT_HEADERS_MAX_CPFS)
+
+
+# One entry of a batch header lookup: the header, or why it was not returned
+class PatientHeaderResult(BaseModel):
+    status: int
+    header: Optional[PatientHeader]
+    message: Optional[str]
+    type: Optional[AccessErrorEnum]
+
+
+class PatientBundle(BaseModel):
+    header: PatientHeader
+    summary: PatientSummary
+    encounters: List[Encounter]
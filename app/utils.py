@@ -1,32 +1,81 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import copy
 import hashlib
 import json
 import os
 import base64
+import time
+import unicodedata
+from typing import Any, AsyncIterable, AsyncIterator, Callable, List, Optional
 
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import bigquery
 from google.oauth2 import service_account
-from asyncer import asyncify
+from requests.adapters import HTTPAdapter
 from loguru import logger
 from fastapi import Request
 from fastapi.responses import JSONResponse
 from app.models import User
 from app.enums import AccessErrorEnum
+from app.executor import bigquery_executor, bigquery_stats_executor
+from app.metrics import Counter, Histogram, current_endpoint
+from app.queries import get_query_template, user_permission_parameters
 from app.config import (
-    BIGQUERY_PROJECT,
-    BIGQUERY_PATIENT_HEADER_TABLE_ID,
-    BIGQUERY_ERGON_TABLE_ID,
+    BIGQUERY_HTTP_POOL_SIZE,
+    BIGQUERY_STREAM_PAGE_SIZE,
+    BIGQUERY_JOB_STATS_ENABLE,
 )
 
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+_bigquery_client: bigquery.Client | None = None
+
+# Queries currently running, by SQL text and parameters, so identical concurrent calls
+# share one job, and how many callers wait for each of them
+_inflight_queries: dict[tuple[str, str], asyncio.Future] = {}
+_inflight_callers: dict[tuple[str, str], int] = {}
+
+read_bq_calls = Counter(
+    "hci_read_bq_calls_total",
+    "Calls to read_bq, by whether they started a BigQuery job or joined an identical "
+    "in-flight one",
+)
+bigquery_job_wall_seconds = Histogram(
+    "hci_bigquery_job_wall_seconds",
+    "Time spent waiting for BigQuery query results, by endpoint",
+)
+bigquery_job_queue_seconds = Histogram(
+    "hci_bigquery_job_queue_seconds",
+    "Time BigQuery jobs waited for slots before starting, by endpoint",
+)
+bigquery_job_bytes_processed = Histogram(
+    "hci_bigquery_job_bytes_processed",
+    "Bytes processed by BigQuery jobs, by endpoint",
+    buckets=(1e6, 1e7, 1e8, 1e9, 1e10, 1e11, 1e12),
+)
+bigquery_job_slot_millis = Histogram(
+    "hci_bigquery_job_slot_millis",
+    "Slot-milliseconds consumed by BigQuery jobs, by endpoint",
+    buckets=(10, 100, 1e3, 1e4, 1e5, 1e6, 1e7),
+)
+bigquery_jobs = Counter(
+    "hci_bigquery_jobs_total",
+    "BigQuery jobs run, by endpoint and whether the result came from BigQuery's cache",
+)
+
+# Job statistics lookups running in the background, kept referenced until they finish
+_job_stats_tasks: set[asyncio.Task] = set()
+
 
 async def employee_verify(user: User) -> bool:
     if not user.is_ergon_validation_required:
         return True
 
-    ergon_register = await read_bq(
-        f"""SELECT * FROM {BIGQUERY_ERGON_TABLE_ID} WHERE cpf_particao = {user.cpf}""",
-        from_file="/tmp/credentials.json",
-    )
+    # Imported here because app.snapshots imports this module
+    from app.snapshots import ergon_snapshot
+
+    ergon_register = await ergon_snapshot.get_rows(user.cpf)
     if len(ergon_register) == 0 or len(ergon_register[0]["dados"]) == 0:
         logger.info(f"User {user.username} not found in Ergon")
         return False
@@ -38,6 +87,15 @@ async def employee_verify(user: User) -> bool:
         return True
 
 
+def normalize_name(name: str) -> str:
+    """
+    Strips the accents of a name, as the patient search expects.
+    """
+    return "".join(
+        c for c in unicodedata.normalize("NFD", name) if unicodedata.category(c) != "Mn"
+    )
+
+
 def generate_dictionary_fingerprint(dict_obj: dict) -> str:
     """
     Generate a fingerprint for a dictionary object.
@@ -81,16 +139,184 @@ def prepare_gcp_credential() -> None:
     return
 
 
-async def read_bq(query, from_file="/tmp/credentials.json"):
+def create_bigquery_client(from_file="/tmp/credentials.json") -> bigquery.Client:
+    """
+    Builds a BigQuery client whose HTTP session keeps a pool of connections alive, so
+    consecutive queries reuse the same TLS connections instead of opening new ones.
+    Args:
+        from_file (str, optional): The path to the service account credentials JSON file.
+            Defaults to "/tmp/credentials.json".
+    Returns:
+        bigquery.Client: A client backed by a pooled authorized session.
+    """
+    credentials = service_account.Credentials.from_service_account_file(
+        from_file,
+        scopes=bigquery.Client.SCOPE,
+    )
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(
+        pool_connections=BIGQUERY_HTTP_POOL_SIZE,
+        pool_maxsize=BIGQUERY_HTTP_POOL_SIZE,
+    )
+    session.mount("https://", adapter)
+
+    return bigquery.Client(
+        project=credentials.project_id,
+        credentials=credentials,
+        _http=session,
+    )
+
+
+def init_bigquery_client(from_file="/tmp/credentials.json") -> bigquery.Client:
+    """
+    Creates the process-wide BigQuery client. Called once per worker by `api_lifespan`.
+    """
+    global _bigquery_client
+
+    if _bigquery_client is None:
+        logger.info("Creating pooled BigQuery client")
+        _bigquery_client = create_bigquery_client(from_file)
+    return _bigquery_client
+
+
+def get_bigquery_client(from_file="/tmp/credentials.json") -> bigquery.Client:
+    """
+    Returns the process-wide BigQuery client, creating it on first use when the
+    application lifespan has not done so (e.g. scripts and test fixtures).
+    """
+    if _bigquery_client is None:
+        return init_bigquery_client(from_file)
+    return _bigquery_client
+
+
+def close_bigquery_client() -> None:
+    """
+    Closes the process-wide BigQuery client and its pooled HTTP connections.
+    """
+    global _bigquery_client
+
+    if _bigquery_client is not None:
+        logger.info("Closing pooled BigQuery client")
+        _bigquery_client.close()
+        _bigquery_client = None
+
+
+async def _log_job_stats(client: bigquery.Client, stats: dict) -> None:
+    # Only look the job up when the result did not carry its statistics
+    missing_stats = stats["total_bytes_processed"] is None or stats["cache_hit"] is None
+    if stats["job_id"] is not None and missing_stats and BIGQUERY_JOB_STATS_ENABLE:
+        try:
+            job = await bigquery_stats_executor.run(
+                client.get_job, stats["job_id"], location=stats["location"]
+            )
+        except Exception as e:
+            logger.warning(f"Error reading statistics of BigQuery job {stats['job_id']}: {e}")
+        else:
+            stats["total_bytes_processed"] = job.total_bytes_processed
+            stats["slot_millis"] = job.slot_millis
+            stats["cache_hit"] = job.cache_hit
+            if job.created is not None and job.started is not None:
+                stats["queue_seconds"] = (job.started - job.created).total_seconds()
+
+    endpoint = stats["endpoint"]
+    if stats["total_bytes_processed"] is not None:
+        bigquery_job_bytes_processed.observe(stats["total_bytes_processed"], endpoint=endpoint)
+    if stats["slot_millis"] is not None:
+        bigquery_job_slot_millis.observe(stats["slot_millis"], endpoint=endpoint)
+    if stats["queue_seconds"] is not None:
+        bigquery_job_queue_seconds.observe(stats["queue_seconds"], endpoint=endpoint)
+    bigquery_jobs.inc(endpoint=endpoint, cache_hit=str(stats["cache_hit"]).lower())
+
+    logger.info(f"BigQuery job stats: {json.dumps(stats)}")
+
+
+def record_job_stats(
+    client: bigquery.Client, row_iterator, wall_seconds: float, endpoint: str
+) -> None:
+    """
+    Records the cost and latency of a finished BigQuery query, labelled with the endpoint
+    that ran it, as metrics and as a JSON log line. Bytes processed, slot usage, cache hit
+    and queue time are read from the result when the client library exposes them there.
+    Older versions, such as the one locked for this API, only return the job ID, and the
+    statistics are then looked up from the job in the background when
+    `BIGQUERY_JOB_STATS_ENABLE` is set, at the cost of one extra `get_job` call per query.
+    Lookups run in their own executor; when its queue is full, the statistics of that
+    query are logged without them.
+    Args:
+        client (bigquery.Client): The client that ran the query.
+        row_iterator (RowIterator): The result returned by `query_and_wait`.
+        wall_seconds (float): How long `query_and_wait` took.
+        endpoint (str): The route path of the request that ran the query.
+    """
+    bigquery_job_wall_seconds.observe(wall_seconds, endpoint=endpoint)
+
+    stats = {
+        "endpoint": endpoint,
+        "job_id": getattr(row_iterator, "job_id", None),
+        "location": getattr(row_iterator, "location", None),
+        "wall_seconds": round(wall_seconds, 3),
+        "total_bytes_processed": getattr(row_iterator, "total_bytes_processed", None),
+        "slot_millis": getattr(row_iterator, "slot_millis", None),
+        "cache_hit": getattr(row_iterator, "cache_hit", None),
+        "queue_seconds": None,
+    }
+    created = getattr(row_iterator, "created", None)
+    started = getattr(row_iterator, "started", None)
+    if created is not None and started is not None:
+        stats["queue_seconds"] = (started - created).total_seconds()
+    task = asyncio.ensure_future(_log_job_stats(client, stats))
+    _job_stats_tasks.add(task)
+    task.add_done_callback(_job_stats_tasks.discard)
+
+
+def _forget_inflight_query(key: tuple[str, str], job: asyncio.Future) -> int:
+    # Stops new calls from joining `job` and returns how many callers share it
+    if _inflight_queries.get(key) is not job:
+        return 1
+    del _inflight_queries[key]
+    return _inflight_callers.pop(key)
+
+
+def _finish_inflight_query(key: tuple[str, str], job: asyncio.Future) -> None:
+    _forget_inflight_query(key, job)
+    # Mark the exception as retrieved in case every caller was cancelled meanwhile
+    if not job.cancelled():
+        job.exception()
+
+
+def _query_parameters_key(query_parameters: list | None) -> str:
+    return json.dumps(
+        [parameter.to_api_repr() for parameter in query_parameters or []],
+        sort_keys=True,
+        default=str,
+    )
+
+
+async def read_bq(query, from_file="/tmp/credentials.json", query_parameters=None):
     """
     Asynchronously reads data from Google BigQuery using a provided SQL query.
+    Concurrent calls with an identical query and parameters share a single BigQuery job,
+    and each of them gets its own deep copy of the rows.
     Args:
         query (str): The SQL query to execute on BigQuery.
-        from_file (str, optional): The path to the service account credentials JSON file.
+        from_file (str, optional): The path to the service account credentials JSON file,
+            only used if the shared client was not created yet.
             Defaults to "/tmp/credentials.json".
+        query_parameters (list, optional): The BigQuery query parameters referenced by the
+            query as `@name`. Prefer `run_query`, which builds them from a named template.
     Returns:
         list: A list of dictionaries, where each dictionary represents a row from the query result.
     """
+    parameters_key = _query_parameters_key(query_parameters)
+    key = (query, parameters_key)
+
+    inflight = _inflight_queries.get(key)
+    if inflight is not None:
+        logger.info(f"Joining in-flight BigQuery query: {query}")
+        read_bq_calls.inc(mode="coalesced")
+        _inflight_callers[key] += 1
+        results = await asyncio.shield(inflight)
+        return results.pop()
 
     logger.debug(
         f"""Reading BigQuery with query (QUERY_PREVIEW_ENABLED={
@@ -98,43 +324,71 @@ async def read_bq(query, from_file="/tmp/credentials.json"):
     }): {query}"""
     )
 
-    logger.info(f"Querying BigQuery: {query}")
+    logger.info(f"Querying BigQuery: {query} with parameters {parameters_key}")
 
-    def execute_job():
-        credentials = service_account.Credentials.from_service_account_file(
-            from_file,
-        )
-        client = bigquery.Client(credentials=credentials)
-        row_iterator = client.query_and_wait(query)
-        return [dict(row) for row in row_iterator]
+    client = get_bigquery_client(from_file)
+    endpoint = current_endpoint.get()
+    job_config = bigquery.QueryJobConfig(query_parameters=query_parameters or [])
 
-    rows = await asyncify(execute_job)()
-
-    return rows
-
-def get_filter_clause(user: User) -> str:
+    def execute_job():
+        started_at = time.perf_counter()
+        row_iterator = client.query_and_wait(query, job_config=job_config)
+        rows = [dict(row) for row in row_iterator]
+        return rows, row_iterator, time.perf_counter() - started_at
+
+    async def run_job():
+        try:
+            rows, row_iterator, wall_seconds = await bigquery_executor.run(execute_job)
+        finally:
+            callers = _forget_inflight_query(key, job)
+        record_job_stats(client, row_iterator, wall_seconds, endpoint)
+        # Callers may change the rows they get, so none of them share rows or values
+        return [rows, *(copy.deepcopy(rows) for _ in range(callers - 1))]
+
+    job = asyncio.ensure_future(run_job())
+    _inflight_queries[key] = job
+    _inflight_callers[key] = 1
+    job.add_done_callback(lambda future: _finish_inflight_query(key, future))
+    read_bq_calls.inc(mode="executed")
+
+    results = await asyncio.shield(job)
+
+    return results.pop()
+
+
+async def run_query(
+    query_name: str,
+    /,
+    *,
+    fields: Optional[List[str]] = None,
+    **params,
+):
     """
-    Builds a filter clause based on the user's role and permissions.
+    Runs the query template registered as `query_name` in `app.queries` with the given
+    parameter values.
+    Args:
+        query_name (str): The name of the query template.
+        fields (list, optional): Only select these fields of the template's model.
+        **params: The values of the template's parameters.
+    Returns:
+        list: The rows, as returned by `read_bq`.
+    Raises:
+        TypeError: If a required parameter is missing or an unknown one is given.
     """
-    filter_clause = {
-        "full_permission": "1 = 1",
-        "only_from_same_cpf": "cpf = '{user_cpf}'",
-        "only_from_same_ap": "'{user_cnes}' IN UNNEST(exibicao.unidades_cadastro)",
-        "only_from_same_cnes": "'{user_ap}' IN UNNEST(exibicao.ap_cadastro)",
-    }
-    return filter_clause[user.access_level].format(
-        user_cpf=user.cpf,
-        user_ap=user.ap,
-        user_cnes=user.cnes,
+    template = get_query_template(query_name)
+    return await read_bq(
+        template.sql_for(fields),
+        from_file="/tmp/credentials.json",
+        query_parameters=template.build_parameters(**params),
     )
 
 
-async def validate_user_access_to_patient_data(user: User, cpf: str) -> tuple[bool, JSONResponse]:
+def check_access_results(results: list) -> tuple[bool, JSONResponse]:
     """
-    Validates if a user has access to a patient's data based on their role and permissions.
+    Turns the access flags returned by BigQuery for a patient into an access decision.
     Args:
-        user (User): The user object containing user details and role permissions.
-        cpf (str): The CPF (Cadastro de Pessoas Físicas) number of the patient.
+        results (list): Rows with the `data_is_displayable`, `data_display_reasons` and
+            `user_has_permition` columns. Empty if the patient was not found.
     Returns:
         tuple: A tuple containing a boolean and a JSONResponse.
             - If the user has permission and the data is displayable, returns (True, None).
@@ -144,22 +398,6 @@ async def validate_user_access_to_patient_data(user: User, cpf: str) -> tuple[bo
             - If the data is not displayable, returns (False, JSONResponse) with a 403 status
                 code and reasons for restriction.
     """
-    user_permition_filter = get_filter_clause(user)
-
-    # Build the query
-    query = f"""
-    SELECT
-        exibicao.indicador data_is_displayable,
-        exibicao.motivos data_display_reasons,
-        cast({user_permition_filter} as bool) as user_has_permition
-    FROM `{BIGQUERY_PROJECT}`.{BIGQUERY_PATIENT_HEADER_TABLE_ID}
-    WHERE
-        cpf_particao = {cpf}
-    """
-
-    # Execute the query
-    results = await read_bq(query, from_file="/tmp/credentials.json")
-
     if len(results) == 0:
         return False, JSONResponse(
             status_code=404,
@@ -188,6 +426,118 @@ async def validate_user_access_to_patient_data(user: User, cpf: str) -> tuple[bo
     return True, None
 
 
+async def read_patient_data_with_access(
+    user: User,
+    cpf: str,
+    query_name: str,
+    **params,
+) -> tuple[bool, JSONResponse, list]:
+    """
+    Validates the user's access to a patient and reads the patient's rows in a single
+    BigQuery job. The rows are only fetched when access is granted.
+    Args:
+        user (User): The user object containing user details and role permissions.
+        cpf (str): The CPF (Cadastro de Pessoas Físicas) number of the patient.
+        query_name (str): A query template that returns the access flags and a `payload`
+            column, such as "patient_header" or "patient_encounters".
+        **params: Values of the template's optional parameters.
+    Returns:
+        tuple: The boolean and JSONResponse returned by `check_access_results`, followed by
+            the list of rows (empty when access is denied).
+    """
+    results = await run_query(
+        query_name,
+        cpf=cpf,
+        **user_permission_parameters(user),
+        **params,
+    )
+
+    has_access, response = check_access_results(results)
+    if not has_access:
+        return has_access, response, []
+
+    rows = [result["payload"] for result in results if result["payload"] is not None]
+    return has_access, response, rows
+
+
+async def stream_bq(
+    query: str,
+    from_file: str = "/tmp/credentials.json",
+    page_size: int = BIGQUERY_STREAM_PAGE_SIZE,
+    query_parameters: list | None = None,
+) -> AsyncIterator[list]:
+    """
+    Runs a query on BigQuery and yields its result one page at a time, as soon as each
+    page arrives, instead of loading the whole result in memory.
+    Args:
+        query (str): The SQL query to execute on BigQuery.
+        from_file (str, optional): The path to the service account credentials JSON file,
+            only used if the shared client was not created yet.
+        page_size (int, optional): The number of rows per page.
+        query_parameters (list, optional): The BigQuery query parameters referenced by the
+            query as `@name`.
+    Yields:
+        list: The rows of a page, as dictionaries.
+    """
+    logger.info(
+        f"Streaming BigQuery: {query} with parameters {_query_parameters_key(query_parameters)}"
+    )
+
+    client = get_bigquery_client(from_file)
+    job_config = bigquery.QueryJobConfig(query_parameters=query_parameters or [])
+
+    def execute_job():
+        started_at = time.perf_counter()
+        row_iterator = client.query_and_wait(query, job_config=job_config, page_size=page_size)
+        return row_iterator, time.perf_counter() - started_at
+
+    row_iterator, wall_seconds = await bigquery_executor.run(execute_job)
+    record_job_stats(client, row_iterator, wall_seconds, current_endpoint.get())
+
+    pages = iter(row_iterator.pages)
+    while True:
+        # The stream was already accepted, so later pages wait for a thread instead of failing
+        page = await bigquery_executor.run(next, pages, None, reject_when_saturated=False)
+        if page is None:
+            break
+        yield [dict(row) for row in page]
+
+
+def stream_query(
+    query_name: str,
+    /,
+    *,
+    page_size: int = BIGQUERY_STREAM_PAGE_SIZE,
+    fields: Optional[List[str]] = None,
+    **params,
+) -> AsyncIterator[list]:
+    """
+    Streams the result of the query template registered as `query_name`, a page at a
+    time, as `stream_bq` does.
+    """
+    template = get_query_template(query_name)
+    return stream_bq(
+        template.sql_for(fields),
+        page_size=page_size,
+        query_parameters=template.build_parameters(**params),
+    )
+
+
+def accepts_ndjson(request: Request) -> bool:
+    """
+    Tells whether the client asked for a newline-delimited JSON stream in `Accept`.
+    """
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+async def ndjson_lines(rows: AsyncIterable, serialize: Callable[[Any], str]) -> AsyncIterator[str]:
+    """
+    Serializes an asynchronous iterable of rows as newline-delimited JSON.
+    """
+    async for row in rows:
+        yield serialize(row) + "\n"
+
+
 async def request_limiter_identifier(request: Request):
     """
     Generates a unique identifier for rate limiting based on the request's client host and
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "materialized_patient_header" (
+            "cpf" VARCHAR(11) NOT NULL  PRIMARY KEY,
+            "data" JSONB NOT NULL,
+            "synced_at" TIMESTAMPTZ NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS "idx_materialize_synced__830b2f" ON "materialized_patient_header" ("synced_at");
+        CREATE TABLE IF NOT EXISTS "materialized_patient_summary" (
+            "cpf" VARCHAR(11) NOT NULL  PRIMARY KEY,
+            "data" JSONB NOT NULL,
+            "synced_at" TIMESTAMPTZ NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS "idx_materialize_synced__ecd1e7" ON "materialized_patient_summary" ("synced_at");
+        CREATE TABLE IF NOT EXISTS "materialized_patient_encounters" (
+            "cpf" VARCHAR(11) NOT NULL  PRIMARY KEY,
+            "data" JSONB NOT NULL,
+            "synced_at" TIMESTAMPTZ NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS "idx_materialize_synced__cb70cc" ON "materialized_patient_encounters" ("synced_at");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "materialized_patient_header";
+        DROP TABLE IF EXISTS "materialized_patient_summary";
+        DROP TABLE IF EXISTS "materialized_patient_encounters";"""
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE TABLE IF NOT EXISTS "patient_search_index" (
+            "cpf" VARCHAR(11) NOT NULL  PRIMARY KEY,
+            "name" TEXT NOT NULL,
+            "normalized_name" TEXT NOT NULL,
+            "data" JSONB NOT NULL,
+            "unidades_cadastro" JSONB,
+            "ap_cadastro" JSONB,
+            "synced_at" TIMESTAMPTZ NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS "idx_patient_sea_synced__0215b9" ON "patient_search_index" ("synced_at");
+        CREATE INDEX IF NOT EXISTS "idx_patient_sea_normali_trgm" ON "patient_search_index" USING GIN ("normalized_name" gin_trgm_ops);
+        COMMENT ON TABLE "patient_search_index" IS 'A row of the BigQuery patient search table, copied to Postgres and indexed with `pg_trgm` so that name searches don''t wait for a BigQuery job';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "patient_search_index";"""
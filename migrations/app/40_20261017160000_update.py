@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "userhistory" RENAME TO "userhistory_legacy";
+        ALTER TABLE "userhistory_legacy" RENAME CONSTRAINT "userhistory_pkey" TO "userhistory_legacy_pkey";
+        CREATE TABLE "userhistory" (
+            "id" UUID NOT NULL,
+            "method" VARCHAR(10) NOT NULL,
+            "path" VARCHAR(100) NOT NULL,
+            "query_params" JSONB,
+            "body" JSONB,
+            "status_code" INT NOT NULL,
+            "timestamp" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP,
+            "user_id" INT NOT NULL REFERENCES "user" ("id") ON DELETE CASCADE,
+            PRIMARY KEY ("id", "timestamp")
+        ) PARTITION BY RANGE ("timestamp");
+        CREATE INDEX IF NOT EXISTS "idx_userhistory_timesta_71ede8" ON "userhistory" ("timestamp");
+        CREATE INDEX IF NOT EXISTS "idx_userhistory_user_id_491d52" ON "userhistory" ("user_id", "timestamp");
+        CREATE TABLE "userhistory_default" PARTITION OF "userhistory" DEFAULT;
+        DO $$
+        DECLARE
+            partition_start DATE := date_trunc(
+                'month', COALESCE((SELECT MIN("timestamp") FROM "userhistory_legacy"), now()) AT TIME ZONE 'UTC'
+            );
+        BEGIN
+            WHILE partition_start < date_trunc('month', now() AT TIME ZONE 'UTC') + INTERVAL '3 months' LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF "userhistory" FOR VALUES FROM (%L) TO (%L)',
+                    'userhistory_p' || to_char(partition_start, 'YYYY_MM'),
+                    partition_start || ' 00:00:00+00',
+                    (partition_start + INTERVAL '1 month')::DATE || ' 00:00:00+00'
+                );
+                partition_start := partition_start + INTERVAL '1 month';
+            END LOOP;
+        END $$;
+        INSERT INTO "userhistory" ("id", "method", "path", "query_params", "body", "status_code", "timestamp", "user_id")
+            SELECT "id", "method", "path", "query_params", "body", "status_code", "timestamp", "user_id"
+            FROM "userhistory_legacy";
+        DROP TABLE "userhistory_legacy";"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE "userhistory_legacy" (
+            "id" UUID NOT NULL  PRIMARY KEY,
+            "method" VARCHAR(10) NOT NULL,
+            "path" VARCHAR(100) NOT NULL,
+            "query_params" JSONB,
+            "body" JSONB,
+            "status_code" INT NOT NULL,
+            "timestamp" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP,
+            "user_id" INT NOT NULL REFERENCES "user" ("id") ON DELETE CASCADE
+        );
+        INSERT INTO "userhistory_legacy" ("id", "method", "path", "query_params", "body", "status_code", "timestamp", "user_id")
+            SELECT "id", "method", "path", "query_params", "body", "status_code", "timestamp", "user_id"
+            FROM "userhistory"
+            ON CONFLICT ("id") DO NOTHING;
+        DROP TABLE "userhistory";
+        ALTER TABLE "userhistory_legacy" RENAME TO "userhistory";
+        ALTER TABLE "userhistory" RENAME CONSTRAINT "userhistory_legacy_pkey" TO "userhistory_pkey";
+        ALTER TABLE "userhistory" RENAME CONSTRAINT "userhistory_legacy_user_id_fkey" TO "userhistory_user_id_fkey";"""
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the latency of building a BigQuery client on every query (the previous
+`read_bq` behaviour) against reusing the pooled process-wide client.
+
+Usage:
+    python scripts/benchmark_bigquery_client.py --iterations 20 --concurrency 5
+"""
+import asyncio
+import statistics
+import time
+from argparse import ArgumentParser
+
+from asyncer import asyncify
+from google.cloud import bigquery
+from google.oauth2 import service_account
+from loguru import logger
+
+from app.utils import close_bigquery_client, get_bigquery_client, prepare_gcp_credential
+
+CREDENTIALS_FILE = "/tmp/credentials.json"
+
+
+def query_with_new_client(query: str) -> list:
+    credentials = service_account.Credentials.from_service_account_file(CREDENTIALS_FILE)
+    client = bigquery.Client(credentials=credentials)
+    return [dict(row) for row in client.query_and_wait(query)]
+
+
+def query_with_pooled_client(query: str) -> list:
+    client = get_bigquery_client(CREDENTIALS_FILE)
+    return [dict(row) for row in client.query_and_wait(query)]
+
+
+async def measure(name: str, func, query: str, iterations: int, concurrency: int) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def run_once():
+        async with semaphore:
+            start = time.perf_counter()
+            await asyncify(func)(query)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[run_once() for _ in range(iterations)])
+    total = time.perf_counter() - start
+
+    latencies.sort()
+    logger.info(
+        f"{name}: total={total:.2f}s "
+        f"mean={statistics.mean(latencies) * 1000:.0f}ms "
+        f"p50={latencies[len(latencies) // 2] * 1000:.0f}ms "
+        f"p95={latencies[int(len(latencies) * 0.95) - 1] * 1000:.0f}ms"
+    )
+
+
+async def run(iterations: int, concurrency: int, query: str) -> None:
+    prepare_gcp_credential()
+
+    # Warm up both paths so that one-off imports and DNS lookups are not measured
+    await asyncify(query_with_new_client)(query)
+    await asyncify(query_with_pooled_client)(query)
+
+    await measure("new client per query", query_with_new_client, query, iterations, concurrency)
+    await measure("pooled client", query_with_pooled_client, query, iterations, concurrency)
+
+    close_bigquery_client()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--query", type=str, default="select 1 as number")
+
+    args = parser.parse_args()
+
+    asyncio.run(run(args.iterations, args.concurrency, args.query))
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the latency of patient name searches in the Postgres trigram index, on a
+synthetic table with the same structure and indexes as the real one.
+
+Usage:
+    python scripts/benchmark_patient_search_index.py --rows 1000000 --iterations 50
+"""
+import random
+import statistics
+import time
+from argparse import ArgumentParser
+
+from loguru import logger
+from tortoise import Tortoise, connections, run_async
+
+from app.db import TORTOISE_ORM
+from app.search import SEARCH_INDEX_TABLE, search_patient_index
+
+BENCHMARK_TABLE = f"{SEARCH_INDEX_TABLE}_benchmark"
+
+FIRST_NAMES = [
+    "maria", "jose", "ana", "joao", "antonio", "francisca", "francisco", "adriana",
+    "carlos", "juliana", "paulo", "marcia", "pedro", "fernanda", "lucas", "patricia",
+    "luiz", "aline", "marcos", "sandra", "luis", "camila", "gabriel", "amanda",
+]
+LAST_NAMES = [
+    "silva", "santos", "oliveira", "souza", "rodrigues", "ferreira", "alves", "pereira",
+    "lima", "gomes", "costa", "ribeiro", "martins", "carvalho", "almeida", "lopes",
+    "soares", "fernandes", "vieira", "barbosa", "rocha", "dias", "nascimento", "andrade",
+]
+
+
+async def create_synthetic_table(rows: int) -> None:
+    db = connections.get("default")
+    await db.execute_script(
+        f"""
+        DROP TABLE IF EXISTS "{BENCHMARK_TABLE}";
+        CREATE TABLE "{BENCHMARK_TABLE}" (LIKE "{SEARCH_INDEX_TABLE}" INCLUDING ALL);
+        """
+    )
+    await db.execute_query(
+        f"""
+        INSERT INTO "{BENCHMARK_TABLE}"
+            (cpf, name, normalized_name, data, unidades_cadastro, ap_cadastro, synced_at)
+        SELECT
+            lpad(i::text, 11, '0'),
+            full_name,
+            full_name,
+            jsonb_build_object('cpf', lpad(i::text, 11, '0'), 'nome', full_name),
+            '[]'::jsonb,
+            '[]'::jsonb,
+            now()
+        FROM (
+            SELECT
+                i,
+                first_names[1 + floor(random() * cardinality(first_names))::int]
+                || ' ' || last_names[1 + floor(random() * cardinality(last_names))::int]
+                || ' ' || last_names[1 + floor(random() * cardinality(last_names))::int]
+                AS full_name
+            FROM generate_series(1, $1) i, (SELECT $2::text[] first_names, $3::text[] last_names) n
+        ) synthetic
+        """,
+        [rows, FIRST_NAMES, LAST_NAMES],
+    )
+    await db.execute_script(f'ANALYZE "{BENCHMARK_TABLE}";')
+
+
+async def run(rows: int, iterations: int, limit: int, keep: bool):
+    await Tortoise.init(config=TORTOISE_ORM)
+
+    try:
+        start = time.perf_counter()
+        await create_synthetic_table(rows)
+        logger.info(f"Created {rows} synthetic patients in {time.perf_counter() - start:.1f}s")
+
+        searches = {
+            "full name": lambda: " ".join(
+                [random.choice(FIRST_NAMES), random.choice(LAST_NAMES), random.choice(LAST_NAMES)]
+            ),
+            "first and last name": lambda: (
+                f"{random.choice(FIRST_NAMES)} {random.choice(LAST_NAMES)}"
+            ),
+            "partial last name": lambda: random.choice(LAST_NAMES)[:5],
+        }
+        for kind, make_name in searches.items():
+            latencies, matches = [], []
+            for _ in range(iterations):
+                name = make_name()
+                start = time.perf_counter()
+                entries = await search_patient_index(name, limit=limit, table=BENCHMARK_TABLE)
+                latencies.append(time.perf_counter() - start)
+                matches.append(len(entries))
+
+            latencies.sort()
+            logger.info(
+                f"{kind}: mean={statistics.mean(latencies) * 1000:.1f}ms "
+                f"p50={latencies[len(latencies) // 2] * 1000:.1f}ms "
+                f"p95={latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f}ms "
+                f"results={statistics.mean(matches):.0f}"
+            )
+    finally:
+        if not keep:
+            await connections.get("default").execute_script(
+                f'DROP TABLE IF EXISTS "{BENCHMARK_TABLE}";'
+            )
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--keep", action="store_true")
+
+    args = parser.parse_args()
+
+    run_async(run(args.rows, args.iterations, args.limit, args.keep))
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Compares latency and peak memory of decoding a large encounter history into one dictionary
+per row, as `read_bq` does, against reading it as Arrow record batches over the BigQuery
+Storage Read API and converting the table to dictionaries at the end.
+
+The API serves rows as dictionaries because the response cache, the Postgres copy of the
+patients' rows and the pydantic response models all need them, so an Arrow read only pays
+off if its decoding is cheaper than building those dictionaries directly. Results that
+fit in the first page of the query response are converted from that page, not read over
+the Storage Read API.
+
+Usage:
+    python scripts/benchmark_read_bq_decoding.py --cpf 12345678900 --iterations 5
+"""
+import statistics
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from typing import Callable
+
+import pyarrow as pa
+from google.cloud import bigquery
+from google.cloud.bigquery_storage import BigQueryReadClient
+from loguru import logger
+
+from app.config import BIGQUERY_PROJECT, BIGQUERY_PATIENT_ENCOUNTERS_TABLE_ID
+from app.utils import close_bigquery_client, get_bigquery_client, prepare_gcp_credential
+
+
+def measure(name: str, decode: Callable[[], list], iterations: int) -> None:
+    latencies, python_peaks, arrow_peaks = [], [], []
+
+    default_pool = pa.default_memory_pool()
+    for _ in range(iterations):
+        # Arrow buffers are not seen by tracemalloc; a proxy pool tracks their own peak
+        arrow_pool = pa.proxy_memory_pool(default_pool)
+        pa.set_memory_pool(arrow_pool)
+        tracemalloc.start()
+        start = time.perf_counter()
+
+        try:
+            rows = decode()
+        finally:
+            pa.set_memory_pool(default_pool)
+
+        latencies.append(time.perf_counter() - start)
+        python_peaks.append(tracemalloc.get_traced_memory()[1])
+        arrow_peaks.append(arrow_pool.max_memory())
+        tracemalloc.stop()
+
+    logger.info(
+        f"{name}: rows={len(rows)} "
+        f"mean={statistics.mean(latencies) * 1000:.0f}ms "
+        f"min={min(latencies) * 1000:.0f}ms "
+        f"python_peak={max(python_peaks) / 2**20:.1f}MiB "
+        f"arrow_peak={max(arrow_peaks) / 2**20:.1f}MiB"
+    )
+
+
+def run(cpf: str, iterations: int) -> None:
+    prepare_gcp_credential()
+    client = get_bigquery_client()
+    bqstorage_client = BigQueryReadClient(credentials=client._credentials)
+
+    query = f"""
+    SELECT *
+    FROM `{BIGQUERY_PROJECT}`.{BIGQUERY_PATIENT_ENCOUNTERS_TABLE_ID}
+    WHERE cpf_particao = @cpf and exibicao.indicador = true
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter("cpf", "INT64", int(cpf))]
+    )
+
+    def row_dictionaries() -> list:
+        row_iterator = client.query_and_wait(query, job_config=job_config)
+        return [dict(row) for row in row_iterator]
+
+    def arrow_record_batches() -> list:
+        row_iterator = client.query_and_wait(query, job_config=job_config)
+        table = row_iterator.to_arrow(bqstorage_client=bqstorage_client)
+        return table.to_pylist()
+
+    # Warm up the clients and BigQuery's result cache, so both modes read cached results
+    row_dictionaries()
+
+    measure("row dictionaries", row_dictionaries, iterations)
+    measure("arrow record batches", arrow_record_batches, iterations)
+
+    close_bigquery_client()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+
+    parser.add_argument("--cpf", type=str, required=True)
+    parser.add_argument("--iterations", type=int, default=5)
+
+    args = parser.parse_args()
+
+    run(args.cpf, args.iterations)
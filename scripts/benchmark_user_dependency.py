@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the per-request cost of authenticating a user with `get_current_user`: saving
+every token claim on each request (the previous behaviour), writing only changed claims,
+and reusing the user cached by token.
+
+Usage:
+    python scripts/benchmark_user_dependency.py --iterations 1000
+"""
+import statistics
+import time
+from argparse import ArgumentParser
+
+from loguru import logger
+from tortoise import Tortoise, run_async
+
+from app import config
+from app.auth.utils import generate_token_from_user_data
+from app.db import TORTOISE_ORM
+from app.dependencies import USER_TOKEN_FIELDS, clear_authenticated_users, get_current_user
+from app.models import User
+
+BENCHMARK_USER = {
+    "username": "benchmark_user_dependency",
+    "name": "Benchmark",
+    "email": "benchmark_user_dependency@example.com",
+    "cpf": None,
+    "access_level": "full_permission",
+    "job_title": "Benchmark",
+    "cnes": "0000000",
+    "ap": "10",
+}
+
+
+async def save_every_request(token: str, username: str) -> User:
+    # What `get_current_user` did before: read the user and save every claim
+    user = await User.get(username=username)
+    for field in USER_TOKEN_FIELDS:
+        setattr(user, field, BENCHMARK_USER[field])
+    await user.save()
+    return user
+
+
+async def update_changed_claims(token: str, username: str) -> User:
+    clear_authenticated_users()
+    return await get_current_user(token)
+
+
+async def cached_user(token: str, username: str) -> User:
+    return await get_current_user(token)
+
+
+async def run(iterations: int):
+    await Tortoise.init(config=TORTOISE_ORM)
+    token = generate_token_from_user_data(BENCHMARK_USER)
+
+    try:
+        config.USER_CACHE_TTL = max(config.USER_CACHE_TTL, 60)
+        clear_authenticated_users()
+        await get_current_user(token)
+
+        modes = {
+            "save every request": save_every_request,
+            "update changed claims": update_changed_claims,
+            "cached by token": cached_user,
+        }
+        for mode, authenticate in modes.items():
+            latencies = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                await authenticate(token, BENCHMARK_USER["username"])
+                latencies.append(time.perf_counter() - start)
+
+            latencies.sort()
+            logger.info(
+                f"{mode}: mean={statistics.mean(latencies) * 1000:.3f}ms "
+                f"p50={latencies[len(latencies) // 2] * 1000:.3f}ms "
+                f"p95={latencies[int(len(latencies) * 0.95) - 1] * 1000:.3f}ms"
+            )
+    finally:
+        clear_authenticated_users()
+        await User.filter(username=BENCHMARK_USER["username"]).delete()
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+
+    parser.add_argument("--iterations", type=int, default=1000)
+
+    args = parser.parse_args()
+
+    run_async(run(args.iterations))
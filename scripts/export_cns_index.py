@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Exports the BigQuery CNS index to the local CNS to CPF index file read by the API.
+The new file atomically replaces the old one, and running workers switch to it on
+their next check (CNS_INDEX_CHECK_INTERVAL).
+
+Usage:
+    python scripts/export_cns_index.py --path /data/cns_index.bin
+"""
+import asyncio
+from argparse import ArgumentParser
+from array import array
+
+from loguru import logger
+
+from app.cns_index import CnsIndex, write_cns_index
+from app.config import CNS_INDEX_PATH
+from app.utils import close_bigquery_client, prepare_gcp_credential, stream_query
+
+
+async def run(path: str, page_size: int):
+    prepare_gcp_credential()
+
+    # Kept as a flat array of integers: 16 bytes per patient instead of two Python ints
+    records = array("Q")
+    skipped = 0
+    try:
+        async for page in stream_query("patient_index_all", page_size=page_size):
+            for row in page:
+                try:
+                    records.extend((int(row["cns"]), int(row["cpf"])))
+                except ValueError:
+                    skipped += 1
+            logger.info(f"Read {len(records) // 2} records")
+    finally:
+        close_bigquery_client()
+
+    count = write_cns_index(
+        path, ((records[i], records[i + 1]) for i in range(0, len(records), 2))
+    )
+    logger.info(f"Wrote {count} records to {path}, skipped {skipped} invalid rows")
+
+    # Sanity check of the file that workers will read
+    index = CnsIndex(path, check_interval=0)
+    if count and index.lookup(records[0]) is None:
+        raise RuntimeError(f"CNS {records[0]} was not found in the new index")
+    index.close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+
+    parser.add_argument("--path", type=str, default=CNS_INDEX_PATH)
+    parser.add_argument("--page-size", type=int, default=50000)
+
+    args = parser.parse_args()
+
+    if not args.path:
+        parser.error("--path is required when CNS_INDEX_PATH is not set")
+
+    asyncio.run(run(args.path, args.page_size))
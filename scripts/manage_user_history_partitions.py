@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Manages the monthly partitions of the user history table (see migration 40). Creates the
+partitions of the coming months, moving any of their rows out of the default partition,
+and archives closed partitions: each is detached from the table, exported to a Parquet
+file, and, with --drop, dropped once the file is checked against it.
+Meant to run monthly.
+
+Usage:
+    python scripts/manage_user_history_partitions.py --months-ahead 3
+    python scripts/manage_user_history_partitions.py --archive-before-months 6 \
+        --archive-dir gs://bucket/userhistory --drop
+"""
+import datetime
+from argparse import ArgumentParser
+from typing import List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.fs
+import pyarrow.parquet as pq
+from loguru import logger
+from tortoise import Tortoise, run_async
+from tortoise.transactions import in_transaction
+
+from app.db import TORTOISE_ORM
+
+TABLE = "userhistory"
+DEFAULT_PARTITION = f"{TABLE}_default"
+
+ARCHIVE_SCHEMA = pa.schema(
+    [
+        ("id", pa.string()),
+        ("user_id", pa.int32()),
+        ("method", pa.string()),
+        ("path", pa.string()),
+        ("query_params", pa.string()),
+        ("body", pa.string()),
+        ("status_code", pa.int32()),
+        ("timestamp", pa.timestamp("us", tz="UTC")),
+    ]
+)
+
+
+def add_months(month: datetime.date, months: int) -> datetime.date:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: datetime.date) -> str:
+    return f"{TABLE}_p{month:%Y_%m}"
+
+
+def partition_bounds(month: datetime.date) -> Tuple[str, str]:
+    """
+    The first instant of the month and of the next one, in UTC, as SQL literals.
+    """
+    return (
+        f"'{month:%Y-%m-%d} 00:00:00+00'",
+        f"'{add_months(month, 1):%Y-%m-%d} 00:00:00+00'",
+    )
+
+
+async def get_partitions() -> List[datetime.date]:
+    """
+    Returns the months of the attached monthly partitions, oldest first.
+    """
+    rows = await Tortoise.get_connection("default").execute_query_dict(
+        """
+        SELECT child.relname AS name
+        FROM pg_inherits
+            JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+            JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+        WHERE parent.relname = $1
+        """,
+        [TABLE],
+    )
+    months = []
+    for row in rows:
+        if row["name"] == DEFAULT_PARTITION:
+            continue
+        months.append(datetime.datetime.strptime(row["name"], f"{TABLE}_p%Y_%m").date())
+    return sorted(months)
+
+
+async def get_detached_partitions() -> List[datetime.date]:
+    """
+    Returns the months of the monthly partitions that were detached but not dropped, oldest
+    first, such as those of an archive that failed after the detach.
+    """
+    rows = await Tortoise.get_connection("default").execute_query_dict(
+        """
+        SELECT relname AS name
+        FROM pg_class
+        WHERE relkind = 'r' AND NOT relispartition AND relname LIKE $1
+        """,
+        [f"{TABLE}\\_p%"],
+    )
+    return sorted(
+        datetime.datetime.strptime(row["name"], f"{TABLE}_p%Y_%m").date() for row in rows
+    )
+
+
+async def create_partition(month: datetime.date) -> None:
+    """
+    Creates the partition of a month, with the rows of that month already in the default
+    partition, since a partition can't be attached while the default one has its rows.
+    The default partition is locked until the partition is attached, so that no row of the
+    month is inserted there, or missed by the move, in between.
+    """
+    name = partition_name(month)
+    start, end = partition_bounds(month)
+    async with in_transaction() as connection:
+        await connection.execute_script(
+            f"""
+            LOCK TABLE "{DEFAULT_PARTITION}" IN ACCESS EXCLUSIVE MODE;
+            CREATE TABLE "{name}" (LIKE "{TABLE}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS);
+            WITH moved AS (
+                DELETE FROM "{DEFAULT_PARTITION}"
+                WHERE "timestamp" >= {start} AND "timestamp" < {end}
+                RETURNING *
+            )
+            INSERT INTO "{name}" SELECT * FROM moved;
+            ALTER TABLE "{TABLE}" ATTACH PARTITION "{name}" FOR VALUES FROM ({start}) TO ({end});
+            """
+        )
+    logger.info(f"Created partition {name}")
+
+
+async def export_partition(
+    month: datetime.date, filesystem: pyarrow.fs.FileSystem, path: str, batch_size: int
+) -> int:
+    """
+    Writes the rows of a partition to a Parquet file, JSON columns as text.
+    Returns:
+        int: The number of rows written.
+    """
+    query = f"""
+        SELECT "id"::TEXT, "user_id", "method", "path", "query_params"::TEXT, "body"::TEXT,
+            "status_code", "timestamp"
+        FROM "{partition_name(month)}"
+        ORDER BY "timestamp"
+    """
+    count = 0
+    columns = {name: [] for name in ARCHIVE_SCHEMA.names}
+    with pq.ParquetWriter(
+        path, ARCHIVE_SCHEMA, filesystem=filesystem, compression="zstd"
+    ) as writer:
+        client = Tortoise.get_connection("default")
+        async with client.acquire_connection() as connection:
+            async with connection.transaction():
+                async for record in connection.cursor(query, prefetch=batch_size):
+                    for name in ARCHIVE_SCHEMA.names:
+                        columns[name].append(record[name])
+                    count += 1
+                    if count % batch_size == 0:
+                        writer.write_table(pa.Table.from_pydict(columns, schema=ARCHIVE_SCHEMA))
+                        columns = {name: [] for name in ARCHIVE_SCHEMA.names}
+        if columns["id"]:
+            writer.write_table(pa.Table.from_pydict(columns, schema=ARCHIVE_SCHEMA))
+    return count
+
+
+async def archive_partition(
+    month: datetime.date, archive_dir: str, drop: bool, batch_size: int, attached: bool = True
+) -> None:
+    """
+    Detaches a partition, so that no row is added to it anymore, exports it to
+    `<archive_dir>/<partition>.parquet`, and drops it with `drop` once the file has as many
+    rows as the table. The detached table is kept if the export fails.
+    """
+    name = partition_name(month)
+    if attached:
+        async with in_transaction() as connection:
+            await connection.execute_script(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{name}";')
+        logger.info(f"Detached partition {name}")
+
+    filesystem, directory = pyarrow.fs.FileSystem.from_uri(archive_dir)
+    filesystem.create_dir(directory, recursive=True)
+    path = f"{directory}/{name}.parquet"
+
+    await export_partition(month, filesystem, path, batch_size)
+    rows = await Tortoise.get_connection("default").execute_query_dict(
+        f'SELECT count(*) AS count FROM "{name}"'
+    )
+    count = rows[0]["count"]
+    archived = pq.read_metadata(path, filesystem=filesystem).num_rows
+    if archived != count:
+        raise RuntimeError(f"{path} has {archived} rows, but {name} has {count}")
+    logger.info(f"Exported {count} rows of {name} to {archive_dir}/{name}.parquet")
+
+    if drop:
+        await Tortoise.get_connection("default").execute_script(f'DROP TABLE "{name}";')
+        logger.info(f"Dropped partition {name}")
+
+
+async def run(
+    months_ahead: int,
+    archive_before_months: Optional[int],
+    archive_dir: Optional[str],
+    drop: bool,
+    batch_size: int,
+):
+    await Tortoise.init(config=TORTOISE_ORM)
+
+    try:
+        current_month = datetime.datetime.now(datetime.timezone.utc).date().replace(day=1)
+        partitions = await get_partitions()
+
+        for months in range(months_ahead + 1):
+            month = add_months(current_month, months)
+            if month not in partitions:
+                await create_partition(month)
+
+        if archive_before_months is not None:
+            # Only months before the current one are closed
+            cutoff = add_months(current_month, -max(archive_before_months, 0))
+            for month in partitions:
+                if month < cutoff:
+                    await archive_partition(month, archive_dir, drop, batch_size)
+            # Detached partitions are only left behind without `drop` or by a failed archive
+            if drop:
+                for month in await get_detached_partitions():
+                    if month < cutoff:
+                        await archive_partition(
+                            month, archive_dir, drop, batch_size, attached=False
+                        )
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+
+    parser.add_argument("--months-ahead", type=int, default=3)
+    parser.add_argument("--archive-before-months", type=int, default=None)
+    parser.add_argument("--archive-dir", type=str, default=None)
+    parser.add_argument("--drop", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=10000)
+
+    args = parser.parse_args()
+    if args.archive_before_months is not None and not args.archive_dir:
+        parser.error("--archive-dir is required with --archive-before-months")
+
+    run_async(
+        run(
+            args.months_ahead,
+            args.archive_before_months,
+            args.archive_dir,
+            args.drop,
+            args.batch_size,
+        )
+    )
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+Refreshes the Postgres patient name search index from the BigQuery patient search table.
+Meant to run periodically; searches keep using the index while it is refreshed.
+
+Usage:
+    python scripts/refresh_patient_search_index.py --page-size 10000
+"""
+from argparse import ArgumentParser
+
+from loguru import logger
+from tortoise import Tortoise, run_async
+
+from app.db import TORTOISE_ORM
+from app.search import refresh_search_index
+from app.utils import close_bigquery_client, prepare_gcp_credential
+
+
+async def run(page_size: int):
+    prepare_gcp_credential()
+    await Tortoise.init(config=TORTOISE_ORM)
+
+    try:
+        count = await refresh_search_index(page_size=page_size)
+        logger.info(f"Search index refreshed with {count} patients")
+    finally:
+        close_bigquery_client()
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+
+    parser.add_argument("--page-size", type=int, default=10000)
+
+    args = parser.parse_args()
+
+    run_async(run(args.page_size))
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Materializes the header, summary and encounters of the most viewed patients in Postgres,
+so that the frontend endpoints read them without waiting for BigQuery. Patients are
+ranked by the requests to their pages in the user history.
+
+Usage:
+    python scripts/sync_materialized_patients.py --days 7 --limit 1000
+    python scripts/sync_materialized_patients.py --cpf 12345678900 --cpf 98765432100
+"""
+import asyncio
+import datetime
+import re
+from argparse import ArgumentParser
+from collections import Counter
+
+from loguru import logger
+from tortoise import Tortoise, run_async
+from tortoise.functions import Count
+
+from app.db import TORTOISE_ORM
+from app.materialization import MATERIALIZED_TABLES, sync_patient
+from app.models import UserHistory
+from app.utils import close_bigquery_client, prepare_gcp_credential
+
+PATIENT_PATH_PATTERN = re.compile(r"^/frontend/patient/[a-z_]+/(\d{11})$")
+
+
+async def get_hot_cpfs(days: int, limit: int) -> list[str]:
+    """
+    Returns the CPFs of the patients whose pages were requested the most in the last `days`.
+    """
+    since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)
+    paths = (
+        await UserHistory.filter(timestamp__gte=since, path__startswith="/frontend/patient/")
+        .annotate(requests=Count("id"))
+        .group_by("path")
+        .values("path", "requests")
+    )
+
+    requests_by_cpf = Counter()
+    for path in paths:
+        match = PATIENT_PATH_PATTERN.match(path["path"])
+        if match:
+            requests_by_cpf[match.group(1)] += path["requests"]
+
+    return [cpf for cpf, _ in requests_by_cpf.most_common(limit)]
+
+
+async def get_fresh_cpfs(cpfs: list[str], min_age: int) -> set[str]:
+    """
+    Returns the CPFs, among `cpfs`, whose tables were all synced less than `min_age`
+    seconds ago.
+    """
+    newest = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=min_age)
+    fresh = None
+    for model, _ in MATERIALIZED_TABLES.values():
+        synced = set(
+            await model.filter(cpf__in=cpfs, synced_at__gte=newest).values_list("cpf", flat=True)
+        )
+        fresh = synced if fresh is None else fresh & synced
+    return fresh or set()
+
+
+async def run(cpfs: list[str], days: int, limit: int, min_age: int, concurrency: int):
+    prepare_gcp_credential()
+    await Tortoise.init(config=TORTOISE_ORM)
+
+    try:
+        if not cpfs:
+            cpfs = await get_hot_cpfs(days, limit)
+            fresh = await get_fresh_cpfs(cpfs, min_age)
+            cpfs = [cpf for cpf in cpfs if cpf not in fresh]
+            logger.info(f"Skipping {len(fresh)} patients synced in the last {min_age} seconds")
+        logger.info(f"Syncing {len(cpfs)} patients")
+
+        semaphore = asyncio.Semaphore(concurrency)
+        failures = 0
+
+        async def sync_one(cpf: str):
+            nonlocal failures
+            async with semaphore:
+                try:
+                    synced = await sync_patient(cpf)
+                    logger.info(f"Synced {cpf}: {synced}")
+                except Exception as e:
+                    failures += 1
+                    logger.error(f"Error syncing {cpf}: {e}")
+
+        await asyncio.gather(*[sync_one(cpf) for cpf in cpfs])
+        logger.info(f"Synced {len(cpfs) - failures} patients, {failures} failures")
+    finally:
+        close_bigquery_client()
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+
+    parser.add_argument("--cpf", action="append", default=[])
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--min-age", type=int, default=3600)
+    parser.add_argument("--concurrency", type=int, default=5)
+
+    args = parser.parse_args()
+
+    run_async(run(args.cpf, args.days, args.limit, args.min_age, args.concurrency))
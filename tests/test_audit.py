@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import errno
+import uuid
+from pathlib import Path
+
+import pytest  # noqa
+from tortoise import timezone
+
+from app.audit import AuditSpool, AuditWriter, audit_dropped_records
+from app.models import User, UserHistory
+
+
+@pytest.fixture
+async def audit_user():
+    yield await User.get(username="frontend")
+
+
+def history_fields(user: User, path: str) -> dict:
+    return dict(
+        user=user, method="GET", path=path, query_params={}, body={}, status_code=200
+    )
+
+
+def unique_path() -> str:
+    return f"/test/audit/{uuid.uuid4()}"
+
+
+async def failing_bulk_create(*args, **kwargs):
+    raise ConnectionError("database is down")
+
+
+def spool_files(directory: Path) -> list:
+    return sorted(directory.glob("*.jsonl"))
+
+
+@pytest.fixture
+def written_batches(monkeypatch: pytest.MonkeyPatch):
+    batches = []
+    bulk_create = UserHistory.bulk_create
+
+    async def counting_bulk_create(objects, *args, **kwargs):
+        batches.append(len(objects))
+        return await bulk_create(objects, *args, **kwargs)
+
+    monkeypatch.setattr(UserHistory, "bulk_create", counting_bulk_create)
+    yield batches
+
+
+async def wait_for_batches(batches: list, count: int, timeout: float = 5) -> None:
+    async def wait():
+        while len(batches) < count:
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(wait(), timeout)
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_audit_writer_batches_records(audit_user: User, written_batches: list):
+    path = unique_path()
+    writer = AuditWriter(batch_size=100, flush_interval=0.05, spool_dir="")
+    writer.start()
+    for _ in range(5):
+        await writer.record(**history_fields(audit_user, path))
+    await wait_for_batches(written_batches, 1)
+
+    assert written_batches == [5]
+    assert await UserHistory.filter(path=path).count() == 5
+    await writer.close()
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_audit_writer_flushes_full_batches(audit_user: User, written_batches: list):
+    path = unique_path()
+    # The batch is written once it is full, long before the flush interval
+    writer = AuditWriter(batch_size=2, flush_interval=3600, spool_dir="")
+    writer.start()
+    await writer.record(**history_fields(audit_user, path))
+    await asyncio.sleep(0.05)
+    assert written_batches == []
+
+    await writer.record(**history_fields(audit_user, path))
+    await wait_for_batches(written_batches, 1)
+
+    assert written_batches == [2]
+    await writer.close()
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_audit_writer_flushes_after_the_interval(audit_user: User, written_batches: list):
+    path = unique_path()
+    writer = AuditWriter(batch_size=100, flush_interval=0.05, spool_dir="")
+    writer.start()
+    await writer.record(**history_fields(audit_user, path))
+    await wait_for_batches(written_batches, 1)
+
+    assert written_batches == [1]
+    assert await UserHistory.filter(path=path).count() == 1
+    await writer.close()
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_audit_writer_drains_on_close(audit_user: User, written_batches: list):
+    path = unique_path()
+    writer = AuditWriter(batch_size=100, flush_interval=3600, spool_dir="")
+    writer.start()
+    for _ in range(3):
+        await writer.record(**history_fields(audit_user, path))
+    await writer.close()
+
+    assert written_batches == [3]
+    assert await UserHistory.filter(path=path).count() == 3
+
+    # Once closed, records are written right away
+    await writer.record(**history_fields(audit_user, path))
+    assert await UserHistory.filter(path=path).count() == 4
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_audit_writer_counts_write_errors(
+    audit_user: User, monkeypatch: pytest.MonkeyPatch
+):
+    dropped = audit_dropped_records.get(reason="write_error")
+    monkeypatch.setattr(UserHistory, "bulk_create", failing_bulk_create)
+    writer = AuditWriter(batch_size=100, flush_interval=3600, spool_dir="")
+    writer.start()
+    await writer.record(**history_fields(audit_user, unique_path()))
+    await writer.record(**history_fields(audit_user, unique_path()))
+    await writer.close()
+
+    assert audit_dropped_records.get(reason="write_error") == dropped + 2
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_audit_writer_counts_full_queue(audit_user: User):
+    path = unique_path()
+    dropped = audit_dropped_records.get(reason="queue_full")
+    writer = AuditWriter(max_queue_size=1, flush_interval=3600, spool_dir="")
+    writer.start()
+    await writer.record(**history_fields(audit_user, path))
+    await writer.record(**history_fields(audit_user, path))
+
+    assert audit_dropped_records.get(reason="queue_full") == dropped + 1
+    await writer.close()
+    assert await UserHistory.filter(path=path).count() == 1
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_audit_spool_replays_files_left_by_a_crash(audit_user: User, tmp_path: Path):
+    path = unique_path()
+    crashed_spool = AuditSpool(str(tmp_path))
+    crashed_spool.open()
+    crashed_spool.append(UserHistory(**history_fields(audit_user, path), timestamp=timezone.now()))
+    # The process died while writing the next line, leaving it partial
+    crashed_spool.append(UserHistory(**history_fields(audit_user, path), timestamp=timezone.now()))
+    with open(spool_files(tmp_path)[0], "r+b") as file:
+        file.truncate(file.seek(0, 2) - 10)
+    crashed_spool._segment.release()
+
+    writer = AuditWriter(spool_dir=str(tmp_path))
+    writer.start()
+    await writer.close()
+
+    assert await UserHistory.filter(path=path).count() == 1
+    assert spool_files(tmp_path) == []
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_audit_spool_keeps_failed_batches(
+    audit_user: User, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    path = unique_path()
+    with monkeypatch.context() as patch:
+        patch.setattr(UserHistory, "bulk_create", failing_bulk_create)
+        writer = AuditWriter(flush_interval=0.01, spool_dir=str(tmp_path))
+        writer.start()
+        await writer.record(**history_fields(audit_user, path))
+        await writer.close()
+
+    assert await UserHistory.filter(path=path).count() == 0
+    files = spool_files(tmp_path)
+    assert len(files) == 1
+    assert path in files[0].read_text()
+
+    # Once the database is back, the next writer inserts the kept file
+    writer = AuditWriter(spool_dir=str(tmp_path))
+    writer.start()
+    await writer.close()
+
+    assert await UserHistory.filter(path=path).count() == 1
+    assert spool_files(tmp_path) == []
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_audit_spool_keeps_records_of_a_full_queue(audit_user: User, tmp_path: Path):
+    first_path, second_path = unique_path(), unique_path()
+    writer = AuditWriter(max_queue_size=1, spool_dir=str(tmp_path))
+    writer.start()
+    await writer.record(**history_fields(audit_user, first_path))
+    await writer.record(**history_fields(audit_user, second_path))
+
+    assert writer.queue_depth == 1
+    assert second_path in spool_files(tmp_path)[0].read_text()
+
+    await writer.close()
+
+    # Only the queued record was written, and the file keeps the other one
+    assert await UserHistory.filter(path=first_path).count() == 1
+    assert await UserHistory.filter(path=second_path).count() == 0
+    assert len(spool_files(tmp_path)) == 1
+
+    writer = AuditWriter(spool_dir=str(tmp_path))
+    writer.start()
+    await writer.close()
+
+    assert await UserHistory.filter(path=first_path).count() == 1
+    assert await UserHistory.filter(path=second_path).count() == 1
+    assert spool_files(tmp_path) == []
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_audit_spool_errors_dont_fail_requests(
+    audit_user: User, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    path = unique_path()
+    writer = AuditWriter(flush_interval=0.01, spool_dir=str(tmp_path))
+    writer.start()
+
+    def append(*args, **kwargs):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setattr(writer.spool, "append", append)
+    await writer.record(**history_fields(audit_user, path))
+    await writer.close()
+
+    assert await UserHistory.filter(path=path).count() == 1
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+from pathlib import Path
+
+import pytest  # noqa
+
+from app.cns_index import CnsIndex, write_cns_index
+
+RECORDS = [
+    (700000000000001, 38965996074),
+    (700000000000005, 74663240020),
+    (700000000000009, 1234567890),
+    (898000000000000, 11144477735),
+]
+
+
+@pytest.fixture
+def index_path(tmp_path: Path):
+    yield str(tmp_path / "cns_index.bin")
+
+
+@pytest.fixture
+def index(index_path: str):
+    cns_index = CnsIndex(index_path, check_interval=0)
+    yield cns_index
+    cns_index.close()
+
+
+@pytest.mark.run(order=1)
+def test_cns_index_hits(index_path: str, index: CnsIndex):
+    assert write_cns_index(index_path, RECORDS) == len(RECORDS)
+
+    # The first and last records are found, and CPFs keep their leading zeros
+    assert index.lookup(700000000000001) == "38965996074"
+    assert index.lookup(700000000000005) == "74663240020"
+    assert index.lookup(700000000000009) == "01234567890"
+    assert index.lookup(898000000000000) == "11144477735"
+
+
+@pytest.mark.parametrize(
+    "cns", [0, 700000000000000, 700000000000002, 700000000000006, 898000000000001, 2**64 - 1]
+)
+@pytest.mark.run(order=1)
+def test_cns_index_misses(index_path: str, index: CnsIndex, cns: int):
+    write_cns_index(index_path, RECORDS)
+
+    assert index.lookup(cns) is None
+
+
+@pytest.mark.run(order=1)
+def test_cns_index_without_file(index: CnsIndex):
+    assert index.lookup(700000000000001) is None
+
+
+@pytest.mark.run(order=1)
+def test_cns_index_reopens_rewritten_file(index_path: str, index: CnsIndex):
+    write_cns_index(index_path, RECORDS)
+    assert index.lookup(700000000000005) == "74663240020"
+
+    write_cns_index(index_path, [(700000000000003, 38965996074), (700000000000005, 11144477735)])
+
+    assert index.lookup(700000000000001) is None
+    assert index.lookup(700000000000003) == "38965996074"
+    assert index.lookup(700000000000005) == "11144477735"
+
+
+@pytest.mark.run(order=1)
+def test_cns_index_keeps_first_repeated_cns(index_path: str, index: CnsIndex):
+    records = [(700000000000001, 38965996074), (700000000000001, 74663240020)]
+
+    assert write_cns_index(index_path, records) == 1
+    assert index.lookup(700000000000001) == "38965996074"
+
+
+@pytest.mark.run(order=1)
+def test_cns_index_rejects_unsorted_records(index_path: str, index: CnsIndex):
+    write_cns_index(index_path, RECORDS)
+
+    with pytest.raises(ValueError):
+        write_cns_index(index_path, list(reversed(RECORDS)))
+
+    # The previous file is kept, without a temporary file left behind
+    assert index.lookup(700000000000005) == "74663240020"
+    assert [path.name for path in Path(index_path).parent.iterdir()] == ["cns_index.bin"]
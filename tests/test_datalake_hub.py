@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+import httpx
+import jwt
+import pytest  # noqa
+
+import app.http_clients
+from app.config import DATALAKE_HUB_URL, DATALAKE_HUB_TOKEN_DEFAULT_TTL
+from app.datalake_hub import HubTokenError, HubTokenManager, _token_lifetime
+
+UPLOAD_URL = f"{DATALAKE_HUB_URL}upload"
+
+
+@pytest.mark.parametrize(
+    "response_json, expected",
+    [
+        ({"expires_in": 3600}, 3600),
+        ({"token_expire_minutes": 30}, 1800),
+        ({}, DATALAKE_HUB_TOKEN_DEFAULT_TTL),
+    ],
+)
+@pytest.mark.run(order=1)
+def test_token_lifetime(response_json: dict, expected: float):
+    assert _token_lifetime(response_json, "not a jwt") == expected
+
+
+@pytest.mark.run(order=1)
+def test_token_lifetime_from_jwt():
+    token = jwt.encode({"exp": int(time.time()) + 600}, "secret", algorithm="HS256")
+
+    assert 590 < _token_lifetime({}, token) <= 600
+
+
+@pytest.fixture
+def hub(monkeypatch: pytest.MonkeyPatch):
+    hub = {"grants": 0, "requests": [], "rejected_tokens": set(), "status_code": 200}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/auth/token"):
+            hub["grants"] += 1
+            # Concurrent token requests overlap while the hub answers
+            await asyncio.sleep(0.01)
+            if hub["status_code"] != 200:
+                return httpx.Response(hub["status_code"], text="invalid credentials")
+            return httpx.Response(
+                200, json={"access_token": f"token-{hub['grants']}", "expires_in": 3600}
+            )
+
+        token = request.headers["Authorization"].removeprefix("Bearer ")
+        hub["requests"].append(token)
+        if token in hub["rejected_tokens"]:
+            return httpx.Response(401)
+        return httpx.Response(200)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setitem(app.http_clients._http_clients, "datalake_hub", client)
+    yield hub
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_hub_token_is_shared(hub: dict):
+    manager = HubTokenManager(refresh_margin=60)
+
+    tokens = await asyncio.gather(*[manager.get_token() for _ in range(5)])
+    tokens.append(await manager.get_token())
+
+    assert tokens == ["token-1"] * 6
+    assert hub["grants"] == 1
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_hub_token_is_renewed_before_it_expires(hub: dict):
+    # The token is renewed as soon as it is within the margin of its expiry
+    manager = HubTokenManager(refresh_margin=3600)
+
+    assert await manager.get_token() == "token-1"
+    assert await manager.get_token() == "token-2"
+    assert hub["grants"] == 2
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_hub_token_errors(hub: dict):
+    hub["status_code"] = 401
+    manager = HubTokenManager(refresh_margin=60)
+
+    with pytest.raises(HubTokenError) as error:
+        await manager.get_token()
+    assert error.value.status_code == 401
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_hub_request_retries_once_after_401(hub: dict):
+    manager = HubTokenManager(refresh_margin=60)
+    await manager.get_token()
+    # The hub revoked the kept token
+    hub["rejected_tokens"].add("token-1")
+
+    response = await manager.request("POST", UPLOAD_URL)
+
+    assert response.status_code == 200
+    assert hub["requests"] == ["token-1", "token-2"]
+    assert await manager.get_token() == "token-2"
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_hub_request_returns_second_401(hub: dict):
+    manager = HubTokenManager(refresh_margin=60)
+    hub["rejected_tokens"].update({"token-1", "token-2"})
+
+    response = await manager.request("POST", UPLOAD_URL)
+
+    assert response.status_code == 401
+    assert hub["requests"] == ["token-1", "token-2"]
+    assert hub["grants"] == 2
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import pytest  # noqa
+from fastapi import HTTPException
+
+from app import config
+from app.auth.utils import create_access_token
+from app.dependencies import (
+    assert_user_is_active,
+    clear_authenticated_users,
+    get_authenticated_user,
+    get_current_user,
+)
+from app.models import User
+from app.types import TokenData
+
+
+@pytest.fixture
+async def user_token(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(config, "USER_CACHE_TTL", 60)
+    clear_authenticated_users()
+    user = await User.get(username="frontend")
+    yield create_access_token(data={"sub": TokenData(**dict(user)).json()})
+    clear_authenticated_users()
+    user.is_active = True
+    await user.save()
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_current_user_is_cached(user_token: str):
+    user = await get_current_user(user_token)
+
+    assert get_authenticated_user(user_token) is user
+    assert await get_current_user(user_token) is user
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_deactivated_user_is_forgotten(user_token: str):
+    await get_current_user(user_token)
+
+    user = await User.get(username="frontend")
+    user.is_active = False
+    await user.save()
+
+    assert get_authenticated_user(user_token) is None
+    with pytest.raises(HTTPException) as error:
+        await assert_user_is_active(await get_current_user(user_token))
+    assert error.value.status_code == 400
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+import uuid
+
+import pytest  # noqa
+
+from app.executor import (
+    BoundedExecutor,
+    ExecutorSaturatedError,
+    executor_active_jobs,
+    executor_queue_wait_seconds,
+    executor_queued_jobs,
+    executor_rejections,
+)
+
+
+@pytest.fixture
+async def executor():
+    bounded_executor = BoundedExecutor(
+        name=f"test-{uuid.uuid4()}", max_workers=1, max_queue_depth=1
+    )
+    yield bounded_executor
+    await bounded_executor.shutdown()
+
+
+async def wait_until(condition, timeout: float = 5) -> None:
+    async def wait():
+        while not condition():
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(wait(), timeout)
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_executor_rejects_calls_when_saturated(executor: BoundedExecutor):
+    name = executor.name
+    release = threading.Event()
+
+    def blocking_call():
+        release.wait(5)
+        return name
+
+    running = asyncio.ensure_future(executor.run(blocking_call))
+    await wait_until(lambda: executor_active_jobs.get(executor=name) == 1)
+    queued = asyncio.ensure_future(executor.run(blocking_call))
+    await wait_until(lambda: executor_queued_jobs.get(executor=name) == 1)
+
+    # The only thread is busy and the queue is full
+    with pytest.raises(ExecutorSaturatedError) as error:
+        await executor.run(blocking_call)
+    assert error.value.status_code == 503
+    assert error.value.headers == {"Retry-After": "1"}
+    assert executor_rejections.get(executor=name) == 1
+
+    # Calls that continue accepted work still queue
+    continued = asyncio.ensure_future(executor.run(blocking_call, reject_when_saturated=False))
+    await wait_until(lambda: executor_queued_jobs.get(executor=name) == 2)
+    assert executor_active_jobs.get(executor=name) == 1
+
+    release.set()
+    assert await asyncio.gather(running, queued, continued) == [name, name, name]
+    assert executor_active_jobs.get(executor=name) == 0
+    assert executor_queued_jobs.get(executor=name) == 0
+    assert executor_queue_wait_seconds.get(executor=name)["count"] == 3
+    assert executor_rejections.get(executor=name) == 1
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_executor_measures_queue_wait(executor: BoundedExecutor):
+    name = executor.name
+    release = threading.Event()
+
+    running = asyncio.ensure_future(executor.run(release.wait, 5))
+    await wait_until(lambda: executor_active_jobs.get(executor=name) == 1)
+    queued = asyncio.ensure_future(executor.run(lambda: None))
+    await asyncio.sleep(0.2)
+    release.set()
+    await asyncio.gather(running, queued)
+
+    # The second call waited for the first one to release the thread
+    wait_seconds = executor_queue_wait_seconds.get(executor=name)
+    assert wait_seconds["count"] == 2
+    assert wait_seconds["sum"] >= 0.2
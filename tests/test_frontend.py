@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import datetime
+
 from httpx import AsyncClient  # noqa
 import pytest  # noqa
 import sys
@@ -77,3 +79,251 @@ async def test_patientencounters(
     )
 
     assert response.status_code == 200
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_patientbundle(
+    client: AsyncClient,
+    token_frontend: str,
+    patient_cpf_with_data: str,
+):
+    response = await client.get(
+        f"/frontend/patient/bundle/{patient_cpf_with_data}",
+        headers={"Authorization": f"Bearer {token_frontend}"}
+    )
+
+    assert response.status_code == 200
+    assert set(response.json().keys()) == {"header", "summary", "encounters"}
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_patientheaders(
+    client: AsyncClient,
+    token_frontend: str,
+    patient_cpf_with_data: str,
+):
+    response = await client.post(
+        "/frontend/patient/headers",
+        headers={"Authorization": f"Bearer {token_frontend}"},
+        json={"cpfs": [patient_cpf_with_data]},
+    )
+
+    assert response.status_code == 200
+    assert response.json()[patient_cpf_with_data]["status"] == 200
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_patientheader_fields(
+    client: AsyncClient,
+    token_frontend: str,
+    patient_cpf_with_data: str,
+):
+    response = await client.get(
+        f"/frontend/patient/header/{patient_cpf_with_data}",
+        headers={"Authorization": f"Bearer {token_frontend}"},
+        params={"fields": ["registration_name", "family_clinic"]},
+    )
+
+    assert response.status_code == 200
+    assert set(response.json().keys()) == {"registration_name", "family_clinic"}
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_patientencounters_reads_materialized_rows(
+    client: AsyncClient,
+    token_frontend: str,
+    patient_cpf_with_data: str,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    import app.cache
+    from app.config import BIGQUERY_PATIENT_ENCOUNTERS_TABLE_ID
+
+    materialized_reads = []
+
+    async def get_materialized_rows(table_id: str, cpf: str):
+        materialized_reads.append((table_id, cpf))
+        return None
+
+    async def get_cached_rows(key: str):
+        return None
+
+    monkeypatch.setattr(app.cache, "MATERIALIZATION_ENABLE", True)
+    monkeypatch.setattr(app.cache, "get_materialized_rows", get_materialized_rows)
+    monkeypatch.setattr(app.cache, "get_cached_rows", get_cached_rows)
+
+    response = await client.get(
+        f"/frontend/patient/encounters/{patient_cpf_with_data}",
+        headers={"Authorization": f"Bearer {token_frontend}"}
+    )
+
+    assert response.status_code == 200
+    assert materialized_reads == [(BIGQUERY_PATIENT_ENCOUNTERS_TABLE_ID, patient_cpf_with_data)]
+
+
+ENCOUNTER_TIMES = [
+    "2024-01-05T10:00:00",
+    "2024-01-04T10:00:00",
+    "2024-01-04T10:00:00",
+    "2024-01-04T10:00:00",
+    "2024-01-01T10:00:00",
+]
+
+
+def build_encounter(index: int, entry_datetime: str) -> dict:
+    return {
+        "entry_datetime": entry_datetime,
+        "exit_datetime": None,
+        "location": f"location {index}",
+        "type": "type",
+        "deceased": None,
+        "subtype": None,
+        "cids": [],
+        "cids_summarized": [],
+        "responsible": None,
+        "clinical_motivation": None,
+        "clinical_outcome": None,
+        "clinical_exams": [],
+        "procedures": None,
+        "measures": {},
+        "filter_tags": [],
+        "prescription": None,
+        "medicines_administered": None,
+        "provider": None,
+        "page_order": index,
+    }
+
+
+@pytest.mark.parametrize(
+    "cursor, expected",
+    [
+        ("2024-01-04T10:00:00~2", (datetime.datetime(2024, 1, 4, 10), 2)),
+        ("2024-01-04 10:00:00~0", (datetime.datetime(2024, 1, 4, 10), 0)),
+        ("2024-01-04T10:00:00", (datetime.datetime(2024, 1, 4, 10), None)),
+    ],
+)
+@pytest.mark.run(order=1)
+def test_parse_encounters_cursor(cursor: str, expected: tuple):
+    from app.routers.frontend import parse_encounters_cursor
+
+    assert parse_encounters_cursor(cursor) == expected
+
+
+@pytest.mark.parametrize(
+    "cursor", ["", "yesterday", "2024-01-04T10:00:00~", "2024-01-04T10:00:00~-1", "~2"]
+)
+@pytest.mark.run(order=1)
+def test_parse_encounters_cursor_malformed(cursor: str):
+    from app.routers.frontend import parse_encounters_cursor
+
+    with pytest.raises(ValueError):
+        parse_encounters_cursor(cursor)
+
+
+@pytest.mark.run(order=1)
+def test_next_encounters_cursor_ties():
+    from app.routers.frontend import next_encounters_cursor
+
+    encounters = [build_encounter(index, value) for index, value in enumerate(ENCOUNTER_TIMES)]
+
+    # The page ends with two of the three encounters at the same time
+    assert next_encounters_cursor(encounters[:3], None) == "2024-01-04T10:00:00~2"
+    # A page made only of encounters at the cursor's time adds to its count
+    assert (
+        next_encounters_cursor(encounters[3:4], "2024-01-04T10:00:00~2")
+        == "2024-01-04T10:00:00~3"
+    )
+    assert next_encounters_cursor(encounters[3:5], "2024-01-04T10:00:00~2") == (
+        "2024-01-01T10:00:00~1"
+    )
+
+
+@pytest.fixture
+def stored_encounters(monkeypatch: pytest.MonkeyPatch):
+    import app.routers.frontend
+
+    encounters = [build_encounter(index, value) for index, value in enumerate(ENCOUNTER_TIMES)]
+
+    async def read_patient_data_cached(user, cpf, query_name, limit, cursor, cursor_skip, **params):
+        rows = [
+            row
+            for row in encounters
+            if cursor is None
+            or datetime.datetime.fromisoformat(row["entry_datetime"]) < cursor
+            or (
+                cursor_skip is not None
+                and datetime.datetime.fromisoformat(row["entry_datetime"]) == cursor
+            )
+        ]
+        return True, None, rows[:limit]
+
+    monkeypatch.setattr(app.routers.frontend, "read_patient_data_cached", read_patient_data_cached)
+    yield encounters
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_patientencounters_pages(
+    client: AsyncClient,
+    token_frontend: str,
+    patient_cpf: str,
+    stored_encounters: list,
+):
+    locations, cursors, cursor = [], [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = await client.get(
+            f"/frontend/patient/encounters/{patient_cpf}",
+            headers={"Authorization": f"Bearer {token_frontend}"},
+            params=params,
+        )
+        assert response.status_code == 200
+        locations += [encounter["location"] for encounter in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        cursors.append(cursor)
+
+    # Encounters at the same time are split across pages without repeats or gaps, and
+    # the last page has no next cursor
+    assert locations == [encounter["location"] for encounter in stored_encounters]
+    assert cursors == ["2024-01-04T10:00:00~1", "2024-01-04T10:00:00~3"]
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_patientencounters_last_page(
+    client: AsyncClient,
+    token_frontend: str,
+    patient_cpf: str,
+    stored_encounters: list,
+):
+    response = await client.get(
+        f"/frontend/patient/encounters/{patient_cpf}",
+        headers={"Authorization": f"Bearer {token_frontend}"},
+        params={"limit": len(stored_encounters)},
+    )
+
+    assert response.status_code == 200
+    assert len(response.json()) == len(stored_encounters)
+    assert "X-Next-Cursor" not in response.headers
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_patientencounters_malformed_cursor(
+    client: AsyncClient,
+    token_frontend: str,
+    patient_cpf: str,
+    stored_encounters: list,
+):
+    response = await client.get(
+        f"/frontend/patient/encounters/{patient_cpf}",
+        headers={"Authorization": f"Bearer {token_frontend}"},
+        params={"cursor": "2024-01-04T10:00:00~x"},
+    )
+
+    assert response.status_code == 400
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import json
+
+import httpx
+import pytest  # noqa
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+
+import app.http_clients
+from app.auth.utils.jwks import JwksCache, cache_max_age
+
+JWKS_URL = "https://sso.test/jwk"
+
+
+def build_jwk(key_id: str) -> dict:
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return {**json.loads(RSAAlgorithm.to_jwk(private_key.public_key())), "kid": key_id}
+
+
+@pytest.mark.parametrize(
+    "headers, expected",
+    [
+        ({"cache-control": "public, max-age=300"}, 300),
+        ({"cache-control": 'max-age="300"'}, 300),
+        ({"cache-control": "max-age=300", "age": "100"}, 200),
+        ({"cache-control": "max-age=300", "age": "400"}, 0),
+        ({"cache-control": "max-age=soon"}, 60),
+        ({"cache-control": "no-cache"}, 0),
+        ({"cache-control": "no-store, max-age=300"}, 0),
+        (
+            {
+                "date": "Wed, 21 Oct 2026 07:28:00 GMT",
+                "expires": "Wed, 21 Oct 2026 07:38:00 GMT",
+            },
+            600,
+        ),
+        ({"cache-control": "public", "expires": "0"}, 0),
+        ({}, 60),
+    ],
+)
+@pytest.mark.run(order=1)
+def test_cache_max_age(headers: dict, expected: float):
+    assert cache_max_age(httpx.Headers(headers), default=60) == expected
+
+
+@pytest.fixture
+def jwks_server(monkeypatch: pytest.MonkeyPatch):
+    server = {"keys": [build_jwk("first")], "fetches": 0, "cache_control": "max-age=300"}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        server["fetches"] += 1
+        return httpx.Response(
+            200,
+            json={"keys": server["keys"]},
+            headers={"cache-control": server["cache_control"]},
+        )
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setitem(app.http_clients._http_clients, "govbr", client)
+    yield server
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_jwks_cache_keeps_keys(jwks_server: dict):
+    jwks = JwksCache(JWKS_URL, "govbr", min_refresh_interval=30)
+
+    assert await jwks.get_key("first") is not None
+    assert await jwks.get_key("first") is not None
+    assert jwks_server["fetches"] == 1
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_jwks_cache_refetches_expired_keys(jwks_server: dict):
+    jwks_server["cache_control"] = "no-cache"
+    jwks = JwksCache(JWKS_URL, "govbr", min_refresh_interval=0)
+
+    await jwks.get_key("first")
+    await jwks.get_key("first")
+
+    assert jwks_server["fetches"] == 2
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_jwks_cache_refetches_for_rotated_keys(jwks_server: dict):
+    jwks = JwksCache(JWKS_URL, "govbr", min_refresh_interval=30)
+    await jwks.get_key("first")
+
+    # The provider rotated its keys after the set was fetched
+    jwks_server["keys"] = [build_jwk("second")]
+    assert await jwks.get_key("second") is not None
+    assert jwks_server["fetches"] == 2
+
+    # Unknown key IDs don't fetch the set again within the minimum interval
+    assert await jwks.get_key("third") is None
+    assert await jwks.get_key("fourth") is None
+    assert jwks_server["fetches"] == 2
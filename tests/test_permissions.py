@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import pytest  # noqa
+
+import app.cache
+from app.cache import validate_user_access_cached
+from app.enums import AccessErrorEnum
+from app.models import User
+from app.queries import user_has_permission
+
+PATIENT = {
+    "cpf": "38965996074",
+    "data_is_displayable": True,
+    "data_display_reasons": [],
+    "unidades_cadastro": ["2269376"],
+    "ap_cadastro": ["51"],
+}
+
+
+def build_user(access_level, cpf="11144477735", cnes="0000000", ap="10") -> User:
+    return User(username="permissions", access_level=access_level, cpf=cpf, cnes=cnes, ap=ap)
+
+
+# The "only_from_same_ap" level checks the user's CNES and "only_from_same_cnes" checks
+# the user's AP, as the BigQuery condition always did
+@pytest.mark.parametrize(
+    "user, expected",
+    [
+        (build_user("full_permission"), True),
+        (build_user("only_from_same_cpf", cpf="38965996074"), True),
+        (build_user("only_from_same_cpf"), False),
+        (build_user("only_from_same_ap", cnes="2269376"), True),
+        (build_user("only_from_same_ap", ap="51"), False),
+        (build_user("only_from_same_cnes", ap="51"), True),
+        (build_user("only_from_same_cnes", cnes="2269376"), False),
+        (build_user(None, cpf="38965996074", cnes="2269376", ap="51"), False),
+    ],
+)
+@pytest.mark.run(order=1)
+def test_user_has_permission(user: User, expected: bool):
+    assert user_has_permission(user, PATIENT) is expected
+
+
+@pytest.mark.run(order=1)
+def test_user_has_permission_without_registrations():
+    patient = {**PATIENT, "unidades_cadastro": None, "ap_cadastro": None}
+
+    assert not user_has_permission(build_user("only_from_same_ap", cnes="2269376"), patient)
+    assert not user_has_permission(build_user("only_from_same_cnes", ap="51"), patient)
+
+
+@pytest.fixture
+def exibicao_rows(monkeypatch: pytest.MonkeyPatch):
+    rows = [PATIENT]
+    queries = []
+
+    async def run_query(query_name: str, cpf: str):
+        queries.append((query_name, cpf))
+        return rows
+
+    monkeypatch.setattr(app.cache, "_cache_connection", None)
+    monkeypatch.setattr(app.cache, "run_query", run_query)
+    yield rows, queries
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_validate_user_access_cached_granted(exibicao_rows):
+    rows, queries = exibicao_rows
+    has_access, response = await validate_user_access_cached(
+        build_user("full_permission"), "38965996074"
+    )
+
+    assert has_access and response is None
+    assert queries == [("patient_exibicao", "38965996074")]
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_validate_user_access_cached_denied(exibicao_rows):
+    has_access, response = await validate_user_access_cached(
+        build_user("only_from_same_cpf"), "38965996074"
+    )
+
+    assert not has_access
+    assert response.status_code == 403
+    assert AccessErrorEnum.PERMISSION_DENIED.value in response.body.decode()
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_validate_user_access_cached_not_displayable(exibicao_rows):
+    rows, _ = exibicao_rows
+    rows[:] = [{**PATIENT, "data_is_displayable": False, "data_display_reasons": ["obito"]}]
+    has_access, response = await validate_user_access_cached(
+        build_user("full_permission"), "38965996074"
+    )
+
+    assert not has_access
+    assert response.status_code == 403
+    assert AccessErrorEnum.DATA_RESTRICTED.value in response.body.decode()
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_validate_user_access_cached_not_found(exibicao_rows):
+    rows, _ = exibicao_rows
+    rows[:] = []
+    has_access, response = await validate_user_access_cached(
+        build_user("full_permission"), "38965996074"
+    )
+
+    assert not has_access
+    assert response.status_code == 404
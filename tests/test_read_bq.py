@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+
+import pytest  # noqa
+
+import app.utils
+from app.utils import read_bq
+
+QUERY = "SELECT @cpf AS cpf"
+
+
+class StubClient:
+    """
+    Answers every query with the same rows once `release` is set, counting the jobs run.
+    """
+
+    def __init__(self, error: Exception | None = None):
+        self.error = error
+        self.jobs = 0
+        self.release = threading.Event()
+
+    def query_and_wait(self, query, job_config):
+        self.jobs += 1
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return [{"cpf": "38965996074", "payload": {"tags": ["UPA"]}}]
+
+
+@pytest.fixture
+def stub_client(monkeypatch: pytest.MonkeyPatch):
+    client = StubClient()
+    monkeypatch.setattr(app.utils, "_bigquery_client", client)
+    yield client
+    client.release.set()
+
+
+async def read_concurrently(client: StubClient, calls: int) -> list:
+    reads = [asyncio.ensure_future(read_bq(QUERY)) for _ in range(calls)]
+    # Every call joins the first job before BigQuery answers
+    while len(app.utils._inflight_queries) == 0 or client.jobs == 0:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.05)
+    client.release.set()
+    return await asyncio.gather(*reads, return_exceptions=True)
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_read_bq_shares_concurrent_jobs(stub_client: StubClient):
+    results = await read_concurrently(stub_client, 5)
+
+    assert stub_client.jobs == 1
+    assert all(rows == [{"cpf": "38965996074", "payload": {"tags": ["UPA"]}}] for rows in results)
+    assert app.utils._inflight_queries == {}
+    assert app.utils._inflight_callers == {}
+
+    # Callers don't see each other's changes, even to nested values
+    results[0][0]["payload"]["tags"].append("CF")
+    assert all(rows[0]["payload"]["tags"] == ["UPA"] for rows in results[1:])
+    assert len({id(rows[0]["payload"]) for rows in results}) == 5
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_read_bq_shares_errors(stub_client: StubClient):
+    stub_client.error = ValueError("query failed")
+
+    results = await read_concurrently(stub_client, 3)
+
+    assert stub_client.jobs == 1
+    assert all(isinstance(result, ValueError) for result in results)
+    assert app.utils._inflight_queries == {}
+    assert app.utils._inflight_callers == {}
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_read_bq_runs_new_job_after_the_first_one(stub_client: StubClient):
+    stub_client.release.set()
+
+    first = await read_bq(QUERY)
+    second = await read_bq(QUERY)
+
+    assert stub_client.jobs == 2
+    assert first == second and first is not second
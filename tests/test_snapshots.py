@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest  # noqa
+
+import app.snapshots
+from app.snapshots import TableSnapshot
+
+SNAPSHOT_ROW = {"cpf_particao": 38965996074, "source": "snapshot"}
+FALLBACK_ROW = {"cpf_particao": 38965996074, "source": "bigquery"}
+
+
+@pytest.fixture
+def snapshot(monkeypatch: pytest.MonkeyPatch):
+    fallback_queries = []
+    page_sizes = []
+
+    async def stream_query(query_name: str, page_size: int):
+        page_sizes.append(page_size)
+        yield [SNAPSHOT_ROW]
+
+    async def run_query(query_name: str, cpf: str):
+        fallback_queries.append((query_name, cpf))
+        return [FALLBACK_ROW]
+
+    monkeypatch.setattr(app.snapshots, "SNAPSHOT_ENABLE", True)
+    monkeypatch.setattr(app.snapshots, "REGISTERED_SNAPSHOTS", [])
+    monkeypatch.setattr(app.snapshots, "stream_query", stream_query)
+    monkeypatch.setattr(app.snapshots, "run_query", run_query)
+
+    table_snapshot = TableSnapshot(
+        "test", "test_all", "test_by_cpf", refresh_interval=60, max_age=120, page_size=5000
+    )
+    table_snapshot.fallback_queries = fallback_queries
+    table_snapshot.page_sizes = page_sizes
+    yield table_snapshot
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_snapshot_hit(snapshot: TableSnapshot):
+    await snapshot.refresh()
+
+    assert await snapshot.get_rows("38965996074") == [SNAPSHOT_ROW]
+    assert snapshot.fallback_queries == []
+    assert snapshot.page_sizes == [5000]
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_snapshot_miss(snapshot: TableSnapshot):
+    await snapshot.refresh()
+
+    assert await snapshot.get_rows("11144477735") == [FALLBACK_ROW]
+    assert snapshot.fallback_queries == [("test_by_cpf", "11144477735")]
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_snapshot_stale(snapshot: TableSnapshot):
+    await snapshot.refresh()
+    # The last sync is older than `max_age`, so rows removed since then are not returned
+    snapshot._synced_at = time.time() - snapshot.max_age - 1
+
+    assert await snapshot.get_rows("38965996074") == [FALLBACK_ROW]
+    assert snapshot.fallback_queries == [("test_by_cpf", "38965996074")]
+
+
+@pytest.mark.anyio
+@pytest.mark.run(order=1)
+async def test_snapshot_never_synced(snapshot: TableSnapshot):
+    assert await snapshot.get_rows("38965996074") == [FALLBACK_ROW]
+    assert snapshot.fallback_queries == [("test_by_cpf", "38965996074")]